@@ -0,0 +1,579 @@
+#!/usr/bin/env python3
+"""Load test the HTTP server end to end with stand-ins for mpv and yt-dlp
+
+Concurrent clients load the page, run actions, add links, and fetch thumbnails, static files,
+queue ranges and the state API. Latency and throughput of each route is reported, and can be
+saved as JSON to compare between commits.
+"""
+
+import argparse
+import json
+import os
+import platform
+import queue
+import random
+import socket
+import subprocess
+import tempfile
+import threading
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import asdict, dataclass, field
+from functools import partial
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from itertools import count
+from time import perf_counter, sleep, time
+
+import friends_queue
+from friends_queue.async_server import AsyncHTTPThread
+from friends_queue.event_stream import EventStream
+from friends_queue.fetch_scheduler import FetchScheduler
+from friends_queue.friends_queue import HTTPThread, handle_get, http_handler
+from friends_queue.live_updates import publish_player_events, publish_queue_events
+from friends_queue.player_state import PlayerStateSnapshot
+from friends_queue.static_files import StaticFiles
+from friends_queue.thumbnail_cache import ThumbnailCache
+from friends_queue.types import Config, State
+from friends_queue.video_queue import VideoQueue
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Relative weight of each kind of request clients make, see ROUTE_PATHS
+ROUTE_WEIGHTS = {
+    "page": 20,
+    "action": 10,
+    "link": 5,
+    "thumbnail": 30,
+    "static": 15,
+    "queue": 10,
+    "api": 10,
+}
+ACTIONS = ("pause", "resume", "volume_up", "volume_down", "seek_forward")
+
+
+class FakeMPV:
+    """Stand-in for mpv.MPV, property reads, writes and commands wait for latency like a
+    round-trip to the mpv core, and observers are called from an event thread like mpv
+    """
+
+    def __init__(self, latency: float):
+        self._latency = latency
+        self._properties = {
+            "pause": False,
+            "volume": 50.0,
+            "playlist_pos": -1,
+            "playlist": [],
+            "media_title": None,
+            "time_pos": None,
+            "duration": None,
+        }
+        self._lock = threading.Lock()
+        self._observers: dict[str, list] = {}
+        self._events = queue.Queue()
+        threading.Thread(target=self._event_loop, daemon=True).start()
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        sleep(self._latency)
+        with self._lock:
+            value = self._properties.get(name)
+        return list(value) if isinstance(value, list) else value
+
+    def __setattr__(self, name: str, value):
+        if name.startswith("_"):
+            super().__setattr__(name, value)
+            return
+        sleep(self._latency)
+        with self._lock:
+            self._set(name, value)
+
+    def observe_property(self, name: str, handler):
+        """Call handler with (name, value) whenever the property changes"""
+        self._observers.setdefault(name.replace("-", "_"), []).append(handler)
+
+    def loadfile(self, filename: str, mode: str = "replace", **_options):
+        """Append to the playlist"""
+        assert mode.startswith("append")
+        sleep(self._latency)
+        with self._lock:
+            playlist = self._properties["playlist"] + [{"filename": filename}]
+            self._set("playlist", playlist)
+            if self._properties["playlist_pos"] < 0:
+                self._set("playlist_pos", 0)
+
+    def playlist_move(self, index1: int, index2: int):
+        """Move entry at index1 to before the entry at index2"""
+        sleep(self._latency)
+        with self._lock:
+            playlist = list(self._properties["playlist"])
+            if not 0 <= index1 < len(playlist):
+                raise SystemError("Error running mpv command")
+            playlist.insert(index2, playlist[index1])
+            playlist.pop(index1 + 1 if index2 < index1 else index1)
+            self._set("playlist", playlist)
+
+    def playlist_remove(self, index: int):
+        """Remove the entry at index"""
+        sleep(self._latency)
+        with self._lock:
+            playlist = list(self._properties["playlist"])
+            playlist.pop(index)
+            self._set("playlist", playlist)
+
+    def playlist_next(self, _mode: str = "weak"):
+        """Skip to the next entry"""
+        self._step(1)
+
+    def playlist_prev(self, _mode: str = "weak"):
+        """Go back to the previous entry"""
+        self._step(-1)
+
+    def seek(self, amount, _reference: str = "relative"):
+        """Seek, the position only moves forward as there is nothing playing"""
+        sleep(self._latency)
+        with self._lock:
+            self._set("time_pos", (self._properties["time_pos"] or 0) + float(amount))
+
+    def quit(self, _code: int = 0):
+        """Ignored so clients can't stop the benchmark"""
+
+    def _step(self, direction: int):
+        sleep(self._latency)
+        with self._lock:
+            length = len(self._properties["playlist"])
+            pos = self._properties["playlist_pos"] + direction
+            if 0 <= pos < length:
+                self._set("playlist_pos", pos)
+                self._set("media_title", self._properties["playlist"][pos]["filename"])
+
+    def _set(self, name: str, value):
+        """Set a property and queue calling its observers, must hold lock"""
+        self._properties[name] = value
+        if name in self._observers:
+            value = list(value) if isinstance(value, list) else value
+            self._events.put((name, value))
+
+    def _event_loop(self):
+        while True:
+            name, value = self._events.get()
+            for observer in self._observers[name]:
+                observer(name.replace("_", "-"), value)
+
+
+# pylint: disable-next=too-few-public-methods
+class FakeYoutubeDL:
+    """Stand-in for yt_dlp.YoutubeDL returning generated info after a delay"""
+
+    def __init__(self, thumbnail_origin: str, delay: float, formats: int):
+        self.delay = delay
+        self._thumbnail_origin = thumbnail_origin
+        self._formats = formats
+
+    def extract_info(self, url: str, download: bool = False) -> dict:
+        """Get info of a video, the ID is the last part of the URL"""
+        assert not download
+        sleep(self.delay)
+        video_id = url.rsplit("=", 1)[-1]
+        formats = [
+            {
+                "format_id": str(i),
+                "url": "https://media.invalid/{}/{}?expire=0&sig={}".format(
+                    video_id, i, "0" * 200
+                ),
+                "ext": "mp4",
+                "width": 160 * (i % 8 + 1),
+                "height": 90 * (i % 8 + 1),
+                "tbr": 100.0 * i,
+                "video_ext": "mp4" if i % 2 == 0 else "none",
+                "audio_ext": "none" if i % 2 == 0 else "m4a",
+            }
+            for i in range(self._formats)
+        ]
+        return {
+            "id": video_id,
+            "extractor_key": "Generic",
+            "webpage_url": url,
+            "fulltitle": "Benchmark video {}".format(video_id),
+            "title": "Benchmark video {}".format(video_id),
+            "uploader": "Uploader {}".format(hash(video_id) % 17),
+            "duration": 60 + hash(video_id) % 3600,
+            "duration_string": "1:00",
+            "formats": formats,
+            "requested_formats": formats[-2:],
+            "thumbnails": [
+                {
+                    "url": "{}/{}/{}.jpg".format(self._thumbnail_origin, video_id, w),
+                    "width": w,
+                    "height": w * 9 // 16,
+                }
+                for w in (120, 320, 480, 1280)
+            ],
+        }
+
+
+def make_thumbnail(width: int) -> bytes:
+    """Make a JPEG thumbnail, when Pillow is missing the cache never decodes it"""
+    if Image is None:
+        return b"\xff\xd8\xff\xe0" + bytes(width * 64)
+    image = Image.effect_noise((width, width * 9 // 16), 64).convert("RGB")
+    buffer = BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def start_thumbnail_origin(image: bytes) -> ThreadingHTTPServer:
+    """Serve image at every path, in place of a video site's image server"""
+
+    class OriginHandler(BaseHTTPRequestHandler):
+        """Respond with the thumbnail"""
+
+        # pylint: disable-next=invalid-name
+        def do_GET(self):
+            """Send the image"""
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", len(image))
+            self.end_headers()
+            self.wfile.write(image)
+
+        def log_message(self, *_args):
+            """Don't log requests"""
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OriginHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@dataclass
+class RouteResult:
+    """Measured requests of a route, latencies are milliseconds"""
+
+    requests: int = 0
+    errors: int = 0
+    requests_per_second: float = 0
+    p50_ms: float = None
+    p99_ms: float = None
+    mean_ms: float = None
+    latencies: list[float] = field(default_factory=list, repr=False)
+
+    def finish(self, elapsed: float) -> dict:
+        """Calculate statistics, returns them without the latencies"""
+        latencies = sorted(self.latencies)
+        self.requests = len(latencies)
+        self.requests_per_second = round(self.requests / elapsed, 2)
+        if self.requests > 0:
+            self.p50_ms = round(percentile(latencies, 0.5), 3)
+            self.p99_ms = round(percentile(latencies, 0.99), 3)
+            self.mean_ms = round(sum(latencies) / self.requests, 3)
+        result = asdict(self)
+        del result["latencies"]
+        return result
+
+
+def percentile(latencies: list[float], fraction: float) -> float:
+    """Get the nearest rank percentile of sorted latencies"""
+    return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)]
+
+
+def make_state(args: argparse.Namespace, ytdl: FakeYoutubeDL, cache_dir: str) -> State:
+    """Make app state like main does, with the stand-ins for mpv and yt-dlp"""
+    config = Config(fetch_workers=args.fetch_workers, http_workers=args.http_workers)
+    player = FakeMPV(args.property_latency)
+    player_state = PlayerStateSnapshot()
+    player_state.observe(player)
+    for name in ("static", "thumbs"):
+        os.mkdir(os.path.join(cache_dir, name))
+    thumbnails = ThumbnailCache(os.path.join(cache_dir, "thumbs"))
+    video_queue = VideoQueue(
+        player, ytdl, thumbnails, FetchScheduler(config.fetch_workers)
+    )
+    events = EventStream()
+    publish_player_events(events, player_state)
+    publish_queue_events(events, video_queue, player_state)
+    static = StaticFiles(
+        os.path.dirname(friends_queue.__file__),
+        ["friends_queue.css", "friends_queue.js"],
+        os.path.join(cache_dir, "static"),
+    )
+    state = State(
+        config=config,
+        player=player,
+        player_state=player_state,
+        ytdl=ytdl,
+        static=static,
+        thumbnails=thumbnails,
+        queue=video_queue,
+        events=events,
+        close_condition=threading.Condition(),
+    )
+    state.ready.set()
+    return state
+
+
+def fill_queue(state: State, ytdl: FakeYoutubeDL, items: int, video_ids: count):
+    """Queue items without extraction delay and wait for their thumbnails"""
+    delay = ytdl.delay
+    ytdl.delay = 0
+    for _ in range(items):
+        state.queue.append_url(
+            "https://videos.invalid/watch?v={}".format(next(video_ids))
+        )
+    wait_for_fetches(state)
+    ytdl.delay = delay
+
+
+def wait_for_fetches(state: State):
+    """Wait until all queued links have been fetched, including their thumbnails"""
+    while True:
+        stats = state.queue.fetch_stats()
+        if stats.backlog == 0 and stats.busy == 0:
+            return
+        sleep(0.01)
+
+
+def free_port() -> int:
+    """Find a port to listen on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(server: str, state: State) -> (HTTPThread | AsyncHTTPThread, int):
+    """Start the HTTP server, returns it and the port it listens on"""
+    address = ("127.0.0.1", free_port())
+    if server == "asyncio":
+        http = AsyncHTTPThread(
+            address,
+            partial(handle_get, app=state),
+            state.events,
+            state.config.http_workers,
+        )
+    else:
+        http = HTTPThread(address, http_handler(state))
+    http.daemon = True
+    http.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(address).close()
+            break
+        except ConnectionRefusedError:
+            sleep(0.01)
+    return http, address[1]
+
+
+def _thumbnail_path(rand: random.Random, state: State, _video_ids: count) -> str:
+    thumbnails = [item.thumbnail for item in state.queue if item.thumbnail]
+    if len(thumbnails) == 0:
+        return "/"
+    # Relative to the page
+    return rand.choice(thumbnails)[1:]
+
+
+def _static_path(rand: random.Random, state: State, _video_ids: count) -> str:
+    return state.static.url(rand.choice(("friends_queue.css", "friends_queue.js")))[1:]
+
+
+# Make a path to request for each route, from (random, state, video IDs)
+ROUTE_PATHS = {
+    "page": lambda rand, state, video_ids: "/",
+    "action": lambda rand, state, video_ids: "/?a=" + rand.choice(ACTIONS),
+    "link": lambda rand, state, video_ids: (
+        "/?link=https%3A%2F%2Fvideos.invalid%2Fwatch%3Fv%3D{}".format(next(video_ids))
+    ),
+    "thumbnail": _thumbnail_path,
+    "static": _static_path,
+    "queue": lambda rand, state, video_ids: "/queue?start={}&count=50".format(
+        rand.randrange(max(len(state.queue), 1))
+    ),
+    "api": lambda rand, state, video_ids: "/api/state",
+}
+
+
+def run_client(port: int, state: State, deadline: float, results: dict, video_ids):
+    """Make requests until the deadline, recording latencies in results"""
+    rand = random.Random()
+    routes = list(ROUTE_WEIGHTS)
+    weights = list(ROUTE_WEIGHTS.values())
+    while perf_counter() < deadline:
+        route = rand.choices(routes, weights)[0]
+        path = ROUTE_PATHS[route](rand, state, video_ids)
+        connection = HTTPConnection("127.0.0.1", port, timeout=30)
+        start = perf_counter()
+        try:
+            connection.request("GET", path, headers={"Accept-Encoding": "gzip"})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except OSError:
+            ok = False
+        finally:
+            connection.close()
+        result = results[route]
+        if ok:
+            result.latencies.append((perf_counter() - start) * 1000)
+        else:
+            result.errors += 1
+
+
+def run_clients(
+    args: argparse.Namespace, state: State, port: int, video_ids: count
+) -> (dict[str, RouteResult], float):
+    """Run clients for the duration, returns results of each route and seconds taken"""
+    results = {route: RouteResult() for route in ROUTE_WEIGHTS}
+    start = perf_counter()
+    clients = [
+        threading.Thread(
+            target=run_client,
+            args=(port, state, start + args.duration, results, video_ids),
+        )
+        for _ in range(args.clients)
+    ]
+    # Still write the server's request logs, just not to the terminal
+    with (
+        open(os.devnull, "w", encoding="utf-8") as devnull,
+        redirect_stdout(devnull),
+        redirect_stderr(devnull),
+    ):
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = perf_counter() - start
+        # Links added at the end would otherwise fetch after the cache is deleted
+        wait_for_fetches(state)
+    return results, elapsed
+
+
+def git_commit() -> str:
+    """Get the commit being benchmarked, None outside of a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(routes: dict[str, dict], baseline: dict = None):
+    """Print a table of route results, with the change from baseline if given"""
+    print(
+        "{:<10} {:>8} {:>7} {:>9} {:>9} {:>9}".format(
+            "route", "requests", "errors", "req/s", "p50 ms", "p99 ms"
+        )
+    )
+    for route, result in routes.items():
+        line = "{:<10} {:>8} {:>7} {:>9.1f} {:>9} {:>9}".format(
+            route,
+            result["requests"],
+            result["errors"],
+            result["requests_per_second"],
+            _format_ms(result["p50_ms"]),
+            _format_ms(result["p99_ms"]),
+        )
+        before = (baseline or {}).get("routes", {}).get(route)
+        if before is not None:
+            line += "  p50 {} p99 {}".format(
+                _format_change(before["p50_ms"], result["p50_ms"]),
+                _format_change(before["p99_ms"], result["p99_ms"]),
+            )
+        print(line)
+
+
+def _format_ms(value: float) -> str:
+    return "-" if value is None else "{:.2f}".format(value)
+
+
+def _format_change(before: float, after: float) -> str:
+    if not before or after is None:
+        return "-"
+    return "{:+.0%}".format(after / before - 1)
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds")
+    parser.add_argument("--server", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--http-workers", type=int, default=8)
+    parser.add_argument("--fetch-workers", type=int, default=3)
+    parser.add_argument("--items", type=int, default=100, help="Initial queue length")
+    parser.add_argument(
+        "--property-latency",
+        type=float,
+        default=0.0002,
+        help="Seconds for each mpv property read, write or command",
+    )
+    parser.add_argument(
+        "--extract-delay",
+        type=float,
+        default=0.5,
+        help="Seconds each yt-dlp extraction takes",
+    )
+    parser.add_argument(
+        "--formats", type=int, default=30, help="Formats in each extracted info"
+    )
+    parser.add_argument(
+        "--thumbnail-width", type=int, default=480, help="Width of served thumbnails"
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Show changes from results in this JSON file")
+    return parser.parse_args()
+
+
+def main():
+    """Run load test"""
+    args = parse_args()
+    origin = start_thumbnail_origin(make_thumbnail(args.thumbnail_width))
+    ytdl = FakeYoutubeDL(
+        "http://127.0.0.1:{}".format(origin.server_address[1]),
+        args.extract_delay,
+        args.formats,
+    )
+    video_ids = count()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        state = make_state(args, ytdl, cache_dir)
+        fill_queue(state, ytdl, args.items, video_ids)
+        http, port = start_server(args.server, state)
+
+        results, elapsed = run_clients(args, state, port, video_ids)
+        http.shutdown()
+    origin.shutdown()
+    origin.server_close()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time(),
+        "python": platform.python_version(),
+        "options": vars(args),
+        "queue_length": len(state.queue),
+        "routes": {route: result.finish(elapsed) for route, result in results.items()},
+    }
+    total = RouteResult(
+        latencies=[ms for result in results.values() for ms in result.latencies],
+        errors=sum(result.errors for result in results.values()),
+    )
+    report["routes"]["total"] = total.finish(elapsed)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        print("Compared with {}".format(baseline.get("commit")))
+    print_report(report["routes"], baseline)
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
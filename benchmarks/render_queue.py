@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Benchmark rendering the queue, with and without cached item fragments"""
+
+import argparse
+from functools import partial
+from io import BytesIO
+from timeit import repeat
+
+from friends_queue.generate import generate_page_queue
+from friends_queue.player_state import PlayerStateSnapshot
+from friends_queue.types import Config, RequestState, State
+from friends_queue.video_queue import VideoQueue, VideoQueueItem
+
+
+class FakePlayer:
+    """Just enough of mpv.MPV for VideoQueue.append"""
+
+    playlist_pos = 0
+
+    def loadfile(self, *_args, **_kwargs):
+        """Ignore loaded files"""
+
+    def observe_property(self, *_args):
+        """Ignore observers"""
+
+
+def make_state(items: int) -> State:
+    """Make app state with a queue of items that have all been fetched"""
+    queue = VideoQueue(FakePlayer(), None, None, None)
+    for i in range(items):
+        thumbnail = "./thumbnails/{:0128x}".format(i)
+        item = VideoQueueItem("https://www.youtube.com/watch?v={:011d}".format(i))
+        item.update(
+            title="Video number {} & something <long> to escape".format(i),
+            uploader="Uploader {}".format(i % 17),
+            duration=200 + i,
+            duration_str="3:{:02}".format(i % 60),
+            thumbnail=thumbnail,
+            thumbnail_srcset="{0}-96 96w, {0}-192 192w".format(thumbnail),
+            thumbnail_width=480,
+            thumbnail_height=360,
+        )
+        queue.append(item)
+    player_state = PlayerStateSnapshot(playlist_pos=0)
+    # Render every item rather than a window of them
+    config = Config(queue_window=items)
+    return State(config, None, player_state, None, None, None, queue, None, None)
+
+
+def render(state: State, cached: bool):
+    """Render the queue once, clearing cached fragments first if not cached"""
+    if not cached:
+        for item in state.queue:
+            item.fragment = None
+    generate_page_queue(BytesIO(), state, RequestState())
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--number", type=int, default=50)
+    args = parser.parse_args()
+
+    state = make_state(args.items)
+    for cached in (False, True):
+        render(state, True)
+        best = min(repeat(partial(render, state, cached), number=args.number, repeat=5))
+        print(
+            "{:>8} {:.3f}ms per render of {} items".format(
+                "cached" if cached else "uncached",
+                best / args.number * 1000,
+                args.items,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
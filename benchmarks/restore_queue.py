@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""Benchmark restoring the queue from its journal, as done on startup"""
+
+import argparse
+import tempfile
+from time import perf_counter
+
+from friends_queue.journal import QueueJournal
+from friends_queue.player_state import PlayerStateSnapshot
+from friends_queue.thumbnail_cache import ThumbnailCache
+from friends_queue.video_queue import VideoQueue, VideoQueueItem
+
+
+class FakePlayer:
+    """Just enough of mpv.MPV for VideoQueue.append, move and restore"""
+
+    playlist_pos = -1
+    pause = False
+
+    def loadfile(self, *_args, **_kwargs):
+        """Ignore loaded files"""
+
+    def playlist_move(self, *_args):
+        """Ignore moves"""
+
+    def observe_property(self, *_args):
+        """Ignore observers"""
+
+
+def write_journal(directory: str, items: int, compact_every: int):
+    """Journal a queue of items that have all been fetched, with some moves"""
+    queue = VideoQueue(FakePlayer(), None, None, None)
+    player_state = PlayerStateSnapshot()
+    journal = QueueJournal(directory, compact_every)
+    journal.record(queue, player_state)
+    for i in range(items):
+        item = VideoQueueItem("https://www.youtube.com/watch?v={:011d}".format(i))
+        item.update(
+            key="Youtube:{:011d}".format(i),
+            title="Video number {}".format(i),
+            uploader="Uploader {}".format(i % 17),
+            duration=200 + i,
+            duration_str="3:{:02}".format(i % 60),
+        )
+        queue.append(item)
+        queue.update_item(
+            item,
+            thumbnail_url="https://i.ytimg.com/vi/{:011d}/hqdefault.jpg".format(i),
+        )
+        if i % 10 == 9:
+            queue.move(i, i // 2)
+    journal.close()
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--compact-every", type=int, default=1000)
+    args = parser.parse_args()
+
+    with (
+        tempfile.TemporaryDirectory() as directory,
+        tempfile.TemporaryDirectory() as thumbs,
+    ):
+        write_journal(directory, args.items, args.compact_every)
+
+        start = perf_counter()
+        queue = VideoQueue(FakePlayer(), None, None, None)
+        QueueJournal(directory).restore(queue, ThumbnailCache(thumbs))
+        elapsed = perf_counter() - start
+
+    print(
+        "Restored {} items in {:.1f}ms ({:.1f}us per item)".format(
+            len(queue), elapsed * 1000, elapsed / max(len(queue), 1) * 1_000_000
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Benchmark startup of the whole app run from main.py: time until the server is listening,
+until requests are handled (the player is created, static files compressed and the queue
+restored) and until yt-dlp is loaded in the background"""
+
+import argparse
+import os.path
+import re
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from time import monotonic, sleep
+
+MAIN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py"
+)
+# Printed by friends_queue.startup, times are since the process started
+MILESTONE = re.compile(r"^Startup: (.+) after (\d+)ms$")
+TIMEOUT = 60
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _read_milestones(process: subprocess.Popen, milestones: dict[str, float]):
+    for line in process.stdout:
+        match = MILESTONE.match(line.strip())
+        if match is not None:
+            milestones[match.group(1)] = float(match.group(2))
+
+
+def _wait_until_handled(port: int, start: float) -> float:
+    """Poll the API, which waits until the app is ready, returns ms since start it answered"""
+    deadline = monotonic() + TIMEOUT
+    while monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(
+                "http://127.0.0.1:{}/api/state".format(port), timeout=TIMEOUT
+            ):
+                return (monotonic() - start) * 1000
+        except (urllib.error.URLError, ConnectionError):
+            sleep(0.01)
+    raise TimeoutError("App didn't start")
+
+
+def run_once(main_args: list[str]) -> dict:
+    """Start the app once, returns ms until each stage"""
+    port = _free_port()
+    milestones = {}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = monotonic()
+        with subprocess.Popen(
+            [sys.executable, "-u", MAIN, "--listen", "127.0.0.1", "--port", str(port)]
+            + ["--cache-dir", cache_dir]
+            + main_args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ) as process:
+            reader = threading.Thread(
+                target=_read_milestones, args=(process, milestones), daemon=True
+            )
+            reader.start()
+            try:
+                handled = _wait_until_handled(port, start)
+                deadline = monotonic() + TIMEOUT
+                while "yt-dlp ready" not in milestones and monotonic() < deadline:
+                    sleep(0.01)
+            finally:
+                process.send_signal(signal.SIGINT)
+                try:
+                    process.wait(10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+            reader.join(1)
+    return {
+        "listening_ms": milestones.get("listening"),
+        "handled_ms": handled,
+        "ytdl_ms": milestones.get("yt-dlp ready"),
+    }
+
+
+def main():
+    """Run benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "main_args",
+        nargs="*",
+        help="Arguments for main.py, after --, e.g. -- --player ipc",
+    )
+    args = parser.parse_args()
+
+    # The first run also compiles bytecode
+    run_once(args.main_args)
+    runs = [run_once(args.main_args) for _ in range(args.runs)]
+
+    def median(name: str) -> str:
+        times = [run[name] for run in runs if run[name] is not None]
+        return "{:.0f}ms".format(statistics.median(times)) if times else "never"
+
+    print(
+        "Listening after {}, handling requests after {}, yt-dlp ready after {} "
+        "(median of {} runs, from the process starting)".format(
+            median("listening_ms"), median("handled_ms"), median("ytdl_ms"), args.runs
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Stress test the video queue with concurrent appends, moves, renders and changes made directly
+to the mpv playlist, then check the queue still matches the playlist"""
+
+import argparse
+import queue
+import random
+import threading
+from io import BytesIO
+from time import perf_counter
+
+from friends_queue.generate import generate_page_queue
+from friends_queue.player_state import PlayerStateSnapshot
+from friends_queue.types import Config, RequestState, State
+from friends_queue.video_queue import VideoQueue, VideoQueueItem
+
+
+class FakePlayer:
+    """Playlist parts of mpv.MPV, property observers are called from an event thread like mpv"""
+
+    def __init__(self):
+        self.playlist_pos = 0
+        self._playlist: list[dict] = []
+        self._lock = threading.Lock()
+        self._observers = []
+        self._events = queue.Queue()
+        threading.Thread(target=self._event_loop, daemon=True).start()
+
+    @property
+    def playlist(self) -> list[dict]:
+        """Copy of the playlist"""
+        with self._lock:
+            return [dict(entry) for entry in self._playlist]
+
+    def observe_property(self, _name: str, handler):
+        """Observe the playlist"""
+        self._observers.append(handler)
+
+    def loadfile(self, filename: str, mode: str = "replace", **_options):
+        """Append to the playlist"""
+        assert mode.startswith("append")
+        with self._lock:
+            self._playlist.append({"filename": filename})
+            self._changed()
+
+    def playlist_move(self, index1: int, index2: int):
+        """Move entry at index1 to before the entry at index2"""
+        with self._lock:
+            if not 0 <= index1 < len(self._playlist):
+                # mpv fails the command
+                raise SystemError("Error running mpv command")
+            entry = self._playlist[index1]
+            self._playlist.insert(index2, entry)
+            self._playlist.pop(index1 + 1 if index2 < index1 else index1)
+            self._changed()
+
+    def playlist_remove(self, index: int):
+        """Remove the entry at index"""
+        with self._lock:
+            self._playlist.pop(index)
+            self._changed()
+
+    def wait_for_events(self):
+        """Wait until all observers have been called"""
+        self._events.join()
+
+    def _changed(self):
+        self._events.put([dict(entry) for entry in self._playlist])
+
+    def _event_loop(self):
+        while True:
+            value = self._events.get()
+            for observer in self._observers:
+                observer("playlist", value)
+            self._events.task_done()
+
+
+def run_workers(target, count: int, *args):
+    """Run count threads calling target and wait for them"""
+    threads = [threading.Thread(target=target, args=args) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def main():
+    """Run stress test"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--operations", type=int, default=200)
+    args = parser.parse_args()
+
+    player = FakePlayer()
+    video_queue = VideoQueue(player, None, None, None)
+    state = State(
+        Config(),
+        player,
+        PlayerStateSnapshot(),
+        None,
+        None,
+        None,
+        video_queue,
+        None,
+        None,
+    )
+    counter = iter(range(1_000_000_000))
+    renders = []
+    conflicts = []
+
+    def work():
+        rand = random.Random()
+        for _ in range(args.operations):
+            choice = rand.random()
+            length = len(video_queue)
+            if choice < 0.4 or length < 2:
+                video_queue.append(
+                    VideoQueueItem("https://example.com/{}".format(next(counter))),
+                    play_next=rand.random() < 0.2,
+                )
+            elif choice < 0.7:
+                try:
+                    video_queue.move(rand.randrange(length), rand.randrange(length))
+                except (SystemError, AssertionError):
+                    # Playlist changed outside the queue and not reconciled yet
+                    conflicts.append(None)
+            elif choice < 0.98:
+                start = perf_counter()
+                generate_page_queue(BytesIO(), state, RequestState())
+                renders.append(perf_counter() - start)
+            else:
+                # Changed outside the queue, e.g. by mpv key bindings
+                try:
+                    player.playlist_remove(rand.randrange(length))
+                except IndexError:
+                    pass
+
+    start = perf_counter()
+    run_workers(work, args.threads)
+    elapsed = perf_counter() - start
+    player.wait_for_events()
+
+    filenames = [entry["filename"] for entry in player.playlist]
+    queued = [item.url for item in video_queue]
+    print(
+        "{} operations on {} threads in {:.2f}s, {} items, {} renders averaging {:.2f}ms, "
+        "{} conflicts".format(
+            args.threads * args.operations,
+            args.threads,
+            elapsed,
+            len(queued),
+            len(renders),
+            sum(renders) / max(len(renders), 1) * 1000,
+            len(conflicts),
+        )
+    )
+    if filenames != queued:
+        raise SystemExit("Queue does not match playlist")
+    print("Queue matches playlist")
+
+
+if __name__ == "__main__":
+    main()
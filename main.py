@@ -18,6 +18,85 @@ if __name__ == "__main__":
     parser.add_argument(
         "-p", "--port", default=8000, help="Port to listen on", type=int
     )
+    parser.add_argument(
+        "--server",
+        choices=["threaded", "asyncio"],
+        default="threaded",
+        help="HTTP server implementation, asyncio handles many idle connections better",
+    )
+    parser.add_argument(
+        "--player",
+        choices=["embedded", "ipc"],
+        default="embedded",
+        help="Embed libmpv, or run mpv in its own process (restarted if it crashes)",
+    )
+    parser.add_argument(
+        "--mpv-ipc",
+        help="Control an already running mpv started with --input-ipc-server=MPV_IPC",
+    )
+    parser.add_argument(
+        "--http-workers",
+        default=8,
+        help="Threads handling requests when using the asyncio server",
+        type=int,
+    )
+    parser.add_argument(
+        "--fetch-workers",
+        default=3,
+        help="Maximum number of links to fetch at once",
+        type=int,
+    )
+    parser.add_argument(
+        "--search-workers",
+        default=2,
+        help="Maximum number of searches for suggestions to run at once (0 disables)",
+        type=int,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for caches kept between runs (default ~/.cache/friends-queue)",
+    )
+    parser.add_argument(
+        "--metadata-ttl",
+        default=60 * 60 * 24 * 7,
+        help="Seconds to keep cached video metadata",
+        type=int,
+    )
+    parser.add_argument(
+        "--lookahead",
+        default=2,
+        help="Number of upcoming videos to refresh stream URLs for before they play (0 disables)",
+        type=int,
+    )
+    parser.add_argument(
+        "--thumbnail-cache-mb",
+        default=64,
+        help="Maximum size of cached thumbnails in MiB",
+        type=int,
+    )
+    parser.add_argument(
+        "--queue-window",
+        default=50,
+        help="Number of queue items to render at once, the rest load when scrolled to",
+        type=int,
+    )
+    parser.add_argument(
+        "--no-restore",
+        action="store_true",
+        help="Start with an empty queue instead of the queue from the last run",
+    )
+    parser.add_argument(
+        "--profile-slowest",
+        default=0,
+        help="Profile a sample of requests and keep the N slowest at /debug/profiles",
+        type=int,
+    )
+    parser.add_argument(
+        "--profile-sample",
+        default=0.1,
+        help="Fraction of requests to profile with --profile-slowest",
+        type=float,
+    )
     parser.add_argument("--format", help="Override yt-dlp FORMAT SELECTOR")
     parser.add_argument(
         "--height", help="Max height of video (if --format not used)", type=int
@@ -71,5 +150,19 @@ if __name__ == "__main__":
             format_specifier=format_str,
             host=args.listen,
             port=args.port,
+            server=args.server,
+            player=args.player,
+            mpv_ipc=args.mpv_ipc,
+            http_workers=args.http_workers,
+            fetch_workers=args.fetch_workers,
+            search_workers=args.search_workers,
+            cache_dir=args.cache_dir,
+            metadata_ttl=args.metadata_ttl,
+            lookahead=args.lookahead,
+            thumbnail_bytes=args.thumbnail_cache_mb * 1024 * 1024,
+            queue_window=args.queue_window,
+            restore_queue=not args.no_restore,
+            profile_slowest=args.profile_slowest,
+            profile_sample=args.profile_sample,
         )
     )
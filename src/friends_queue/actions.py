@@ -2,8 +2,10 @@
 
 from collections.abc import Callable, Mapping
 from math import floor
+from typing import TYPE_CHECKING
 
-from mpv import MPV
+if TYPE_CHECKING:
+    from mpv import MPV
 
 
 def _pause(player):
@@ -22,7 +24,7 @@ def _volume_down(player):
     player.volume = floor(max(player.volume - 5, 0))
 
 
-ACTIONS: Mapping[str, Callable[[MPV], None]] = {
+ACTIONS: Mapping[str, Callable[["MPV"], None]] = {
     "seek_backward": lambda player: player.seek("-10", "relative+keyframes"),
     "seek_forward": lambda player: player.seek("10", "relative+keyframes"),
     "prev": lambda player: player.playlist_prev("force"),
@@ -0,0 +1,144 @@
+"""JSON API of the player and queue state, for clients polling for changes"""
+
+import json
+import os
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler
+
+from .compression import send_compressed
+from .types import State
+from .utils import parse_search_query
+
+API_PREFIX = "/api/"
+SEARCH_PATH = API_PREFIX + "search"
+# Seconds browsers may reuse complete search suggestions
+SEARCH_MAX_AGE = 60
+
+# Versions restart with the process, so ETags include an id of this run to not match old ones
+_RUN_ID = os.urandom(4).hex()
+
+
+def is_api_url(path: str) -> bool:
+    """Check if a path references an API endpoint"""
+    return path.startswith(API_PREFIX)
+
+
+def handle_request(handler: BaseHTTPRequestHandler, path: str, app: State):
+    """Handle a request, caller must check path is an API URL prior to calling
+
+    Each response has its version as a strong ETag, so polls with If-None-Match get a 304 when
+    nothing changed without reading the queue or player.
+    """
+    endpoint = path[len(API_PREFIX) :]
+    if endpoint == "search":
+        handle_search(handler, app)
+        return
+    # Versions are read before the state so a body is never older than its ETag
+    if endpoint == "state":
+        version = app.player_state.version + app.queue.version
+        body = state_json
+    elif endpoint == "queue":
+        version = app.queue.version
+        body = queue_json
+    else:
+        handler.send_error(404)
+        return
+
+    etag = '"{}-{}-{}"'.format(_RUN_ID, endpoint, version)
+    none_match = handler.headers.get("If-None-Match")
+    if none_match is not None and etag in _parse_etags(none_match):
+        handler.send_response(304)
+        handler.send_header("ETag", etag)
+        handler.send_header("Cache-Control", "no-cache")
+        handler.send_header("Vary", "Accept-Encoding")
+        handler.end_headers()
+        return
+
+    _send_json(
+        handler, [("ETag", etag), ("Cache-Control", "no-cache")], body(app, version)
+    )
+
+
+def handle_search(handler: BaseHTTPRequestHandler, app: State):
+    """Respond with suggestions for the q query option, waiting for the search when wait is set
+    rather than answering from a shorter query's results"""
+    if app.search is None:
+        handler.send_error(404)
+        return
+    opts = parse_search_query(handler.path.partition("?")[2])
+    suggestions = app.search.search(opts.get("q", ""), opts.get("wait") is None)
+    _send_json(
+        handler,
+        [
+            (
+                "Cache-Control",
+                (
+                    "private, max-age={}".format(SEARCH_MAX_AGE)
+                    if suggestions.complete
+                    else "no-store"
+                ),
+            )
+        ],
+        {
+            "query": suggestions.query,
+            "complete": suggestions.complete,
+            "results": [asdict(result) for result in suggestions.results],
+        },
+    )
+
+
+def state_json(app: State, version: int) -> dict:
+    """Get the player state"""
+    player_state = app.player_state
+    return {
+        "version": version,
+        "queue_version": app.queue.version,
+        "pause": player_state.pause,
+        "seekable": player_state.seekable,
+        "time_pos": player_state.time_pos,
+        "time_remaining": player_state.time_remaining,
+        "duration": player_state.duration,
+        "percent_pos": player_state.percent_pos,
+        "volume": player_state.volume,
+        "playlist_pos": player_state.playlist_pos,
+        "media_title": player_state.media_title,
+    }
+
+
+def queue_json(app: State, version: int) -> dict:
+    """Get the queue items, fetches and recent fetch errors"""
+    queue = app.queue
+    return {
+        "version": version,
+        "items": [
+            {
+                "url": item.url,
+                "title": item.title,
+                "uploader": item.uploader,
+                "duration": item.duration,
+                "thumbnail": item.thumbnail,
+            }
+            for item in queue.snapshot()
+        ],
+        "fetching": [
+            {"url": fetch.url, "started": fetch.started}
+            for fetch in queue.active_fetches()
+        ],
+        # Cleared like the page's, so each error is only shown once
+        "errors": [str(error) for error in queue.recent_errors()],
+    }
+
+
+def _send_json(
+    handler: BaseHTTPRequestHandler, headers: list[tuple[str, str]], body: dict
+):
+    content = json.dumps(body, separators=(",", ":")).encode("utf-8")
+    send_compressed(
+        handler,
+        [("Content-Type", "application/json")] + headers,
+        lambda wfile: wfile.write(content),
+    )
+
+
+def _parse_etags(header: str) -> list[str]:
+    return [etag.strip().removeprefix("W/") for etag in header.split(",")]
@@ -0,0 +1,270 @@
+"""asyncio HTTP server, idle and keep-alive connections don't each hold a thread"""
+
+import asyncio
+import os
+import threading
+import traceback
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from http import HTTPStatus
+from http.client import HTTPMessage, parse_headers
+from io import BytesIO
+from time import time
+
+from .event_stream import (
+    KEEPALIVE_INTERVAL,
+    SUBSCRIBER_BACKLOG,
+    EventStream,
+    format_event,
+)
+
+# Close keep-alive connections that have been idle this long
+IDLE_TIMEOUT = 120
+# Maximum size of a request line plus headers
+MAX_HEADER_SIZE = 64 * 1024
+SERVER_VERSION = "friends-queue"
+
+
+# pylint: disable-next=too-few-public-methods
+class _Socket:
+    """Stand in for the request socket, collects sendfile data into the response body"""
+
+    def __init__(self, body: BytesIO):
+        self._body = body
+
+    def sendfile(self, file, offset: int = 0, count: int = None):
+        """Copy count bytes of file starting at offset into the response body"""
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        self._body.write(os.pread(file.fileno(), count, offset))
+        return count
+
+
+class BufferedHandler:
+    """Implements the parts of BaseHTTPRequestHandler used by request handlers, buffering the
+    response so it can be written by the event loop"""
+
+    def __init__(
+        self, path: str, request_version: str, headers: HTTPMessage, client_address
+    ):
+        self.command = "GET"
+        self.path = path
+        self.request_version = request_version
+        self.headers = headers
+        self.client_address = client_address
+        self.wfile = BytesIO()
+        self.request = _Socket(self.wfile)
+        self.status = None
+        self._headers: list[tuple[str, str]] = []
+
+    def send_response(self, code: int, message: str = None):
+        """Set response status"""
+        self.status = (code, message or HTTPStatus(code).phrase)
+        self._headers = [
+            ("Server", SERVER_VERSION),
+            ("Date", self.date_time_string()),
+        ]
+
+    def send_header(self, keyword: str, value):
+        """Add a response header"""
+        self._headers.append((keyword, str(value)))
+
+    def end_headers(self):
+        """Headers are sent with the body so nothing to do"""
+
+    def send_error(self, code: int, message: str = None):
+        """Send an error response with a short HTML body"""
+        self.send_response(code, message)
+        self.send_header("Content-Type", "text/html;charset=utf-8")
+        self.wfile.seek(0)
+        self.wfile.truncate()
+        self.wfile.write(bytes(f"<h1>{code} {self.status[1]}</h1>", "utf-8"))
+
+    def date_time_string(self, timestamp: float = None) -> str:
+        """Format a timestamp for use in a header"""
+        return formatdate(time() if timestamp is None else timestamp, usegmt=True)
+
+    def encode_response(self, keep_alive: bool) -> bytes:
+        """Encode the buffered response ready to write to the client"""
+        code, message = self.status
+        body = self.wfile.getvalue()
+        head = [f"HTTP/1.1 {code} {message}"]
+        names = set()
+        for keyword, value in self._headers:
+            names.add(keyword.lower())
+            head.append(f"{keyword}: {value}")
+        if "content-length" not in names:
+            head.append(f"Content-Length: {len(body)}")
+        head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+        return bytes("\r\n".join(head) + "\r\n\r\n", "latin-1") + body
+
+
+def _wants_keep_alive(request_version: str, headers: HTTPMessage) -> bool:
+    connection = headers.get("Connection", "").lower()
+    if request_version == "HTTP/1.1":
+        return connection != "close"
+    return connection == "keep-alive"
+
+
+async def _read_request(
+    reader: asyncio.StreamReader,
+) -> (str, str, str, HTTPMessage):
+    """Read a request's method, path, version and headers, skipping any body"""
+    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), IDLE_TIMEOUT)
+    request_line, _, header_bytes = head.partition(b"\r\n")
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3:
+        return None
+    headers = parse_headers(BytesIO(header_bytes))
+
+    # Requests we handle have no body, skip any that is sent
+    content_length = int(headers.get("Content-Length", 0))
+    if content_length > 0:
+        await reader.readexactly(content_length)
+
+    return (*parts, headers)
+
+
+class AsyncHTTPThread(threading.Thread):
+    """Run an asyncio HTTP server in a thread, request handlers run on a bounded thread pool"""
+
+    def __init__(
+        self,
+        address: (str, int),
+        handle_get: Callable[[BufferedHandler], None],
+        events: EventStream,
+        workers: int = 8,
+    ):
+        super().__init__()
+        self.address = address
+        self._handle_get = handle_get
+        self._events = events
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="http"
+        )
+        self._loop: asyncio.AbstractEventLoop = None
+        self._stop_event: asyncio.Event = None
+        self._ready = threading.Event()
+        self._connections: set[asyncio.Task] = set()
+
+    def run(self):
+        asyncio.run(self._serve())
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop.set_default_executor(self._executor)
+        self._stop_event = asyncio.Event()
+        server = await asyncio.start_server(
+            self._handle_connection, *self.address, limit=MAX_HEADER_SIZE
+        )
+        print("Listening (asyncio)...", self.address)
+        self._ready.set()
+        async with server:
+            await self._stop_event.wait()
+            # Open connections (e.g. event streams) would otherwise keep the server open
+            for connection in self._connections:
+                connection.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        """Shut down http listening thread"""
+        self._ready.wait()
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self.join()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        client_address = writer.get_extra_info("peername")
+        connection = asyncio.current_task()
+        self._connections.add(connection)
+        try:
+            keep_alive = True
+            while keep_alive:
+                keep_alive = await self._handle_request(reader, writer, client_address)
+        except (
+            asyncio.TimeoutError,
+            asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError,
+            ConnectionError,
+            ValueError,
+        ):
+            pass
+        finally:
+            self._connections.discard(connection)
+            writer.close()
+
+    async def _handle_request(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        client_address,
+    ) -> bool:
+        """Handle a single request, return whether the connection should be kept open"""
+        request = await _read_request(reader)
+        if request is None:
+            writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\n\r\n")
+            await writer.drain()
+            return False
+        method, path, request_version, headers = request
+
+        keep_alive = _wants_keep_alive(request_version, headers)
+        handler = BufferedHandler(path, request_version, headers, client_address)
+        if method != "GET":
+            handler.send_error(501)
+        elif EventStream.is_events_url(path.partition("?")[0]):
+            await self._stream_events(writer)
+            return False
+        else:
+            try:
+                # Handlers may call into mpv or yt-dlp so must not run on the loop
+                await self._loop.run_in_executor(None, self._handle_get, handler)
+            # pylint: disable-next=broad-exception-caught
+            except Exception as error:
+                traceback.print_exception(error)
+                handler = BufferedHandler(
+                    path, request_version, headers, client_address
+                )
+                handler.send_error(500)
+                keep_alive = False
+
+        writer.write(handler.encode_response(keep_alive))
+        await writer.drain()
+        return keep_alive
+
+    async def _stream_events(self, writer: asyncio.StreamWriter):
+        """Stream events to a client until it disconnects"""
+        messages: asyncio.Queue[bytes] = asyncio.Queue(SUBSCRIBER_BACKLOG)
+        overflowed = asyncio.Event()
+
+        def put(message: bytes):
+            try:
+                messages.put_nowait(message)
+            except asyncio.QueueFull:
+                overflowed.set()
+
+        def deliver(message: bytes):
+            self._loop.call_soon_threadsafe(put, message)
+
+        writer.write(
+            b"HTTP/1.1 200 OK\r\n"
+            + b"Content-Type: text/event-stream\r\n"
+            + b"Cache-Control: no-cache\r\n"
+            + b"Connection: close\r\n\r\n"
+            + b"retry: 3000\n\n"
+        )
+        self._events.subscribe(deliver)
+        try:
+            while not overflowed.is_set():
+                try:
+                    message = await asyncio.wait_for(messages.get(), KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    message = b": keep-alive\n\n"
+                writer.write(message)
+                await writer.drain()
+            # Client fell too far behind for diffs to be useful
+            writer.write(format_event("reload", None))
+            await writer.drain()
+        finally:
+            self._events.unsubscribe(deliver)
@@ -0,0 +1,60 @@
+"""Create the YoutubeDL on a background thread so the server can start without waiting for it"""
+
+import threading
+import traceback
+from collections.abc import Callable
+from time import perf_counter
+from typing import TYPE_CHECKING
+
+from .canonical import load_extractors
+from .startup import STARTUP, YTDL_READY
+
+if TYPE_CHECKING:
+    import yt_dlp
+
+
+class BackgroundYoutubeDL:
+    """Stand-in for a YoutubeDL that is imported and created on a background thread
+
+    Importing yt-dlp and its extractors takes much longer than everything else at startup. Using
+    any attribute waits until the YoutubeDL is ready, so fetches of links added before then wait
+    on their fetch workers while the page is already being served.
+    """
+
+    def __init__(self, create: Callable[[], "yt_dlp.YoutubeDL"]):
+        self._create = create
+        self._ytdl: "yt_dlp.YoutubeDL" = None
+        self._error: Exception = None
+        self._ready = threading.Event()
+        threading.Thread(target=self._load, name="ytdl-load", daemon=True).start()
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def get(self) -> "yt_dlp.YoutubeDL":
+        """Get the YoutubeDL, waiting until it's ready"""
+        self._ready.wait()
+        if self._error is not None:
+            raise RuntimeError("Unable to create YoutubeDL") from self._error
+        return self._ytdl
+
+    def is_ready(self) -> bool:
+        """Check if the YoutubeDL can be used without waiting"""
+        return self._ready.is_set()
+
+    def _load(self):
+        start = perf_counter()
+        try:
+            self._ytdl = self._create()
+            # Already imported by the YoutubeDL, lets canonical keys use them
+            load_extractors()
+            print("Loaded yt-dlp in {:.0f}ms".format((perf_counter() - start) * 1000))
+            STARTUP.mark(YTDL_READY)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as error:
+            traceback.print_exception(error)
+            self._error = error
+        finally:
+            self._ready.set()
@@ -1,6 +1,6 @@
 """Cache dir management"""
 
-from os import mkdir
+from os import makedirs, mkdir
 import os.path
 import tempfile
 from dataclasses import dataclass
@@ -14,6 +14,7 @@ class CacheDirs:
     base: str
     thumbs: str
     ytdl: str
+    static: str
 
     def __del__(self):
         rmtree(self.base)
@@ -35,4 +36,15 @@ def make_cache_dirs(base_dir: str = None):
         base_dir,
         _make_cache_dir(base_dir, "thumbnails"),
         _make_cache_dir(base_dir, "ytdl"),
+        _make_cache_dir(base_dir, "static"),
     )
+
+
+def make_persistent_dir(name: str, base_dir: str = None) -> str:
+    """Make a cache dir that is kept between runs, by default under the user's cache dir"""
+    if base_dir is None:
+        base_dir = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+        base_dir = os.path.join(base_dir, "friends-queue")
+    directory = os.path.join(os.path.abspath(base_dir), name)
+    makedirs(directory, exist_ok=True)
+    return directory
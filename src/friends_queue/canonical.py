@@ -0,0 +1,116 @@
+"""Canonical identifiers for videos"""
+
+from collections.abc import Mapping, Sequence
+from functools import cache, lru_cache
+from threading import Event
+from typing import Any, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that don't change which video a URL points to
+_IGNORED_PARAMS = frozenset(
+    ("t", "start", "si", "feature", "pp", "fbclid", "gclid", "igshid", "ref")
+)
+_IGNORED_HOST_PREFIXES = ("www.", "m.")
+# Query parameters naming a playlist that a video URL is played from
+_PLAYLIST_PARAMS = frozenset(("list", "index"))
+
+# Set once yt-dlp's extractors have been imported
+_LOADED = Event()
+
+
+@cache
+def _extractors() -> Sequence[type]:
+    # Importing every extractor is slow, so only done when first needed
+    # pylint: disable-next=import-outside-toplevel
+    from yt_dlp.extractor import gen_extractor_classes
+
+    extractors = list(gen_extractor_classes())
+    _LOADED.set()
+    return extractors
+
+
+def load_extractors():
+    """Import yt-dlp's extractors, called in the background at startup"""
+    _extractors()
+
+
+def extractor_video_key(url: str) -> Optional[str]:
+    """Get "<extractor>:<id>" for a URL without any network requests, if the extractor that
+    handles the URL can tell the video ID from it"""
+    for extractor in _extractors():
+        if extractor.suitable(url):
+            video_id = extractor.get_temp_id(url)
+            if video_id is None:
+                return None
+            return "{}:{}".format(extractor.ie_key(), video_id)
+    return None
+
+
+def info_video_key(info: Mapping[str, Any]) -> Optional[str]:
+    """Get "<extractor>:<id>" from extracted video info, or a flat playlist entry"""
+    extractor = info.get("extractor_key") or info.get("ie_key")
+    video_id = info.get("id")
+    if extractor is None or video_id is None:
+        return None
+    return "{}:{}".format(extractor, video_id)
+
+
+def normalise_url(url: str) -> str:
+    """Normalise parts of a URL that don't change what it points to, such as the scheme, www.
+    and m. subdomains, fragment, tracking and start time parameters and parameter order
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or parts.hostname is None:
+        # Probably a search
+        return url
+    host = parts.hostname
+    for prefix in _IGNORED_HOST_PREFIXES:
+        host = host.removeprefix(prefix)
+    if parts.port is not None:
+        host += ":{}".format(parts.port)
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name not in _IGNORED_PARAMS and not name.startswith("utm_")
+    )
+    return urlunsplit(
+        ("https", host, parts.path.rstrip("/") or "/", urlencode(query), "")
+    )
+
+
+def canonical_key(url: str, playlist: bool = False) -> str:
+    """Get a key that is the same for all URLs of a video, the extractor key when the video ID
+    can be told from the URL otherwise the normalised URL. A URL naming both a video and a
+    playlist gets the video's key, unless playlist when it's the playlist being queued.
+
+    Until the extractors are loaded only the normalised URL is used so a link being added never
+    waits for them, the video's key is checked again once it has been extracted.
+    """
+    if not _LOADED.is_set():
+        return "url:" + normalise_url(url)
+    return _canonical_key(url.strip(), playlist)
+
+
+@lru_cache(maxsize=1024)
+def _canonical_key(url: str, playlist: bool) -> str:
+    video_url = None if playlist else _without_playlist(url)
+    if video_url is not None:
+        key = extractor_video_key(video_url)
+        if key is not None:
+            return key
+    key = extractor_video_key(url)
+    if key is not None:
+        return key
+    return "url:" + normalise_url(url)
+
+
+def _without_playlist(url: str) -> Optional[str]:
+    """Remove the playlist parameters of a URL, leaving the video it names if any, None if it
+    has none"""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    kept = [(name, value) for name, value in query if name not in _PLAYLIST_PARAMS]
+    if len(kept) == len(query):
+        return None
+    return urlunsplit(parts._replace(query=urlencode(kept)))
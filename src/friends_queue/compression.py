@@ -0,0 +1,117 @@
+"""Content-Encoding negotiation and compression"""
+
+import gzip
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from io import BufferedIOBase
+from typing import Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+IDENTITY = "identity"
+# Levels for compressing responses as they are generated, trading size for speed
+STREAM_GZIP_LEVEL = 6
+STREAM_BROTLI_QUALITY = 5
+
+
+def available_encodings() -> Sequence[str]:
+    """Get supported encodings, most preferred first"""
+    if brotli is not None:
+        return ("br", "gzip")
+    return ("gzip",)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress data as small as possible, for content that is compressed once"""
+    if encoding == "gzip":
+        # Fixed mtime so the output only depends on the input
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    if encoding == "br" and brotli is not None:
+        return brotli.compress(data, quality=11)
+    raise ValueError("Unsupported encoding: " + encoding)
+
+
+def choose_encoding(accept_encoding: Optional[str], available: Sequence[str]) -> str:
+    """Choose the first of available that is accepted, identity if none are"""
+    if accept_encoding is None:
+        return IDENTITY
+    accepted = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.partition(";")
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return IDENTITY
+
+
+class _BrotliWriter(BufferedIOBase):
+    """Compress writes with brotli into another file"""
+
+    def __init__(self, wfile: BufferedIOBase):
+        super().__init__()
+        self._wfile = wfile
+        self._compressor = brotli.Compressor(quality=STREAM_BROTLI_QUALITY)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._wfile.write(self._compressor.process(bytes(data)))
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._wfile.write(self._compressor.finish())
+        super().close()
+
+
+@contextmanager
+def compressed_writer(wfile: BufferedIOBase, encoding: str) -> Iterator[BufferedIOBase]:
+    """Wrap wfile so writes are compressed with encoding, the stream is finished on exit but
+    wfile is left open"""
+    if encoding == IDENTITY:
+        yield wfile
+        return
+    if encoding == "gzip":
+        writer = gzip.GzipFile(
+            fileobj=wfile, mode="wb", compresslevel=STREAM_GZIP_LEVEL, mtime=0
+        )
+    elif encoding == "br" and brotli is not None:
+        writer = _BrotliWriter(wfile)
+    else:
+        raise ValueError("Unsupported encoding: " + encoding)
+    with writer:
+        yield writer
+
+
+def send_compressed(
+    handler: BaseHTTPRequestHandler,
+    headers: Sequence[tuple[str, str]],
+    generate: Callable[[BufferedIOBase], None],
+):
+    """Send a 200 response with headers and a body generated by calling generate with a file to
+    write to, compressed if the client supports it"""
+    encoding = choose_encoding(
+        handler.headers.get("Accept-Encoding"), available_encodings()
+    )
+    handler.send_response(200)
+    for keyword, value in headers:
+        handler.send_header(keyword, value)
+    handler.send_header("Vary", "Accept-Encoding")
+    if encoding != IDENTITY:
+        handler.send_header("Content-Encoding", encoding)
+    handler.end_headers()
+    with compressed_writer(handler.wfile, encoding) as wfile:
+        generate(wfile)
@@ -0,0 +1,88 @@
+"""Server-Sent Events stream"""
+
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler
+from queue import Full, Queue, Empty
+from threading import Event, Lock
+import json
+
+EVENTS_PATH = "/events"
+
+# Send a comment this often so proxies and browsers don't time out idle streams
+KEEPALIVE_INTERVAL = 15
+# Number of undelivered messages a subscriber can fall behind by before it must reload
+SUBSCRIBER_BACKLOG = 256
+
+
+def format_event(event: str, data) -> bytes:
+    """Encode an event as a Server-Sent Events message"""
+    return bytes(
+        "event: {}\ndata: {}\n\n".format(
+            event, json.dumps(data, separators=(",", ":"))
+        ),
+        "utf-8",
+    )
+
+
+class EventStream:
+    """Broadcast encoded events to subscribed clients"""
+
+    def __init__(self):
+        self._subscribers: list[Callable[[bytes], None]] = []
+        self._lock = Lock()
+
+    def subscribe(self, subscriber: Callable[[bytes], None]):
+        """Add a function to be called with every encoded message, it must not block"""
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+
+    def unsubscribe(self, subscriber: Callable[[bytes], None]):
+        """Stop sending messages to a subscriber"""
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+    def publish(self, event: str, data):
+        """Encode an event once and send it to every subscriber"""
+        message = format_event(event, data)
+        # Subscribers list is replaced on change so can be iterated without the lock
+        for subscriber in self._subscribers:
+            subscriber(message)
+
+    def handle_request(self, handler: BaseHTTPRequestHandler):
+        """Stream events to a client until it disconnects, caller must check path first"""
+        messages: Queue[bytes] = Queue(SUBSCRIBER_BACKLOG)
+        overflowed = Event()
+
+        def deliver(message: bytes):
+            try:
+                messages.put_nowait(message)
+            except Full:
+                overflowed.set()
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Cache-Control", "no-cache")
+        handler.end_headers()
+
+        self.subscribe(deliver)
+        try:
+            handler.wfile.write(b"retry: 3000\n\n")
+            handler.wfile.flush()
+            while not overflowed.is_set():
+                try:
+                    message = messages.get(timeout=KEEPALIVE_INTERVAL)
+                except Empty:
+                    message = b": keep-alive\n\n"
+                handler.wfile.write(message)
+                handler.wfile.flush()
+            # Client fell too far behind for diffs to be useful
+            handler.wfile.write(format_event("reload", None))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.unsubscribe(deliver)
+
+    @staticmethod
+    def is_events_url(path: str) -> bool:
+        """Check if a path references the event stream"""
+        return path == EVENTS_PATH
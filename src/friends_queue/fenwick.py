@@ -0,0 +1,54 @@
+"""Fenwick (binary indexed) tree for prefix sums"""
+
+from collections.abc import Iterable
+
+
+class FenwickTree:
+    """Sequence of numbers with O(log n) prefix sums, point updates and appends"""
+
+    def __init__(self, values: Iterable[float] = ()):
+        """Build a tree from values in O(n)"""
+        self._values = list(values)
+        # 1-indexed, _tree[i] is the sum of values (i - lowbit(i), i]
+        self._tree = [0] + self._values
+        for i in range(1, len(self._tree)):
+            parent = i + (i & -i)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[i]
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __getitem__(self, index: int) -> float:
+        return self._values[index]
+
+    def append(self, value: float):
+        """Add a value to the end"""
+        i = len(self._tree)
+        # The new node covers itself and the nodes below it that no existing node covers
+        self._tree.append(
+            value + self.prefix_sum(i - 1) - self.prefix_sum(i - (i & -i))
+        )
+        self._values.append(value)
+
+    def set(self, index: int, value: float):
+        """Change the value at index"""
+        delta = value - self._values[index]
+        self._values[index] = value
+        i = index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def prefix_sum(self, count: int) -> float:
+        """Sum of the first count values"""
+        total = 0
+        i = min(count, len(self._values))
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def total(self) -> float:
+        """Sum of all values"""
+        return self.prefix_sum(len(self._values))
@@ -0,0 +1,77 @@
+"""Bounded pool of worker threads for fetching video info"""
+
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from threading import Condition, Thread
+import traceback
+
+
+@dataclass
+class FetchStats:
+    """Fetch scheduler utilisation
+
+    Attributes:
+        backlog     Number of jobs waiting for a worker
+        busy        Number of workers running a job
+        workers     Total number of workers
+    """
+
+    backlog: int
+    busy: int
+    workers: int
+
+
+class FetchScheduler:
+    """Run jobs on a fixed number of worker threads
+
+    Jobs are run in the order submitted, except priority jobs which jump ahead of all normal ones.
+    """
+
+    def __init__(self, workers: int = 3):
+        assert workers > 0
+        self._condition = Condition()
+        self._priority: deque[Callable[[], None]] = deque()
+        self._backlog: deque[Callable[[], None]] = deque()
+        self._busy = 0
+        self._workers = workers
+        for i in range(workers):
+            Thread(target=self._work, name=f"fetch-{i}", daemon=True).start()
+
+    def submit(self, job: Callable[[], None], priority: bool = False):
+        """Queue a job to be run by the next free worker"""
+        with self._condition:
+            if priority:
+                self._priority.append(job)
+            else:
+                self._backlog.append(job)
+            self._condition.notify()
+
+    def stats(self) -> FetchStats:
+        """Get current backlog depth and worker utilisation"""
+        with self._condition:
+            return FetchStats(
+                len(self._priority) + len(self._backlog), self._busy, self._workers
+            )
+
+    def _next_job(self) -> Callable[[], None]:
+        with self._condition:
+            while len(self._priority) == 0 and len(self._backlog) == 0:
+                self._condition.wait()
+            self._busy += 1
+            if len(self._priority) > 0:
+                return self._priority.popleft()
+            return self._backlog.popleft()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                job()
+            # pylint: disable-next=broad-exception-caught
+            except Exception as error:
+                # Jobs should handle their own errors, don't let one kill the worker
+                traceback.print_exception(error)
+            finally:
+                with self._condition:
+                    self._busy -= 1
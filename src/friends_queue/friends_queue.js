@@ -19,9 +19,9 @@ const numberFormatter = new Intl.NumberFormat(undefined, {
   maximumFractionDigits: 0,
 });
 function durationToStr(duration) {
-  const seconds = duration % 60;
-  let minutes = duration / 60;
-  const hours = minutes / 60;
+  const seconds = Math.floor(duration % 60);
+  let minutes = Math.floor(duration / 60);
+  const hours = Math.floor(minutes / 60);
   minutes = minutes % 60;
   return `${numberFormatter.format(hours)}:${numberFormatter.format(minutes)}:${numberFormatter.format(seconds)}`;
 }
@@ -36,3 +36,560 @@ function updateSeekTimes(input) {
   tb.innerText = durationToStr(before);
   ta.innerText = durationToStr(duration - before);
 }
+
+// Live updates
+
+let events = null;
+
+function queueForm() {
+  return document.querySelector(".queue");
+}
+
+function queueItem(index) {
+  return queueForm().querySelector(`button[name="pos"][value="${index}"]`);
+}
+
+function loadingItem(url) {
+  for (const item of queueForm().querySelectorAll(".loading")) {
+    if (item.dataset.url === url) {
+      return item;
+    }
+  }
+  return null;
+}
+
+function htmlToElement(html) {
+  const template = document.createElement("template");
+  template.innerHTML = html;
+  return template.content.firstElementChild;
+}
+
+function setStatus(paused) {
+  const status = document.querySelector(".status");
+  status.innerText = paused ? "Paused" : `Playing ${status.dataset.title}`;
+}
+
+function setSeekHidden(hidden) {
+  for (const form of document.querySelectorAll(".seek-bar, .skip-to")) {
+    form.hidden = hidden;
+  }
+}
+
+let seeking = false;
+
+function onPosition(data) {
+  const seek = document.querySelector(".seek-bar");
+  if (seek === null) {
+    // Seek bar only rendered once something seekable is playing
+    if (data.seekable && data.time_pos !== "") {
+      location.reload();
+    }
+    return;
+  }
+  if (seeking) {
+    return;
+  }
+  const [tb, ta] = getTimeElms();
+  tb.innerText = data.time_pos;
+  ta.innerText = data.time_remaining;
+  const input = seek.querySelector("input");
+  input.dataset.duration = data.duration;
+  if (data.percent_pos !== null) {
+    input.value = data.percent_pos;
+  }
+}
+
+function onPlaylistPos(pos) {
+  const status = document.querySelector(".status");
+  status.hidden = pos < 0;
+  for (const item of queueForm().querySelectorAll(".current")) {
+    item.classList.remove("current");
+  }
+  const current = queueItem(pos);
+  if (current !== null) {
+    current.classList.add("current");
+  }
+}
+
+function insertQueueItem(element) {
+  // Queue items come before loading and error items
+  const form = queueForm();
+  if (form.querySelector(".queue-more") !== null) {
+    // Not all of the queue is shown, it will be loaded with the rest
+    return;
+  }
+  const after = form.querySelector(".loading, .error");
+  form.insertBefore(element, after);
+}
+
+// Windowed queue
+
+function htmlToFragment(html) {
+  const template = document.createElement("template");
+  template.innerHTML = html;
+  return template.content;
+}
+
+async function fetchQueueRange(start, count) {
+  const res = await fetch(`./queue?start=${start}&count=${count}`);
+  if (!res.ok) {
+    throw new Error(`Loading queue failed: ${res.status}`);
+  }
+  return htmlToFragment(await res.text());
+}
+
+let moreObserver = null;
+
+function observeMore() {
+  const more = queueForm().querySelector(".queue-more");
+  if (more !== null && moreObserver !== null) {
+    moreObserver.observe(more);
+  }
+}
+
+async function loadMore(more) {
+  if (more.dataset.loading) {
+    return;
+  }
+  more.dataset.loading = "1";
+  if (moreObserver !== null) {
+    moreObserver.unobserve(more);
+  }
+  try {
+    more.replaceWith(
+      await fetchQueueRange(more.dataset.start, more.dataset.count),
+    );
+  } catch (e) {
+    console.error(e);
+    delete more.dataset.loading;
+    return;
+  }
+  observeMore();
+}
+
+// Load the shown range of the queue again, after changes that can't be applied in place.
+// If the end of the queue is shown and its new length is given, items appended are loaded too.
+async function refreshQueueWindow(queueLength = null) {
+  const form = queueForm();
+  const buttons = form.querySelectorAll('button[name="pos"]');
+  if (buttons.length === 0) {
+    location.reload();
+    return;
+  }
+  const start = parseInt(buttons[0].value);
+  let count = buttons.length;
+  if (queueLength !== null && form.querySelector(".queue-more") === null) {
+    count = Math.max(queueLength - start, 1);
+  }
+  let fragment;
+  try {
+    fragment = await fetchQueueRange(start, count);
+  } catch (e) {
+    console.error(e);
+    location.reload();
+    return;
+  }
+  for (const element of form.querySelectorAll(
+    'button[name="pos"], .queue-more',
+  )) {
+    element.remove();
+  }
+  form.insertBefore(fragment, form.querySelector(".loading, .error"));
+  observeMore();
+}
+
+function setupQueueWindow() {
+  if (!("IntersectionObserver" in window)) {
+    return;
+  }
+  moreObserver = new IntersectionObserver(
+    (entries) => {
+      for (const entry of entries) {
+        if (entry.isIntersecting) {
+          loadMore(entry.target);
+        }
+      }
+    },
+    { rootMargin: "100% 0px" },
+  );
+  observeMore();
+}
+
+function onAppend(data) {
+  const loading = loadingItem(data.url);
+  if (loading !== null) {
+    loading.remove();
+  }
+  insertQueueItem(htmlToElement(data.html));
+}
+
+function onUpdate(data) {
+  const item = queueItem(data.index);
+  if (item !== null) {
+    item.replaceWith(htmlToElement(data.html));
+  }
+}
+
+function onMove(data) {
+  const buttons = 'button[name="pos"]';
+  const shown = queueForm().querySelectorAll(buttons);
+  if (shown.length === 0) {
+    return;
+  }
+  const first = parseInt(shown[0].value);
+  const last = parseInt(shown[shown.length - 1].value);
+  const moved = queueItem(data.old);
+  const target = queueItem(data.new);
+  if (moved === null || target === null) {
+    const low = Math.min(data.old, data.new);
+    const high = Math.max(data.old, data.new);
+    const hasMore = queueForm().querySelector(".queue-more") !== null;
+    // Moves entirely before or after the shown items don't change them
+    if (high < first || (hasMore && low > last)) {
+      return;
+    }
+    refreshQueueWindow();
+    return;
+  }
+  if (data.old < data.new) {
+    target.after(moved);
+  } else {
+    target.before(moved);
+  }
+  // Positions of everything between the old and new index shifted
+  queueForm()
+    .querySelectorAll(buttons)
+    .forEach((button, i) => {
+      button.value = first + i;
+    });
+}
+
+function onFetch(data) {
+  const element = htmlToElement(data.html);
+  const form = queueForm();
+  form.insertBefore(element, form.querySelector(".error"));
+}
+
+function onImported(data) {
+  const loading = loadingItem(data.url);
+  if (loading !== null) {
+    loading.remove();
+  }
+}
+
+function onFetchError(data) {
+  const loading = loadingItem(data.url);
+  if (loading !== null) {
+    loading.remove();
+  }
+  queueForm().append(htmlToElement(data.html));
+}
+
+function onPause(pause) {
+  setStatus(pause);
+  setSeekHidden(pause);
+}
+
+function onMediaTitle(title) {
+  const status = document.querySelector(".status");
+  status.dataset.title = (title || "").slice(0, 40);
+  setStatus(status.innerText === "Paused");
+}
+
+function onVolume(volume) {
+  const span = document.querySelector(".volume span");
+  if (span !== null && volume !== null) {
+    span.innerText = Math.round(volume);
+  }
+}
+
+// Polling, when live updates aren't available
+
+const POLL_INTERVAL = 2000;
+
+let polling = null;
+let stateVersion = null;
+let queueVersion = null;
+
+async function fetchApi(endpoint) {
+  // Revalidated with the ETag, so unchanged state is a 304 answered from the browser cache
+  const res = await fetch(`./api/${endpoint}`, { cache: "no-cache" });
+  if (!res.ok) {
+    throw new Error(`Polling ${endpoint} failed: ${res.status}`);
+  }
+  return await res.json();
+}
+
+function applyState(state) {
+  onMediaTitle(state.media_title);
+  onPause(state.pause);
+  onVolume(state.volume);
+  onPlaylistPos(state.playlist_pos);
+  onPosition({
+    time_pos: state.time_pos === null ? "" : durationToStr(state.time_pos),
+    time_remaining:
+      state.time_remaining === null ? "" : durationToStr(state.time_remaining),
+    percent_pos: state.percent_pos,
+    duration: state.duration,
+    seekable: state.seekable,
+  });
+}
+
+function applyQueue(queue) {
+  const form = queueForm();
+  for (const element of form.querySelectorAll(".loading, .error")) {
+    element.remove();
+  }
+  for (const active of queue.fetching) {
+    const element = document.createElement("div");
+    element.className = active.started
+      ? "queue-item loading"
+      : "queue-item loading waiting";
+    element.dataset.url = active.url;
+    element.innerText = active.url;
+    form.append(element);
+  }
+  for (const error of queue.errors) {
+    const element = document.createElement("div");
+    element.className = "queue-item error";
+    element.innerText = error;
+    form.append(element);
+  }
+  return refreshQueueWindow(queue.items.length);
+}
+
+async function poll() {
+  try {
+    const state = await fetchApi("state");
+    if (state.version === stateVersion) {
+      return;
+    }
+    stateVersion = state.version;
+    applyState(state);
+    if (state.queue_version !== queueVersion) {
+      queueVersion = state.queue_version;
+      await applyQueue(await fetchApi("queue"));
+    }
+  } catch (e) {
+    console.error(e);
+  }
+}
+
+function startPolling() {
+  if (polling !== null) {
+    return;
+  }
+  // Version of the queue the page was rendered with
+  queueVersion = parseInt(queueForm().dataset.version);
+  poll();
+  polling = setInterval(poll, POLL_INTERVAL);
+}
+
+function listen(event, handler) {
+  events.addEventListener(event, (e) => handler(JSON.parse(e.data)));
+}
+
+// Search suggestions
+
+// Wait for typing to pause before searching
+const SEARCH_DELAY = 250;
+const SEARCH_MIN_LENGTH = 3;
+const SEARCH_CACHE_SIZE = 100;
+
+// Complete results by query, so retyping a query shows them without a request
+const searchCache = new Map();
+let searchTimer = null;
+let searchAbort = null;
+
+function linkInput() {
+  return document.querySelector(".link input[name=link]");
+}
+
+function showSuggestions(results) {
+  const list = document.querySelector(".suggestions");
+  list.replaceChildren();
+  for (const result of results) {
+    const button = document.createElement("button");
+    button.type = "button";
+    button.className = "suggestion";
+    if (result.thumbnail !== null) {
+      const img = document.createElement("img");
+      img.src = result.thumbnail;
+      img.alt = "";
+      img.loading = "lazy";
+      button.append(img);
+    }
+    const title = document.createElement("span");
+    title.className = "title";
+    title.innerText = result.title ?? result.url;
+    const details = document.createElement("span");
+    details.className = "details";
+    details.innerText = [result.uploader, result.duration]
+      .filter((detail) => detail)
+      .join(" · ");
+    button.append(title, details);
+    button.addEventListener("click", () => chooseSuggestion(result.url));
+    list.append(button);
+  }
+  list.hidden = results.length === 0;
+}
+
+function cancelSearch() {
+  clearTimeout(searchTimer);
+  if (searchAbort !== null) {
+    searchAbort.abort();
+    searchAbort = null;
+  }
+}
+
+function chooseSuggestion(url) {
+  cancelSearch();
+  showSuggestions([]);
+  const input = linkInput();
+  input.value = url;
+  input.form.requestSubmit(input.form.querySelector('button[value="play"]'));
+}
+
+async function search(query, wait = false) {
+  const cached = searchCache.get(query);
+  if (cached !== undefined) {
+    showSuggestions(cached);
+    return;
+  }
+  // The server also stops searches it hasn't started for queries this one replaces
+  const abort = new AbortController();
+  searchAbort = abort;
+  const params = new URLSearchParams({ q: query });
+  if (wait) {
+    params.append("wait", "1");
+  }
+  try {
+    const res = await fetch(`./api/search?${params}`, { signal: abort.signal });
+    if (!res.ok) {
+      throw new Error(`Search failed: ${res.status}`);
+    }
+    const body = await res.json();
+    if (abort.signal.aborted) {
+      return;
+    }
+    showSuggestions(body.results);
+    if (!body.complete) {
+      // Results of a shorter query, wait for the search of this one
+      search(query, true);
+      return;
+    }
+    searchCache.set(query, body.results);
+    if (searchCache.size > SEARCH_CACHE_SIZE) {
+      searchCache.delete(searchCache.keys().next().value);
+    }
+  } catch (e) {
+    if (e.name !== "AbortError") {
+      console.error(e);
+    }
+  }
+}
+
+function onLinkInput(e) {
+  cancelSearch();
+  const query = e.target.value.trim().toLowerCase().replace(/\s+/g, " ");
+  // Links are played rather than searched
+  if (query.length < SEARCH_MIN_LENGTH || /^[a-z]+:\/\//.test(query)) {
+    showSuggestions([]);
+    return;
+  }
+  searchTimer = setTimeout(() => search(query), SEARCH_DELAY);
+}
+
+function setupSearch() {
+  const input = linkInput();
+  if (input === null || !("search" in input.dataset)) {
+    return;
+  }
+  input.addEventListener("input", onLinkInput);
+  input.addEventListener("keydown", (e) => {
+    if (e.key === "Escape") {
+      cancelSearch();
+      showSuggestions([]);
+    }
+  });
+}
+
+// Submit actions in the background when live updates will show the result
+function onSubmit(e) {
+  const submitter = e.submitter;
+  if (submitter && submitter.name === "queue_end" && moreObserver !== null) {
+    e.preventDefault();
+    loadMore(submitter);
+    return;
+  }
+  if (
+    polling === null &&
+    (events === null || events.readyState !== EventSource.OPEN)
+  ) {
+    return;
+  }
+  if (
+    submitter &&
+    (submitter.name === "show_skipped" || submitter.value === "info")
+  ) {
+    // These change what is rendered so need a page load
+    return;
+  }
+  e.preventDefault();
+  const params = new URLSearchParams(new FormData(e.target));
+  if (submitter && submitter.name) {
+    params.append(submitter.name, submitter.value);
+  }
+  fetch(`./?${params}`, { redirect: "manual" });
+  for (const input of e.target.querySelectorAll("input[type=text]")) {
+    input.value = "";
+  }
+  if (e.target.querySelector("[data-search]") !== null) {
+    cancelSearch();
+    showSuggestions([]);
+  }
+}
+
+function connectEvents() {
+  setupSearch();
+  if (document.querySelector(".queue") === null) {
+    return;
+  }
+  setupQueueWindow();
+  document.addEventListener("submit", onSubmit);
+  if (!("EventSource" in window)) {
+    startPolling();
+    return;
+  }
+  events = new EventSource("./events");
+  events.addEventListener("error", () => {
+    // Closed rather than reconnecting, so live updates won't come back
+    if (events.readyState === EventSource.CLOSED) {
+      startPolling();
+    }
+  });
+  listen("position", onPosition);
+  listen("pause", onPause);
+  listen("media_title", onMediaTitle);
+  listen("volume", onVolume);
+  listen("playlist_pos", onPlaylistPos);
+  listen("append", onAppend);
+  listen("update", onUpdate);
+  listen("move", onMove);
+  listen("fetch", onFetch);
+  listen("imported", onImported);
+  listen("fetch_error", onFetchError);
+  listen("reload", () => location.reload());
+
+  const seek = document.querySelector(".seek-bar input");
+  if (seek !== null) {
+    seek.addEventListener("pointerdown", () => (seeking = true));
+    seek.addEventListener("change", () => (seeking = false));
+  }
+}
+
+if (document.readyState === "loading") {
+  document.addEventListener("DOMContentLoaded", connectEvents);
+} else {
+  connectEvents();
+}
@@ -2,24 +2,67 @@
 """Friend's Queue"""
 
 import threading
+from collections.abc import Callable
+from functools import partial
 from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from io import BufferedIOBase
+from typing import TYPE_CHECKING, Optional
 from urllib.parse import unquote, quote
 import os.path
 
-import mpv
-import yt_dlp
-
+from . import api
 from .actions import ACTIONS
-from .cache import make_cache_dirs
-from .generate import generate_page
+from .async_server import AsyncHTTPThread
+from .background_ytdl import BackgroundYoutubeDL
+from .cache import CacheDirs, make_cache_dirs, make_persistent_dir
+from .compression import send_compressed
+from .event_stream import EventStream
+from .fetch_scheduler import FetchScheduler
+from .generate import generate_page, generate_page_queue_items_range
+from .journal import QueueJournal
+from .live_updates import publish_player_events, publish_queue_events
+from .metadata_cache import MetadataCache
+from .metrics import HTTP_REQUEST_DURATION, REGISTRY, Gauge, Registry
+from .mpv_ipc import IPCPlayer
+from .player_state import PlayerStateSnapshot
+from .search import SearchCache
+from .startup import FIRST_RESPONSE, LISTENING, MILESTONES, STARTUP
 from .static_files import StaticFiles
+from .stream_resolver import StreamResolver
 from .thumbnail_cache import ThumbnailCache
+from .tracing import TRACER, Tracer, span
 from .types import Config, RequestState, State
 from .video_queue import VideoQueue
 from .utils import parse_search_query
 
+if TYPE_CHECKING:
+    # Slow to import, only imported when used
+    import mpv
+    import yt_dlp
+
 SRC_DIR = os.path.dirname(__file__)
 
+# Seconds a request made while starting waits before getting a 503
+STARTUP_WAIT = 30
+
+# Path of queue item ranges
+QUEUE_PATH = "/queue"
+# Most queue items to send in one range
+MAX_QUEUE_RANGE = 500
+
+# Label of each route for request metrics, None for event streams which aren't timed
+_ROUTE_LABELS = (
+    (ThumbnailCache.is_thumbnail_url, "thumbnails"),
+    (StaticFiles.is_static_url, "static"),
+    (EventStream.is_events_url, None),
+    (lambda path: path == api.SEARCH_PATH, "search"),
+    (api.is_api_url, "api"),
+    (Registry.is_metrics_url, "metrics"),
+    (Tracer.is_debug_url, "debug"),
+    (lambda path: path == QUEUE_PATH, "queue"),
+    (lambda path: path == "/", "/"),
+)
+
 # Address to listen on
 ADDRESS = ("0.0.0.0", 8000)
 # Specify which format to select https://github.com/yt-dlp/yt-dlp#format-selection
@@ -68,64 +111,196 @@ def http_handler(app: State):
         # pylint: disable-next=invalid-name
         def do_GET(self):
             """Handle get requests"""
-
-            state = RequestState()
-            i = self.path.find("?")
-
-            path = self.path[:i] if i > -1 else self.path
-            if ThumbnailCache.is_thumbnail_url(path):
-                app.thumbnails.handle_request(self, path)
-                return
-            if StaticFiles.is_static_url(path):
-                app.static.handle_request(self, path)
-                return
-            if path != "/":
-                # 404
-                self.send_error(404)
-                self.end_headers()
-                return
-
-            if i > -1:
-                query = self.path[i + 1 :]
-                state.options = parse_search_query(query)
-                handle_options(state, app.player, app.queue)
-                if state.redirect:
-                    self.send_response(302)
-                    path = self.path[:i]
-                    if len(state.location_extra) > 1:
-                        path += state.location_extra
-                    self.send_header("Location", path)
-                    self.end_headers()
-                    return
-
-            # Normal response
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
-            self.end_headers()
-            # Document headings
-            self.wfile.write(
-                b'<!DOCTYPE HTML>\n<html lang="en"><head>'
-                + b"<title>Friends Queue</title>"
-                + b'<meta name="viewport" content="width=device-width,initial-scale=1">'
-                + b'<meta charset="utf-8">'
-                + b'<link rel="stylesheet" href="./static/friends_queue.css">'
-                + b'<script async src="./static/friends_queue.js"></script>'
-                + b"</head><body>"
-            )
-            # Page content
-            generate_page(self.wfile, app, state)
-            self.wfile.write(b"</body></html>")
+            handle_get(self, app)
 
     return HTTPHandler
 
 
-def handle_options(state: RequestState, player: mpv.MPV, queue: VideoQueue):
+def handle_get(handler: BaseHTTPRequestHandler, app: State):
+    """Handle a GET request with any object implementing BaseHTTPRequestHandler's interface"""
+    path = handler.path.split("?", 1)[0]
+    if not wait_until_ready(handler, app, path):
+        STARTUP.mark(FIRST_RESPONSE)
+        return
+    label = route_label(path)
+    if label is None:
+        # Stays open until the client leaves so isn't timed
+        route_get(handler, app, path)
+        return
+    with (
+        HTTP_REQUEST_DURATION.time(label),
+        TRACER.trace("GET", handler.path, profile=True),
+    ):
+        route_get(handler, app, path)
+    STARTUP.mark(FIRST_RESPONSE)
+
+
+def wait_until_ready(handler: BaseHTTPRequestHandler, app: State, path: str) -> bool:
+    """Hold a request made while the app is starting until it has, returns whether it can be
+    handled. The page is answered straight away with a placeholder that reloads instead.
+    """
+    if app.ready.is_set() or StaticFiles.is_static_url(path):
+        # Static files are loaded before listening
+        return True
+    if path == "/" and handler.path == "/":
+        send_compressed(
+            handler,
+            [("Content-Type", "text/html"), ("Cache-Control", "no-store")],
+            partial(generate_starting_document, app=app),
+        )
+        return False
+    if app.ready.wait(STARTUP_WAIT):
+        return True
+    handler.send_response(503)
+    handler.send_header("Retry-After", 1)
+    handler.send_header("Content-Length", 0)
+    handler.end_headers()
+    return False
+
+
+def route_label(path: str) -> Optional[str]:
+    """Get the route a path is timed as, None if it isn't timed"""
+    for matches, label in _ROUTE_LABELS:
+        if matches(path):
+            return label
+    return "other"
+
+
+def route_get(handler: BaseHTTPRequestHandler, app: State, path: str):
+    """Call the handler for a path"""
+    i = handler.path.find("?")
+    query = handler.path[i + 1 :] if i > -1 else None
+
+    if ThumbnailCache.is_thumbnail_url(path):
+        app.thumbnails.handle_request(handler, path)
+    elif StaticFiles.is_static_url(path):
+        app.static.handle_request(handler, path)
+    elif EventStream.is_events_url(path):
+        app.events.handle_request(handler)
+    elif api.is_api_url(path):
+        api.handle_request(handler, path, app)
+    elif Registry.is_metrics_url(path):
+        REGISTRY.handle_request(handler)
+    elif Tracer.is_debug_url(path):
+        TRACER.handle_request(handler, path)
+    elif path == QUEUE_PATH:
+        handle_queue_range(handler, app, query or "")
+    elif path == "/":
+        handle_page(handler, app, path, query)
+    else:
+        # 404
+        handler.send_error(404)
+        handler.end_headers()
+
+
+def handle_page(
+    handler: BaseHTTPRequestHandler, app: State, path: str, query: Optional[str]
+):
+    """Handle a request for the page, query options are actions to run before redirecting"""
+    state = RequestState()
+    if query is not None:
+        state.options = parse_search_query(query)
+        handle_options(state, app.player, app.player_state, app.queue)
+        if state.redirect:
+            handler.send_response(302)
+            if len(state.location_extra) > 1:
+                path += state.location_extra
+            handler.send_header("Location", path)
+            handler.end_headers()
+            return
+
+    # Normal response
+    send_html(handler, partial(generate_document, app=app, state=state))
+
+
+def handle_queue_range(handler: BaseHTTPRequestHandler, app: State, query: str):
+    """Respond with the HTML of a range of queue items, for loading more of the queue"""
+    opts = parse_search_query(query)
+    try:
+        start = max(int(opts.get("start", 0)), 0)
+        count = int(opts.get("count", app.config.queue_window))
+    except ValueError:
+        handler.send_error(400)
+        return
+    count = min(max(count, 1), MAX_QUEUE_RANGE)
+    with span("generate_page_queue_items_range"):
+        send_html(
+            handler,
+            partial(
+                generate_page_queue_items_range, state=app, start=start, count=count
+            ),
+        )
+
+
+def send_html(
+    handler: BaseHTTPRequestHandler, generate: Callable[[BufferedIOBase], None]
+):
+    """Send a HTML response generated by calling generate with a file to write to, compressed
+    if the client supports it"""
+    send_compressed(handler, [("Content-Type", "text/html")], generate)
+
+
+def generate_document(wfile: BufferedIOBase, app: State, state: RequestState):
+    """Generate the whole HTML page"""
+    # Document headings
+    with span("head"):
+        wfile.write(
+            b'<!DOCTYPE HTML>\n<html lang="en"><head>'
+            + b"<title>Friends Queue</title>"
+            + b'<meta name="viewport" content="width=device-width,initial-scale=1">'
+            + b'<meta charset="utf-8">'
+            + bytes(
+                '<link rel="stylesheet" href="{}">'.format(
+                    app.static.url("friends_queue.css")
+                ),
+                "utf-8",
+            )
+            + bytes(
+                '<script async src="{}"></script>'.format(
+                    app.static.url("friends_queue.js")
+                ),
+                "utf-8",
+            )
+            + b"</head><body>"
+        )
+    # Page content
+    with span("generate_page"):
+        generate_page(wfile, app, state)
+    wfile.write(b"</body></html>")
+
+
+def generate_starting_document(wfile: BufferedIOBase, app: State):
+    """Generate a page shown while the app is starting, which reloads until it has"""
+    wfile.write(
+        b'<!DOCTYPE HTML>\n<html lang="en"><head>'
+        + b"<title>Friends Queue</title>"
+        + b'<meta name="viewport" content="width=device-width,initial-scale=1">'
+        + b'<meta charset="utf-8">'
+        + b'<meta http-equiv="refresh" content="1">'
+        + bytes(
+            '<link rel="stylesheet" href="{}">'.format(
+                app.static.url("friends_queue.css")
+            ),
+            "utf-8",
+        )
+        + b"</head><body><p>Starting...</p></body></html>"
+    )
+
+
+def handle_options(
+    state: RequestState,
+    player: "mpv.MPV",
+    player_state: PlayerStateSnapshot,
+    queue: VideoQueue,
+):
     """Handle request query options"""
     opts = state.options
     if "link" in opts:
         state.redirect = True
         print("Adding to queue", opts["link"])
-        queue.append_url(opts["link"])
+        queue.append_url(
+            opts["link"], opts.get("a") == "play_next", opts.get("a") == "import"
+        )
     if "a" in opts:
         state.redirect = True
         action = opts["a"]
@@ -133,7 +308,7 @@ def handle_options(state: RequestState, player: mpv.MPV, queue: VideoQueue):
             state.location_extra += (
                 "text="
                 + quote(
-                    f"Playing {player.media_title} {player.percent_pos}% ({player.video_format} {player.video_codec} {player.hwdec_current} {player.width}x{player.height}) Drop(dec={player.decoder_frame_drop_count}, frame={player.frame_drop_count})"
+                    f"Playing {player_state.media_title} {player_state.percent_pos}% ({player_state.video_format} {player_state.video_codec} {player_state.hwdec_current} {player_state.width}x{player_state.height}) Drop(dec={player_state.decoder_frame_drop_count}, frame={player_state.frame_drop_count})"
                 )
                 + "&"
             )
@@ -152,54 +327,240 @@ def handle_options(state: RequestState, player: mpv.MPV, queue: VideoQueue):
     if "pos" in opts:
         state.redirect = True
         new_pos = int(opts["pos"])
-        if player.playlist_pos != new_pos:
+        if player_state.playlist_pos != new_pos:
             player.playlist_pos = new_pos
     if "show_skipped" in opts:
         state.show_skipped_items = opts["show_skipped"] == "1"
+    if "queue_end" in opts and opts["queue_end"].isdigit():
+        state.queue_end = int(opts["queue_end"])
+
+
+def register_metrics(app: State):
+    """Register gauges of the app state, which are read when metrics are collected"""
+    queue = app.queue
+    thumbnails = app.thumbnails
+    player_state = app.player_state
+    for name, documentation, read, metric_type in (
+        ("friends_queue_queue_length", "Queued videos", lambda: len(queue), "gauge"),
+        (
+            "friends_queue_active_fetches",
+            "Videos being fetched or waiting for a worker",
+            lambda: len(queue.active_fetches()),
+            "gauge",
+        ),
+        (
+            "friends_queue_fetch_workers_busy",
+            "Fetch workers running a job",
+            lambda: queue.fetch_stats().busy,
+            "gauge",
+        ),
+        (
+            "friends_queue_thumbnail_cache_hits_total",
+            "Thumbnail requests served from cache",
+            lambda: thumbnails.stats().hits,
+            "counter",
+        ),
+        (
+            "friends_queue_thumbnail_cache_misses_total",
+            "Thumbnail requests for thumbnails not in cache",
+            lambda: thumbnails.stats().misses,
+            "counter",
+        ),
+        (
+            "friends_queue_thumbnail_cache_evictions_total",
+            "Thumbnails removed to stay within the cache size",
+            lambda: thumbnails.stats().evictions,
+            "counter",
+        ),
+        (
+            "friends_queue_thumbnail_cache_bytes",
+            "Total size of cached thumbnails",
+            lambda: thumbnails.stats().bytes,
+            "gauge",
+        ),
+        (
+            "friends_queue_thumbnail_cache_entries",
+            "Cached thumbnails",
+            lambda: thumbnails.stats().entries,
+            "gauge",
+        ),
+        (
+            "mpv_decoder_frame_drop_count",
+            "Frames dropped by the decoder in the current video",
+            lambda: player_state.decoder_frame_drop_count,
+            "gauge",
+        ),
+        (
+            "mpv_frame_drop_count",
+            "Frames dropped by the video output in the current video",
+            lambda: player_state.frame_drop_count,
+            "gauge",
+        ),
+    ):
+        REGISTRY.register(Gauge(name, documentation, read, metric_type))
+    for milestone in MILESTONES:
+        REGISTRY.register(
+            Gauge(
+                "friends_queue_startup_{}_seconds".format(
+                    milestone.replace("-", "").replace(" ", "_")
+                ),
+                "Seconds after the process started until " + milestone,
+                partial(STARTUP.seconds, milestone),
+            )
+        )
+
+
+def make_player(config: Config, cache_dirs: CacheDirs) -> "mpv.MPV":
+    """Create the mpv player, embedded or in its own process"""
+    if config.mpv_ipc is not None:
+        # Already running with its own options
+        return IPCPlayer(config.mpv_ipc)
+    options = {
+        "ytdl": True,
+        "ytdl_format": config.format_specifier or FORMAT_SPECIFIER,
+        "input_default_bindings": True,
+        "input_vo_keyboard": True,
+        "osc": True,
+        "idle": True,
+        "script_opts": "ytdl_hook-cachedir=" + cache_dirs.ytdl,
+    }
+    if config.player == "ipc":
+        if config.debug:
+            options["msg_level"] = "all=debug"
+        else:
+            # Quiet like embedded mpv
+            options["terminal"] = False
+        return IPCPlayer.launch(os.path.join(cache_dirs.base, "mpv.sock"), **options)
+    if config.debug:
+        options["log_handler"] = print
+        options["loglevel"] = "debug"
+    # Loads libmpv, which isn't needed with the IPC player
+    # pylint: disable-next=import-outside-toplevel
+    import mpv
 
+    return mpv.MPV(**options)
 
-def main(config: Config = Config()):
-    """Main func"""
-
-    assert isinstance(config, Config)
-
-    close_condition = threading.Condition()
-
-    cache_dirs = make_cache_dirs()
 
-    extra_args = {}
-    if config.debug:
-        extra_args["log_handler"] = print
-        extra_args["loglevel"] = "debug"
-    extra_args["script_opts"] = "ytdl_hook-cachedir=" + cache_dirs.ytdl
-    player = mpv.MPV(
-        ytdl=True,
-        ytdl_format=config.format_specifier or FORMAT_SPECIFIER,
-        input_default_bindings=True,
-        input_vo_keyboard=True,
-        osc=True,
-        idle=True,
-        **extra_args,
-    )
+def make_ytdl(config: Config, cache_dirs: CacheDirs) -> "yt_dlp.YoutubeDL":
+    """Create the YoutubeDL used to extract video info, slow as it imports yt-dlp and all its
+    extractors"""
+    # pylint: disable-next=import-outside-toplevel
+    import yt_dlp
 
     yt_args = {
         "format": config.format_specifier or FORMAT_SPECIFIER,
         "skip_download": True,
         "cachedir": cache_dirs.ytdl,
         "remote_components": [],
+        # Only list playlist entries, each is resolved when it nears playback
+        "extract_flat": "in_playlist",
     }
     if config.search:
         yt_args["default_search"] = "auto"
+    return yt_dlp.YoutubeDL(yt_args)
+
+
+def make_search(
+    config: Config, ytdl: "yt_dlp.YoutubeDL", thumbnails: ThumbnailCache
+) -> Optional[SearchCache]:
+    """Create the cache of search suggestions, None if search or suggestions are disabled"""
+    if not config.search or config.search_workers < 1:
+        return None
+    return SearchCache(ytdl, thumbnails, config.search_workers)
+
+
+def keep_queue(
+    config: Config,
+    player: "mpv.MPV",
+    player_state: PlayerStateSnapshot,
+    queue: VideoQueue,
+    thumbnails: ThumbnailCache,
+) -> QueueJournal:
+    """Restore the queue from the last run and journal changes to it, and reload it into mpv if
+    mpv is restarted"""
+    journal = QueueJournal(make_persistent_dir("journal", config.cache_dir))
+    if config.restore_queue:
+        journal.restore(queue, thumbnails)
+    journal.record(queue, player_state)
+
+    if isinstance(player, IPCPlayer):
+        # Load the queue into mpv again if it crashes, carrying on where it was
+        player.add_restart_listener(
+            lambda: queue.reload_player(
+                player_state.playlist_pos, player_state.time_pos, player_state.pause
+            )
+        )
+    return journal
 
-    ytdl = yt_dlp.YoutubeDL(yt_args)
 
-    static = StaticFiles(
-        os.path.dirname(__file__), ["friends_queue.css", "friends_queue.js"]
+def start_app(app: State, cache_dirs: CacheDirs) -> QueueJournal:
+    """Create the player, queue and everything else requests need while the server listens,
+    then mark the app ready"""
+    config = app.config
+    player = make_player(config, cache_dirs)
+
+    player_state = PlayerStateSnapshot()
+    player_state.observe(player)
+
+    thumbnails = ThumbnailCache(
+        cache_dirs.thumbs,
+        max_bytes=config.thumbnail_bytes,
+        max_open_files=config.thumbnail_files,
+    )
+    queue = VideoQueue(
+        player,
+        MetadataCache(
+            make_persistent_dir("metadata", config.cache_dir),
+            app.ytdl,
+            config.metadata_ttl,
+        ),
+        thumbnails,
+        FetchScheduler(config.fetch_workers),
     )
-    thumbnails = ThumbnailCache(cache_dirs.thumbs)
-    queue = VideoQueue(player, ytdl, thumbnails)
 
-    state = State(config, player, ytdl, static, thumbnails, queue, close_condition)
+    journal = keep_queue(config, player, player_state, queue, thumbnails)
+
+    if config.lookahead > 0:
+        StreamResolver(
+            app.ytdl, queue, player_state, config.lookahead, config.stream_url_ttl
+        ).start()
+
+    publish_player_events(app.events, player_state)
+    publish_queue_events(app.events, queue, player_state)
+
+    app.player = player
+    app.player_state = player_state
+    app.thumbnails = thumbnails
+    app.queue = queue
+    app.search = make_search(config, app.ytdl, thumbnails)
+
+    register_metrics(app)
+    if config.profile_slowest > 0:
+        TRACER.enable_profiling(config.profile_slowest, config.profile_sample)
+    app.ready.set()
+    return journal
+
+
+def main(config: Config = Config()):
+    """Main func"""
+
+    assert isinstance(config, Config)
+
+    close_condition = threading.Condition()
+
+    cache_dirs = make_cache_dirs()
+
+    # Started first as it takes longest, links added before it's ready wait to be fetched
+    ytdl = BackgroundYoutubeDL(partial(make_ytdl, config, cache_dirs))
+    events = EventStream()
+    # Compressed before listening so the starting page and its assets load without waiting
+    static = StaticFiles(
+        os.path.dirname(__file__),
+        ["friends_queue.css", "friends_queue.js"],
+        cache_dirs.static,
+    )
+    # Filled in by start_app, requests wait for it
+    state = State(config, None, None, ytdl, static, None, None, events, close_condition)
 
     listen_address = ADDRESS
     if config.host is not None:
@@ -207,11 +568,28 @@ def main(config: Config = Config()):
     if config.port is not None:
         listen_address = (listen_address[0], config.port)
 
-    http = HTTPThread(
-        listen_address,
-        http_handler(state),
-    )
+    if config.server == "asyncio":
+        http = AsyncHTTPThread(
+            listen_address,
+            partial(handle_get, app=state),
+            events,
+            config.http_workers,
+        )
+    else:
+        http = HTTPThread(
+            listen_address,
+            http_handler(state),
+        )
     http.start()
+    STARTUP.mark(LISTENING)
+
+    try:
+        journal = start_app(state, cache_dirs)
+    except BaseException:
+        # The server thread would keep the process running
+        http.shutdown()
+        raise
+    player = state.player
 
     PlayerThread(state).start()
 
@@ -221,12 +599,16 @@ def main(config: Config = Config()):
         except KeyboardInterrupt:
             pass
 
+    journal.close()
+    if isinstance(player, IPCPlayer):
+        player.terminate()
     del player
 
     print("Shutting down")
     http.shutdown()
 
     print("Deleting cache")
+    state.thumbnails.close()
     del cache_dirs
 
 
@@ -3,6 +3,7 @@
 from io import BufferedIOBase
 import html
 
+from .tracing import span
 from .types import RequestState, State
 from .utils import seconds_duration
 from .video_queue import VideoQueueItem
@@ -24,14 +25,24 @@ def generate_action_button(
     )
 
 
-def generate_page_actions(wfile: BufferedIOBase):
-    """Generate HTML for action buttons"""
+def generate_page_actions(wfile: BufferedIOBase, suggestions: bool = False):
+    """Generate HTML for action buttons, and a list for search suggestions if enabled"""
     # Add to queue
     wfile.write(b'<form id="a"></form><form class="grid link">')
     generate_action_button(wfile, "quit", "Quit", "form=a")
-    wfile.write(b'<input type=text name=link placeholder="Play link">')
+    if suggestions:
+        wfile.write(
+            b'<input type=text name=link placeholder="Play link or search" '
+            b"autocomplete=off data-search>"
+        )
+    else:
+        wfile.write(b'<input type=text name=link placeholder="Play link">')
     generate_action_button(wfile, "play", "Play")
+    generate_action_button(wfile, "play_next", "Play next")
+    generate_action_button(wfile, "import", "Import playlist")
     wfile.write(b"</form>")
+    if suggestions:
+        wfile.write(b'<div class="suggestions" hidden></div>')
     # Actions
     actions = [
         ("info", "Info"),
@@ -50,17 +61,27 @@ def generate_page_actions(wfile: BufferedIOBase):
 
 def generate_page_player_status(wfile: BufferedIOBase, state: State):
     """Generate HTML for currently playing video status"""
-    wfile.write(b"<p>")
-    if state.player.pause:
+    player = state.player_state
+    title = (player.media_title or "")[:40]
+    wfile.write(
+        bytes(
+            '<p class="status" data-title="{}"{}>'.format(
+                html.escape(title, True),
+                " hidden" if player.playlist_pos < 0 else "",
+            ),
+            "utf-8",
+        )
+    )
+    if player.pause:
         wfile.write(b"Paused")
     else:
-        wfile.write(bytes("Playing {}".format(state.player.media_title[:40]), "utf-8"))
+        wfile.write(bytes("Playing {}".format(html.escape(title)), "utf-8"))
     wfile.write(b"</p>")
 
 
-def generate_goto_time(wfile: BufferedIOBase):
+def generate_goto_time(wfile: BufferedIOBase, hidden: bool = False):
     """Generate an input for time to go to"""
-    wfile.write(b'<form class="grid skip-to">')
+    wfile.write(b'<form class="grid skip-to"' + (b" hidden>" if hidden else b">"))
     wfile.write(
         b'<input type=text name=time required pattern="\\d*(:\\d+)*" placeholder="00:00">'
     )
@@ -68,26 +89,29 @@ def generate_goto_time(wfile: BufferedIOBase):
     wfile.write(b"</form>")
 
 
-def generate_page_seek_bar(wfile: BufferedIOBase, state: State):
+def generate_page_seek_bar(wfile: BufferedIOBase, state: State, hidden: bool = False):
     """Generate HTML for seek bar"""
-    wfile.write(b'<form class="grid seek-bar">')
+    wfile.write(b'<form class="grid seek-bar"' + (b" hidden>" if hidden else b">"))
     wfile.write(
         bytes(
-            "<span>{}</span>".format(seconds_duration(state.player.time_pos)), "utf-8"
+            "<span>{}</span>".format(seconds_duration(state.player_state.time_pos)),
+            "utf-8",
         )
     )
     wfile.write(
         bytes(
-            '<input name="seek" type="range" onchange="this.form.submit()" oninput="updateSeekTimes(this)" data-duration="{}" value="{}">'.format(
-                state.player.duration,
-                state.player.percent_pos,
+            '<input name="seek" type="range" onchange="this.form.requestSubmit()" oninput="updateSeekTimes(this)" data-duration="{}" value="{}">'.format(
+                state.player_state.duration,
+                state.player_state.percent_pos,
             ),
             "utf-8",
         )
     )
     wfile.write(
         bytes(
-            "<span>{}</span>".format(seconds_duration(state.player.time_remaining)),
+            "<span>{}</span>".format(
+                seconds_duration(state.player_state.time_remaining)
+            ),
             "utf-8",
         )
     )
@@ -98,7 +122,7 @@ def generate_page_volume_slider(wfile: BufferedIOBase, state: State):
     """Generate HTML for a volume slider"""
     wfile.write(b'<form class="grid volume">')
     generate_action_button(wfile, "volume_down", "Decrease Volume")
-    wfile.write(bytes("<span>{:.0f}</span>".format(state.player.volume), "utf-8"))
+    wfile.write(bytes("<span>{:.0f}</span>".format(state.player_state.volume), "utf-8"))
     generate_action_button(wfile, "volume_up", "Increase Volume")
     wfile.write(b"</form>")
 
@@ -107,14 +131,33 @@ def generate_page_queue_item(
     wfile: BufferedIOBase, item: VideoQueueItem, i: int, current: bool
 ):
     """Generate HTML for an active queue item"""
-    content = '<button type="submit" name="pos" value="{}" class="queue-item'.format(i)
-    if current:
-        content += " current"
-    content += '">'
+    wfile.write(
+        bytes(
+            '<button type="submit" name="pos" value="{}" class="queue-item{}">'.format(
+                i, " current" if current else ""
+            ),
+            "utf-8",
+        )
+    )
+    wfile.write(_queue_item_content(item))
+    wfile.write(b"</button>")
+
 
+def _queue_item_content(item: VideoQueueItem) -> bytes:
+    """Get the position independent HTML of a queue item, cached until the item is updated"""
+    # Read version first, if the item changes while rendering the next render will redo it
+    version = item.version
+    fragment = item.fragment
+    if fragment is not None and fragment[0] == version:
+        return fragment[1]
+
+    content = ""
     if item.title is not None:
         if item.thumbnail is not None:
             content += '<img src="{}"'.format(html.escape(item.thumbnail, True))
+            if item.thumbnail_srcset is not None:
+                srcset = html.escape(item.thumbnail_srcset, True)
+                content += f' srcset="{srcset}" sizes="5em"'
             if item.thumbnail_height is not None:
                 height = html.escape(str(item.thumbnail_height), True)
                 content += f' height="{height}"'
@@ -127,87 +170,133 @@ def generate_page_queue_item(
             content += "{} - ".format(html.escape(item.uploader))
         content += "{}</span>".format(html.escape(item.title))
         content += '<span class="duration">{}</span>'.format(
-            html.escape(item.duration_str)
+            html.escape(item.duration_str or "")
         )
         content += '<span class="link">{0}</span>'.format(html.escape(item.url))
     else:
         content += html.escape(item.url)
-    content += "</button>"
-    wfile.write(bytes(content, "utf-8"))
+
+    encoded = bytes(content, "utf-8")
+    item.fragment = (version, encoded)
+    return encoded
+
+
+def generate_page_queue_items_range(
+    wfile: BufferedIOBase, state: State, start: int, count: int
+):
+    """Generate HTML for count queue items from start, followed by a button to load more if
+    there are more"""
+    items = state.queue.snapshot()
+    player_current = state.player_state.playlist_pos
+    end = min(start + count, len(items))
+    for i in range(start, end):
+        generate_page_queue_item(wfile, items[i], i, i == player_current)
+    if end < len(items):
+        generate_page_queue_more(wfile, end, state.config.queue_window)
+
+
+def generate_page_queue_more(wfile: BufferedIOBase, start: int, count: int):
+    """Generate HTML for a button that loads more queue items, automatically when scrolled to
+    with JS"""
+    wfile.write(
+        bytes(
+            '<button class="queue-more" type="submit" name="queue_end" value="{}" '
+            'data-start="{}" data-count="{}">Show more</button>'.format(
+                start + count, start, count
+            ),
+            "utf-8",
+        )
+    )
 
 
 def generate_page_queue_items_active(
-    wfile: BufferedIOBase, state: State, player_current: int, skip_before: int
+    wfile: BufferedIOBase,
+    state: State,
+    player_current: int,
+    skip_before: int,
+    end: int = None,
 ) -> (int, int):
-    """Generate HTML for active items in queue"""
-    time_before = 0
-    time_after = 0
-    after_current = False
-
-    for i, item in enumerate(state.queue):
-        current = i == player_current
-        # Sum queue timings
-        if current:
-            after_current = True
-            pos = state.player.time_pos
-            if pos is not None:
-                time_before += pos
-                time_after += state.player.time_remaining
-            elif item.duration is not None:
-                time_after += item.duration
-        elif after_current and item.duration is not None:
-            time_after += item.duration
-        elif item.duration is not None:
-            time_before += item.duration
-
-        # Only show one item before current item
-        if not after_current and i < skip_before:
-            continue
-
-        generate_page_queue_item(wfile, item, i, current)
+    """Generate HTML for a window of active items in queue, up to end if given"""
+    items = state.queue.snapshot()
+    time_before, current_duration, time_after = state.queue.watch_times(player_current)
+    # Use live time of the current item when known
+    pos = state.player_state.time_pos
+    if pos is not None and 0 <= player_current < len(items):
+        time_before += pos
+        time_after += state.player_state.time_remaining or 0
+    else:
+        time_after += current_duration
+
+    # Only show one item before current item
+    start = max(skip_before, 0)
+    window = state.config.queue_window
+    # Always reach as far past the current item as when skipped items are hidden
+    count = max(window, player_current - 1 + window - start)
+    if end is not None and end - start > count:
+        count = end - start
+    generate_page_queue_items_range(wfile, state, start, count)
 
     return (time_before, time_after)
 
 
+def generate_page_queue_item_loading(
+    wfile: BufferedIOBase, url: str, waiting: bool = False
+):
+    """Generate HTML for a queue item that is being fetched or waiting to be fetched"""
+    wfile.write(
+        bytes(
+            '<div class="queue-item loading{}" data-url="{}">{}</div>'.format(
+                " waiting" if waiting else "",
+                html.escape(url, True),
+                html.escape(url),
+            ),
+            "utf-8",
+        )
+    )
+
+
+def generate_page_queue_item_error(wfile: BufferedIOBase, error: Exception):
+    """Generate HTML for a queue item that failed to fetch"""
+    wfile.write(
+        bytes(
+            '<div class="queue-item error">{}</div>'.format(html.escape(str(error))),
+            "utf-8",
+        )
+    )
+
+
 def generate_page_queue_items_loading(wfile: BufferedIOBase, state: State):
     """Generate HTML for loading queue items"""
     for active in state.queue.active_fetches():
-        wfile.write(
-            bytes(
-                '<div class="queue-item loading">{}</div>'.format(html.escape(active)),
-                "utf-8",
-            )
-        )
+        generate_page_queue_item_loading(wfile, active.url, not active.started)
 
 
 def generate_page_queue_items_errors(wfile: BufferedIOBase, state: State):
     """Generate HTML for loading errors"""
     for error in state.queue.recent_errors():
-        wfile.write(
-            bytes(
-                '<div class="queue-item error">{}</div>'.format(
-                    html.escape(str(error))
-                ),
-                "utf-8",
-            )
-        )
+        generate_page_queue_item_error(wfile, error)
 
 
 def generate_page_queue(
     wfile: BufferedIOBase, state: State, req: RequestState
 ) -> (int, int):
     """Generate HTML for current queue items"""
-    player_current = state.player.playlist_pos
+    player_current = state.player_state.playlist_pos
     skip_before = player_current - 1
     if req.show_skipped_items:
         skip_before = -1
 
     wfile.write(
         bytes(
-            f'<form class="queue" style="counter-reset: section {max(skip_before, 0)}">',
+            '<form class="queue" data-version="{}" style="counter-reset: section {}">'.format(
+                state.queue.version, max(skip_before, 0)
+            ),
             "utf-8",
         )
     )
+    if req.show_skipped_items:
+        # Kept when showing more, before the buttons so "Hide previous" overrides it
+        wfile.write(b'<input type="hidden" name="show_skipped" value="1">')
     # Generate a button to show skipped items
     if skip_before > 0:
         wfile.write(
@@ -218,15 +307,18 @@ def generate_page_queue(
             b'<button class="top-button" type="submit" name="show_skipped" value="0">Hide previous</button>'
         )
 
-    time_before, time_after = generate_page_queue_items_active(
-        wfile, state, player_current, skip_before
-    )
+    with span("generate_page_queue_items_active"):
+        time_before, time_after = generate_page_queue_items_active(
+            wfile, state, player_current, skip_before, req.queue_end
+        )
 
     # Currently fetching
-    generate_page_queue_items_loading(wfile, state)
+    with span("generate_page_queue_items_loading"):
+        generate_page_queue_items_loading(wfile, state)
 
     # Recent errors
-    generate_page_queue_items_errors(wfile, state)
+    with span("generate_page_queue_items_errors"):
+        generate_page_queue_items_errors(wfile, state)
 
     wfile.write(b"</form>")
 
@@ -252,25 +344,27 @@ def generate_page(wfile: BufferedIOBase, state: State, req: RequestState):
             bytes("<p>{}</p>".format(html.escape(req.text)), "utf-8")
         )  # Yes this is XSS
 
-    generate_page_actions(wfile)
+    with span("generate_page_actions"):
+        generate_page_actions(wfile, state.search is not None)
 
-    if state.player.playlist_pos >= 0:
+    # Always present so live updates can reveal it
+    with span("generate_page_player_status"):
         generate_page_player_status(wfile, state)
 
-    # If currently playing show seek bar
-    if (
-        not state.player.pause
-        and state.player.time_pos is not None
-        and state.player.seekable
-    ):
-        generate_goto_time(wfile)
-        generate_page_seek_bar(wfile, state)
+    # If currently playing show seek bar (hidden while paused so live updates can reveal it)
+    if state.player_state.time_pos is not None and state.player_state.seekable:
+        paused = state.player_state.pause
+        with span("generate_page_seek_bar"):
+            generate_goto_time(wfile, paused)
+            generate_page_seek_bar(wfile, state, paused)
 
     # Volume
-    if state.player.volume is not None:
-        generate_page_volume_slider(wfile, state)
+    if state.player_state.volume is not None:
+        with span("generate_page_volume_slider"):
+            generate_page_volume_slider(wfile, state)
 
     # Playlist
-    time_before, time_after = generate_page_queue(wfile, state, req)
+    with span("generate_page_queue"):
+        time_before, time_after = generate_page_queue(wfile, state, req)
 
     generate_page_watch_times(wfile, time_before, time_after)
@@ -0,0 +1,264 @@
+"""Persistent journal of the queue so it can be restored after a restart or crash"""
+
+import json
+import os
+import os.path
+import tempfile
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from math import floor
+from threading import Lock
+from time import perf_counter
+from typing import Any
+
+from .player_state import PlayerStateSnapshot
+from .thumbnail_cache import ThumbnailCache
+from .video_queue import VideoQueue, VideoQueueItem
+
+JOURNAL_FILE = "journal.jsonl"
+SNAPSHOT_FILE = "snapshot.json"
+
+DEFAULT_COMPACT_EVERY = 1000
+# Seconds of playback between recording the position
+POSITION_INTERVAL = 5
+
+# Item fields kept between runs, stream URLs expire so are resolved again
+_ITEM_FIELDS = (
+    "url",
+    "key",
+    "video_key",
+    "webpage_url",
+    "title",
+    "uploader",
+    "duration",
+    "duration_str",
+    "thumbnail",
+    "thumbnail_url",
+    "thumbnail_srcset",
+    "thumbnail_width",
+    "thumbnail_height",
+)
+
+
+@dataclass
+class JournalState:
+    """Queue state rebuilt from the journal
+
+    Attributes:
+        items           Fields of each queued item
+        playlist_pos    Index of the item that was playing, -1 if none
+        time_pos        Seconds into the item that was playing
+        seq             Sequence number of the last change included
+    """
+
+    items: list[dict[str, Any]] = field(default_factory=list)
+    playlist_pos: int = -1
+    time_pos: float = None
+    seq: int = 0
+
+    def apply(self, record: Mapping[str, Any]):
+        """Apply a journal record"""
+        op = record["op"]
+        if op == "append":
+            self.items.append(record["item"])
+        elif op == "update":
+            item = record["item"]
+            for i, queued in enumerate(self.items):
+                if _same_item(queued, item):
+                    self.items[i] = item
+                    break
+        elif op == "move":
+            self.items.insert(record["new"], self.items.pop(record["old"]))
+        elif op == "pos":
+            self.playlist_pos = record["playlist_pos"]
+            self.time_pos = record["time_pos"]
+        self.seq = record["seq"]
+
+
+class QueueJournal:
+    """Append-only journal of queue changes with periodic snapshots
+
+    Each change is written to the journal as a line of JSON and flushed so it survives the process
+    crashing. Every compact_every changes, and whenever the queue is reset to match mpv, the whole
+    state is written to a snapshot and the journal emptied. Records carry a sequence number so
+    ones already in the snapshot are skipped if the process stopped before the journal was
+    emptied.
+    """
+
+    def __init__(self, directory: str, compact_every: int = DEFAULT_COMPACT_EVERY):
+        directory = os.path.abspath(directory)
+        assert os.path.isdir(directory)
+        self._journal_path = os.path.join(directory, JOURNAL_FILE)
+        self._snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+        self._compact_every = compact_every
+        self._queue: VideoQueue = None
+        self._player_state: PlayerStateSnapshot = None
+        self._file = None
+        self._seq = 0
+        self._since_compact = 0
+        self._last_second = None
+        self._closed = False
+        self._lock = Lock()
+
+    def load(self) -> JournalState:
+        """Read the snapshot and apply the journal records after it"""
+        state = JournalState()
+        try:
+            with open(self._snapshot_path, "r", encoding="utf-8") as file:
+                state = JournalState(**json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError, TypeError):
+            pass
+        try:
+            with open(self._journal_path, "r", encoding="utf-8") as file:
+                for line in file:
+                    if len(line.strip()) == 0:
+                        continue
+                    try:
+                        record = json.loads(line)
+                        if record["seq"] > state.seq:
+                            state.apply(record)
+                    except (json.JSONDecodeError, KeyError, IndexError):
+                        # Partly written when the process stopped, later runs start a new line
+                        continue
+        except FileNotFoundError:
+            pass
+        return state
+
+    def restore(self, queue: VideoQueue, thumbnails: ThumbnailCache):
+        """Rebuild the queue and mpv playlist from the journal, without extracting the videos
+        again, must be called before record"""
+        start = perf_counter()
+        state = self.load()
+        items = []
+        for fields in state.items:
+            item = VideoQueueItem(**{name: fields.get(name) for name in _ITEM_FIELDS})
+            if item.thumbnail_url is not None:
+                # The thumbnail cache was deleted on exit, fetch again when shown
+                thumbnails.register(item.thumbnail_url)
+            items.append(item)
+        queue.restore(items, state.playlist_pos, state.time_pos)
+        self._seq = state.seq
+        print(
+            "Restored {} queue items in {:.1f}ms".format(
+                len(items), (perf_counter() - start) * 1000
+            )
+        )
+
+    def record(self, queue: VideoQueue, player_state: PlayerStateSnapshot):
+        """Start writing changes to the queue and playback position to the journal"""
+        self._queue = queue
+        self._player_state = player_state
+        if self._seq == 0:
+            # Nothing restored, start again from the empty queue
+            self.compact()
+        else:
+            with self._lock:
+                # pylint: disable-next=consider-using-with
+                self._file = open(self._journal_path, "a", encoding="utf-8")
+                # The last record may have been partly written
+                self._file.write("\n")
+        queue.add_listener(self._on_queue_change)
+        player_state.add_listener(self._on_player_change)
+
+    def compact(self):
+        """Write a snapshot of the current state and empty the journal"""
+        # Always the queue lock first, as it is held when the queue calls listeners
+        with self._queue.lock, self._lock:
+            if self._closed:
+                return
+            state = JournalState(
+                [_item_fields(item) for item in self._queue.snapshot()],
+                self._player_state.playlist_pos,
+                self._player_state.time_pos,
+                self._seq,
+            )
+            _write_snapshot(self._snapshot_path, state)
+            if self._file is not None:
+                self._file.close()
+            # pylint: disable-next=consider-using-with
+            self._file = open(self._journal_path, "w", encoding="utf-8")
+            self._since_compact = 0
+
+    def close(self):
+        """Stop writing to the journal"""
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, record: dict[str, Any]) -> bool:
+        """Write a record, returns whether the journal should be compacted"""
+        with self._lock:
+            if self._file is None:
+                return False
+            self._seq += 1
+            record["seq"] = self._seq
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._file.flush()
+            self._since_compact += 1
+            return self._since_compact >= self._compact_every
+
+    def _on_queue_change(self, event: str, **data):
+        if event == "append":
+            compact = self._write({"op": "append", "item": _item_fields(data["item"])})
+        elif event == "update":
+            compact = self._write({"op": "update", "item": _item_fields(data["item"])})
+        elif event == "move":
+            compact = self._write(
+                {"op": "move", "old": data["old"], "new": data["new"]}
+            )
+        else:
+            # Too many changes to describe
+            compact = event == "reset"
+        if compact:
+            self.compact()
+
+    def _on_player_change(self, attr: str, _value):
+        if attr not in ("playlist_pos", "time_pos"):
+            return
+        time_pos = self._player_state.time_pos
+        second = None if time_pos is None else floor(time_pos / POSITION_INTERVAL)
+        if attr == "time_pos" and second == self._last_second:
+            return
+        self._last_second = second
+        if self._write(
+            {
+                "op": "pos",
+                "playlist_pos": self._player_state.playlist_pos,
+                "time_pos": time_pos,
+            }
+        ):
+            self.compact()
+
+
+def _item_fields(item: VideoQueueItem) -> dict[str, Any]:
+    return {name: getattr(item, name) for name in _ITEM_FIELDS}
+
+
+def _same_item(a: Mapping[str, Any], b: Mapping[str, Any]) -> bool:
+    if a.get("key") is not None:
+        return a.get("key") == b.get("key")
+    return a.get("url") == b.get("url")
+
+
+def _write_snapshot(path: str, state: JournalState):
+    # Write to a temporary file first so a crash never leaves a partial snapshot
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "items": state.items,
+                    "playlist_pos": state.playlist_pos,
+                    "time_pos": state.time_pos,
+                    "seq": state.seq,
+                },
+                file,
+            )
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
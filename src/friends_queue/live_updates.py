@@ -0,0 +1,101 @@
+"""Publish live player and queue updates to the event stream"""
+
+from io import BytesIO
+from math import floor
+
+from .event_stream import EventStream
+from .generate import (
+    generate_page_queue_item,
+    generate_page_queue_item_error,
+    generate_page_queue_item_loading,
+)
+from .player_state import PlayerStateSnapshot
+from .utils import seconds_duration
+from .video_queue import VideoQueue
+
+# Player properties sent as their own event when changed
+_PLAYER_EVENTS = {"pause", "volume", "playlist_pos", "media_title", "seekable"}
+# Player properties that cause a (throttled) position event
+_POSITION_PROPERTIES = {"time_pos", "duration"}
+
+
+def _render(generator, *args) -> str:
+    buffer = BytesIO()
+    generator(buffer, *args)
+    return buffer.getvalue().decode("utf-8")
+
+
+def publish_player_events(events: EventStream, player_state: PlayerStateSnapshot):
+    """Publish player snapshot changes, position updates are limited to once a second"""
+    last_second = None
+
+    def on_change(attr: str, value):
+        nonlocal last_second
+        if attr in _PLAYER_EVENTS:
+            events.publish(attr, value)
+        elif attr in _POSITION_PROPERTIES:
+            time_pos = player_state.time_pos
+            second = None if time_pos is None else floor(time_pos)
+            if attr == "time_pos" and second == last_second:
+                return
+            last_second = second
+            events.publish(
+                "position",
+                {
+                    "time_pos": seconds_duration(time_pos),
+                    "time_remaining": seconds_duration(player_state.time_remaining),
+                    "percent_pos": player_state.percent_pos,
+                    "duration": player_state.duration,
+                    "seekable": player_state.seekable,
+                },
+            )
+
+    player_state.add_listener(on_change)
+
+
+def publish_queue_events(
+    events: EventStream, queue: VideoQueue, player_state: PlayerStateSnapshot
+):
+    """Publish queue changes with pre-rendered HTML for new or changed items"""
+
+    def on_change(event: str, **data):
+        if event in ("append", "update"):
+            item = data["item"]
+            index = data.get("index")
+            if index is None:
+                index = queue.index(item)
+                if index < 0:
+                    return
+            current = index == player_state.playlist_pos
+            events.publish(
+                event,
+                {
+                    "index": index,
+                    "url": item.url,
+                    "html": _render(generate_page_queue_item, item, index, current),
+                },
+            )
+        elif event == "fetch":
+            url = data["url"]
+            events.publish(
+                event,
+                {"url": url, "html": _render(generate_page_queue_item_loading, url)},
+            )
+        elif event == "imported":
+            events.publish(event, {"url": data["url"]})
+        elif event == "error":
+            # Named so it isn't mistaken for EventSource's own error event
+            events.publish(
+                "fetch_error",
+                {
+                    "url": data["url"],
+                    "html": _render(generate_page_queue_item_error, data["error"]),
+                },
+            )
+        elif event == "move":
+            events.publish(event, {"old": data["old"], "new": data["new"]})
+        elif event == "reset":
+            # Too many changes to describe
+            events.publish("reload", None)
+
+    queue.add_listener(on_change)
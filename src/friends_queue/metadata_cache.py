@@ -0,0 +1,120 @@
+"""Persistent cache of video metadata"""
+
+import hashlib
+import json
+import os
+import os.path
+import tempfile
+from collections.abc import Mapping
+from time import time
+from typing import TYPE_CHECKING, Any, Optional
+
+from .canonical import extractor_video_key, info_video_key
+
+if TYPE_CHECKING:
+    import yt_dlp
+
+DEFAULT_TTL = 60 * 60 * 24 * 7  # 1 week
+
+# Info fields that stay valid, stream URLs in formats expire so are stripped
+_INFO_FIELDS = (
+    "id",
+    "extractor_key",
+    "webpage_url",
+    "fulltitle",
+    "title",
+    "uploader",
+    "duration",
+    "duration_string",
+    "thumbnails",
+)
+_FORMAT_FIELDS = (
+    "format_id",
+    "ext",
+    "width",
+    "height",
+    "fps",
+    "vcodec",
+    "acodec",
+    "tbr",
+    "vbr",
+    "abr",
+    "video_ext",
+    "audio_ext",
+)
+
+
+class MetadataCache:
+    """Cache of video metadata on disk, keyed by extractor and video ID
+
+    Wraps a YoutubeDL so it can be used in its place: extract_info answers from cache when the
+    video ID can be told from the URL and the entry has not expired. Cached info has no stream
+    URLs so the player resolves those itself when the video is played.
+    """
+
+    def __init__(
+        self, cache_dir: str, ytdl: "yt_dlp.YoutubeDL", ttl: int = DEFAULT_TTL
+    ):
+        self._cache_dir = os.path.abspath(cache_dir)
+        assert os.path.isdir(self._cache_dir)
+        self._ytdl = ytdl
+        self._ttl = ttl
+
+    def __getattr__(self, name: str):
+        return getattr(self._ytdl, name)
+
+    def extract_info(self, url: str, download: bool = False, **kwargs):
+        """Get video info from cache, falling back to extracting and caching it"""
+        if download or len(kwargs) > 0:
+            return self._ytdl.extract_info(url, download=download, **kwargs)
+
+        key = extractor_video_key(url)
+        if key is not None:
+            info = self.get(key)
+            if info is not None:
+                return info
+
+        info = self._ytdl.extract_info(url, download=False)
+        if info is not None:
+            self.put(info)
+        return info
+
+    def get(self, key: str) -> Optional[Mapping[str, Any]]:
+        """Get cached info for a video key, if not expired"""
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if entry.get("key") != key or entry.get("fetched", 0) + self._ttl < time():
+            return None
+        return entry["info"]
+
+    def put(self, info: Mapping[str, Any]):
+        """Store the long lived parts of extracted video info"""
+        if info.get("_type", "video") != "video":
+            return
+        key = info_video_key(info)
+        if key is None:
+            return
+        cached = {field: info[field] for field in _INFO_FIELDS if field in info}
+        if "formats" in info:
+            cached["formats"] = [
+                {field: fmt[field] for field in _FORMAT_FIELDS if field in fmt}
+                for fmt in info["formats"]
+            ]
+        entry = {"key": key, "fetched": time(), "info": cached}
+
+        # Write to a temporary file first so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, self._path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    def _path(self, key: str) -> str:
+        name = hashlib.sha256(bytes(key, "utf-8")).hexdigest()
+        return os.path.join(self._cache_dir, name + ".json")
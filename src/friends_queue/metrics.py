@@ -0,0 +1,236 @@
+"""Metrics in the Prometheus text format"""
+
+from bisect import bisect_left
+from collections.abc import Callable, Iterator, Sequence
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler
+from threading import Lock
+from time import perf_counter
+
+from .compression import send_compressed
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached static file to a slow extraction
+DEFAULT_BUCKETS = (
+    0.001,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+)
+
+
+class Counter:
+    """Count of events, optionally split by labels
+
+    Updates only hold the counter's own lock for an addition, so don't slow what they count.
+    """
+
+    metric_type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self._labels = tuple(labels)
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1):
+        """Add amount to the count for label values"""
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterator[str]:
+        """Get lines of the current values"""
+        with self._lock:
+            values = list(self._values.items())
+        for label_values, value in values:
+            yield "{}{} {}".format(
+                self.name, _format_labels(self._labels, label_values), value
+            )
+
+
+# pylint: disable-next=too-few-public-methods
+class Gauge:
+    """Value read when metrics are collected, so costs nothing until then"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        read: Callable[[], float],
+        metric_type: str = "gauge",
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self._read = read
+
+    def samples(self) -> Iterator[str]:
+        """Get a line of the current value"""
+        value = self._read()
+        if value is not None:
+            yield "{} {}".format(self.name, value)
+
+
+class Histogram:
+    """Distribution of observed values, optionally split by labels
+
+    Observations find their bucket before taking the lock, which is only held to increment it.
+    """
+
+    metric_type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self._labels = tuple(labels)
+        self._buckets = tuple(sorted(buckets))
+        # Non-cumulative count of each bucket then +Inf, sum
+        self._values: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+        self._lock = Lock()
+
+    def observe(self, value: float, *label_values: str):
+        """Record a value for label values"""
+        bucket = bisect_left(self._buckets, value)
+        with self._lock:
+            counts, total = self._values.get(label_values, (None, None))
+            if counts is None:
+                counts, total = [0] * (len(self._buckets) + 1), [0.0]
+                self._values[label_values] = (counts, total)
+            counts[bucket] += 1
+            total[0] += value
+
+    @contextmanager
+    def time(self, *label_values: str) -> Iterator[None]:
+        """Observe how many seconds the block takes, including if it raises"""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *label_values)
+
+    def samples(self) -> Iterator[str]:
+        """Get lines of cumulative bucket counts, sums and counts"""
+        with self._lock:
+            values = [
+                (label_values, list(counts), total[0])
+                for label_values, (counts, total) in self._values.items()
+            ]
+        for label_values, counts, total in values:
+            cumulative = 0
+            bounds = [str(bound) for bound in self._buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield "{}_bucket{} {}".format(
+                    self.name,
+                    _format_labels(self._labels + ("le",), label_values + (bound,)),
+                    cumulative,
+                )
+            labels = _format_labels(self._labels, label_values)
+            yield "{}_sum{} {}".format(self.name, labels, total)
+            yield "{}_count{} {}".format(self.name, labels, cumulative)
+
+
+class Registry:
+    """Metrics to collect"""
+
+    def __init__(self):
+        self._metrics: list[Counter | Gauge | Histogram] = []
+        self._lock = Lock()
+
+    def register(self, metric: Counter | Gauge | Histogram):
+        """Add a metric, returns it"""
+        with self._lock:
+            self._metrics = self._metrics + [metric]
+        return metric
+
+    def collect(self) -> str:
+        """Get all metrics in the text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.documentation))
+            lines.append("# TYPE {} {}".format(metric.name, metric.metric_type))
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def handle_request(self, handler: BaseHTTPRequestHandler):
+        """Respond with all metrics"""
+        content = bytes(self.collect(), "utf-8")
+        send_compressed(
+            handler,
+            [("Content-Type", CONTENT_TYPE), ("Cache-Control", "no-store")],
+            lambda wfile: wfile.write(content),
+        )
+
+    @staticmethod
+    def is_metrics_url(path: str) -> bool:
+        """Check if a path is the metrics URL"""
+        return path == METRICS_PATH
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if len(names) == 0:
+        return ""
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(
+                name,
+                str(value)
+                .replace("\\", "\\\\")
+                .replace('"', '\\"')
+                .replace("\n", "\\n"),
+            )
+            for name, value in zip(names, values)
+        )
+        + "}"
+    )
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = REGISTRY.register(
+    Histogram(
+        "friends_queue_http_request_duration_seconds",
+        "Time to handle HTTP requests by route",
+        ("route",),
+    )
+)
+FETCH_STAGE_DURATION = REGISTRY.register(
+    Histogram(
+        "friends_queue_fetch_stage_duration_seconds",
+        "Time spent in each stage of fetching a video",
+        ("stage",),
+    )
+)
+FETCHES = REGISTRY.register(
+    Counter(
+        "friends_queue_fetches_total",
+        "Finished video fetches by result",
+        ("result",),
+    )
+)
+SEARCHES = REGISTRY.register(
+    Counter(
+        "friends_queue_searches_total",
+        "Search suggestion requests by how they were answered",
+        ("result",),
+    )
+)
@@ -0,0 +1,309 @@
+"""Control an mpv process over its JSON IPC socket, in place of embedding libmpv"""
+
+import json
+import os
+import os.path
+import socket
+import subprocess
+import threading
+import traceback
+from collections.abc import Callable, Sequence
+from concurrent.futures import Future
+from itertools import count
+from queue import SimpleQueue
+from time import monotonic, sleep
+from typing import Any
+
+# Seconds to wait for mpv to listen on its socket, and for the reply to a command
+CONNECT_TIMEOUT = 10
+COMMAND_TIMEOUT = 10
+# Stop restarting mpv if it crashes more than MAX_RESTARTS times in RESTART_WINDOW seconds
+MAX_RESTARTS = 5
+RESTART_WINDOW = 60
+
+
+class IPCPlayer:
+    """The parts of mpv.MPV's interface used by the app, over mpv's JSON IPC
+
+    mpv runs in its own process so it never holds the GIL the HTTP threads need, and a crash
+    doesn't take the web interface down with it. Commands from any thread are written to the
+    socket straight away and matched to their replies by request ID, so many can be in flight at
+    once. Properties are read and written as attributes with underscores instead of hyphens, and
+    observers are called from one event thread like python-mpv.
+
+    A launched mpv that crashes is started again, its restart listeners are called to load the
+    playlist again and then observers are registered again. An mpv that quits is not restarted.
+    """
+
+    def __init__(self, socket_path: str, args: Sequence[str] = None):
+        """Attach to an mpv listening on socket_path, or launch mpv with args that make it listen
+        there"""
+        self._socket_path = socket_path
+        self._args = None if args is None else list(args)
+        self._process: subprocess.Popen = None
+        self._socket: socket.socket = None
+        self._write_lock = threading.Lock()
+        self._pending: dict[int, Future] = {}
+        self._pending_lock = threading.Lock()
+        self._request_ids = count()
+        self._observers: dict[int, tuple[str, Callable[[str, Any], None]]] = {}
+        self._observer_ids = count(1)
+        self._restart_listeners: list[Callable[[], None]] = []
+        self._restarts: list[float] = []
+        self._events: SimpleQueue[dict] = SimpleQueue()
+        self._connected = threading.Event()
+        self._shutdown = threading.Event()
+        self._terminating = False
+        threading.Thread(target=self._dispatch_events, daemon=True).start()
+        self._start()
+
+    @classmethod
+    def launch(cls, socket_path: str, executable: str = "mpv", **options: Any):
+        """Launch mpv with options, which are named like mpv.MPV's keyword arguments"""
+        args = [executable, "--input-ipc-server=" + socket_path]
+        for name, value in options.items():
+            args.append("--{}={}".format(_mpv_name(name), _mpv_value(value)))
+        return cls(socket_path, args)
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self.command("get_property", _mpv_name(name))
+        except SystemError as error:
+            # Like python-mpv, e.g. media-title when nothing is playing
+            if error.args[-1] == "property unavailable":
+                return None
+            raise
+
+    def __setattr__(self, name: str, value):
+        if name.startswith("_"):
+            super().__setattr__(name, value)
+        else:
+            self.command("set_property", _mpv_name(name), value)
+
+    def command(self, *args: Any) -> Any:
+        """Run a command and wait for its result"""
+        return self.command_async(*args).result(COMMAND_TIMEOUT)
+
+    def command_async(self, *args: Any) -> Future:
+        """Send a command without waiting for it to run, returns a future of its result"""
+        return self._send(list(args))
+
+    def loadfile(self, filename: str, mode: str = "replace", **options: Any):
+        """Load a file or URL, options are set for just this file"""
+        command = {"name": "loadfile", "url": filename, "flags": mode}
+        if len(options) > 0:
+            # Named so it works before and after mpv 0.38 added the index argument
+            command["options"] = ",".join(
+                "{}={}".format(_mpv_name(name), _quote(_mpv_value(value)))
+                for name, value in options.items()
+            )
+        self._send(command).result(COMMAND_TIMEOUT)
+
+    def playlist_move(self, index1: int, index2: int):
+        """Move the playlist entry at index1 to before the entry at index2"""
+        self.command("playlist-move", index1, index2)
+
+    def playlist_remove(self, index: int = "current"):
+        """Remove a playlist entry"""
+        self.command("playlist-remove", index)
+
+    def playlist_next(self, mode: str = "weak"):
+        """Play the next playlist entry"""
+        self.command("playlist-next", mode)
+
+    def playlist_prev(self, mode: str = "weak"):
+        """Play the previous playlist entry"""
+        self.command("playlist-prev", mode)
+
+    def seek(self, amount, reference: str = "relative", precision: str = None):
+        """Seek in the playing file"""
+        args = ["seek", amount, reference]
+        if precision is not None:
+            args.append(precision)
+        self.command(*args)
+
+    def quit(self, code: int = None):
+        """Quit mpv, which isn't restarted"""
+        args = ["quit"] if code is None else ["quit", code]
+        # mpv may close the socket before replying
+        self.command_async(*args)
+
+    def observe_property(self, name: str, handler: Callable[[str, Any], None]):
+        """Call handler with (name, value) from the event thread when a property changes, and
+        once with its current value"""
+        observer_id = next(self._observer_ids)
+        self._observers[observer_id] = (name, handler)
+        self.command("observe_property", observer_id, _mpv_name(name))
+
+    def add_restart_listener(self, listener: Callable[[], None]):
+        """Register a function called after mpv is restarted, before observers are registered
+        again"""
+        self._restart_listeners.append(listener)
+
+    def wait_for_shutdown(self, timeout: float = None) -> bool:
+        """Wait until mpv has quit and won't be restarted, returns whether it has"""
+        return self._shutdown.wait(timeout)
+
+    def terminate(self):
+        """Quit mpv if it was launched, otherwise disconnect from it"""
+        self._terminating = True
+        if self._process is not None:
+            try:
+                self.quit()
+                self._process.wait(CONNECT_TIMEOUT)
+            except (ConnectionError, subprocess.TimeoutExpired):
+                self._process.kill()
+        elif self._socket is not None:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        self._shutdown.wait(CONNECT_TIMEOUT)
+
+    def _start(self):
+        """Launch mpv if not attaching and connect to it"""
+        if self._args is not None:
+            if os.path.exists(self._socket_path):
+                os.unlink(self._socket_path)
+            # pylint: disable-next=consider-using-with
+            self._process = subprocess.Popen(self._args, stdin=subprocess.DEVNULL)
+        deadline = monotonic() + CONNECT_TIMEOUT
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self._socket_path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                sock.close()
+                exited = self._process is not None and self._process.poll() is not None
+                if exited or monotonic() > deadline:
+                    raise ConnectionError(
+                        "Unable to connect to mpv at " + self._socket_path
+                    ) from None
+                sleep(0.05)
+        self._socket = sock
+        threading.Thread(target=self._read, args=(sock,), daemon=True).start()
+        self._connected.set()
+
+    def _send(self, command: list | dict) -> Future:
+        deadline = monotonic() + COMMAND_TIMEOUT
+        # Wait while mpv is being restarted
+        while not self._connected.wait(0.1):
+            if self._shutdown.is_set() or monotonic() > deadline:
+                raise ConnectionError("Not connected to mpv")
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._pending_lock:
+            self._pending[request_id] = future
+        data = json.dumps({"command": command, "request_id": request_id}) + "\n"
+        try:
+            with self._write_lock:
+                self._socket.sendall(bytes(data, "utf-8"))
+        except OSError as error:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            raise ConnectionError("Lost connection to mpv") from error
+        return future
+
+    def _read(self, sock: socket.socket):
+        """Read replies and events until mpv closes the connection"""
+        try:
+            with sock.makefile("rb") as file:
+                for line in file:
+                    try:
+                        message = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    if "event" in message:
+                        self._events.put(message)
+                    elif "request_id" in message:
+                        self._reply(message)
+        except OSError:
+            pass
+        self._disconnected(sock)
+
+    def _reply(self, message: dict):
+        with self._pending_lock:
+            future = self._pending.pop(message["request_id"], None)
+        if future is None:
+            return
+        error = message.get("error")
+        if error == "success":
+            future.set_result(message.get("data"))
+        else:
+            # python-mpv raises SystemError when a command fails
+            future.set_exception(SystemError("Error running mpv command", error))
+
+    def _disconnected(self, sock: socket.socket):
+        self._connected.clear()
+        sock.close()
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+        for future in pending.values():
+            future.set_exception(ConnectionError("Lost connection to mpv"))
+
+        if not self._should_restart():
+            self._shutdown.set()
+            return
+        try:
+            self._start()
+            for listener in self._restart_listeners:
+                listener()
+            for observer_id, (name, _handler) in self._observers.items():
+                self.command("observe_property", observer_id, _mpv_name(name))
+        except (OSError, SystemError) as error:
+            # Includes failing to launch mpv again, if it crashed again once connected this is
+            # called again from the new connection
+            traceback.print_exception(error)
+            if not self._connected.is_set():
+                self._shutdown.set()
+
+    def _should_restart(self) -> bool:
+        """Check if mpv crashed and hasn't crashed too often"""
+        if self._process is None or self._terminating:
+            return False
+        try:
+            code = self._process.wait(CONNECT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # Closed the connection but is still running
+            self._process.kill()
+            code = self._process.wait()
+        if code == 0:
+            return False
+        now = monotonic()
+        self._restarts = [t for t in self._restarts if now - t < RESTART_WINDOW]
+        self._restarts.append(now)
+        if len(self._restarts) > MAX_RESTARTS:
+            print("mpv keeps exiting with errors, not restarting it")
+            return False
+        print("mpv exited with code {}, restarting it".format(code))
+        return True
+
+    def _dispatch_events(self):
+        """Call observers from one thread so they see changes in order"""
+        while True:
+            event = self._events.get()
+            if event.get("event") != "property-change":
+                continue
+            observer = self._observers.get(event.get("id"))
+            if observer is None:
+                continue
+            try:
+                observer[1](event.get("name"), event.get("data"))
+            # pylint: disable-next=broad-exception-caught
+            except Exception as error:
+                traceback.print_exception(error)
+
+
+def _mpv_name(name: str) -> str:
+    return name.replace("_", "-")
+
+
+def _mpv_value(value: Any) -> str:
+    if isinstance(value, bool):
+        return "yes" if value else "no"
+    return str(value)
+
+
+def _quote(value: str) -> str:
+    """Quote a value in an option list, so commas in URLs don't split it"""
+    return "%{}%{}".format(len(bytes(value, "utf-8")), value)
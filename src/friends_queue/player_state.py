@@ -0,0 +1,74 @@
+"""Snapshot of player state kept up to date by mpv property observers"""
+
+from collections.abc import Callable
+from dataclasses import dataclass, field, fields
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import mpv
+
+
+@dataclass
+class PlayerStateSnapshot:
+    """Last known values of the player properties used when rendering
+
+    Each attribute is replaced as a whole by mpv's event thread so it can be read from any thread
+    without locking or a round-trip to the mpv core. Attribute names match the python-mpv property
+    names (underscores instead of hyphens).
+    """
+
+    pause: bool = False
+    time_pos: float = None
+    seekable: bool = False
+    duration: float = None
+    percent_pos: float = None
+    time_remaining: float = None
+    volume: float = None
+    playlist_pos: int = -1
+    media_title: str = None
+    video_format: str = None
+    video_codec: str = None
+    hwdec_current: str = None
+    width: int = None
+    height: int = None
+    decoder_frame_drop_count: int = None
+    frame_drop_count: int = None
+    _listeners: list[Callable[[str, object], None]] = field(
+        default_factory=list, repr=False, compare=False
+    )
+    _version: int = field(default=0, repr=False, compare=False)
+
+    @property
+    def version(self) -> int:
+        """Number of changes made to the snapshot, increases every time a property changes"""
+        return self._version
+
+    def observe(self, player: "mpv.MPV"):
+        """Register property observers on player to keep snapshot up to date"""
+        for attr in _DEFAULTS:
+            player.observe_property(attr.replace("_", "-"), self._on_change)
+
+    def add_listener(self, listener: Callable[[str, object], None]):
+        """Register a function called with (attribute, value) after the snapshot changes
+
+        Listeners are called from mpv's event thread so must not block.
+        """
+        self._listeners.append(listener)
+
+    def _on_change(self, name: str, value):
+        attr = name.replace("-", "_")
+        if value is None:
+            # Property unavailable (e.g. nothing playing) so fall back to default
+            value = _DEFAULTS[attr]
+        setattr(self, attr, value)
+        # Only changed from mpv's event thread so doesn't need a lock
+        self._version += 1
+        for listener in self._listeners:
+            listener(attr, value)
+
+
+_DEFAULTS = {
+    attr.name: attr.default
+    for attr in fields(PlayerStateSnapshot)
+    if not attr.name.startswith("_")
+}
@@ -0,0 +1,229 @@
+"""Search suggestions for links being typed, from flat searches kept in a short lived cache"""
+
+import re
+import traceback
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import RLock
+from time import monotonic
+from typing import TYPE_CHECKING, Optional
+
+from .metrics import SEARCHES
+from .thumbnail_cache import ThumbnailCache
+from .utils import seconds_duration
+
+if TYPE_CHECKING:
+    import yt_dlp
+
+DEFAULT_WORKERS = 2
+DEFAULT_RESULTS = 8
+DEFAULT_TTL = 60 * 10
+DEFAULT_MAX_QUERIES = 256
+# Seconds a request waits for a search before answering with nothing
+SEARCH_TIMEOUT = 15
+# Longer queries are cut to this length
+MAX_QUERY_LENGTH = 100
+# Smallest thumbnail at least this wide is used, suggestions show them small
+THUMBNAIL_WIDTH = 160
+
+
+@dataclass
+class Suggestion:
+    """A search result to suggest"""
+
+    url: str
+    title: str
+    uploader: str
+    duration: str
+    thumbnail: str
+
+
+@dataclass
+class Suggestions:
+    """Suggestions for a query, incomplete when answered from a shorter query's results while
+    the search for the query itself runs"""
+
+    query: str
+    results: list[Suggestion]
+    complete: bool
+
+
+def normalise_query(query: str) -> str:
+    """Normalise a query so ones differing only by case and whitespace share results"""
+    return " ".join(query.lower().split())[:MAX_QUERY_LENGTH]
+
+
+# pylint: disable-next=too-few-public-methods
+class SearchCache:
+    """Runs flat searches on a bounded pool and keeps results in an LRU cache with a TTL
+
+    Searches are flat so only list results without resolving each video. Requests for a query
+    already being searched wait on the same search. Queued searches are cancelled when a query
+    extending or shortening them arrives, as that is someone still typing. While a query is
+    searched it's answered straight away from the results of its longest cached prefix that
+    still match, and the search's results are cached for the next request.
+    """
+
+    def __init__(
+        self,
+        ytdl: "yt_dlp.YoutubeDL",
+        thumbnails: ThumbnailCache,
+        workers: int = DEFAULT_WORKERS,
+        ttl: int = DEFAULT_TTL,
+        max_queries: int = DEFAULT_MAX_QUERIES,
+    ):
+        self._ytdl = ytdl
+        self._thumbnails = thumbnails
+        self._ttl = ttl
+        self._max_queries = max_queries
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="search"
+        )
+        self._cache: OrderedDict[str, tuple[float, list[Suggestion]]] = OrderedDict()
+        self._pending: dict[str, Future] = {}
+        # Re-entrant as cancelling a search runs its done callback on the same thread
+        self._lock = RLock()
+
+    def search(self, query: str, partial: bool = True) -> Suggestions:
+        """Get suggestions for a query, from cache if possible. If partial a search that isn't
+        cached is answered from the cached results of a prefix instead of waiting for it
+        """
+        query = normalise_query(query)
+        if len(query) == 0:
+            return Suggestions(query, [], True)
+
+        with self._lock:
+            results = self._cached(query)
+            if results is not None:
+                SEARCHES.inc("hit")
+                return Suggestions(query, results, True)
+            future = self._pending.get(query)
+            if future is None:
+                self._cancel_superseded(query)
+                future = self._executor.submit(self._search, query)
+                future.add_done_callback(lambda done: self._finished(query, done))
+                self._pending[query] = future
+            results = self._from_prefix(query) if partial else None
+
+        if results is not None:
+            SEARCHES.inc("prefix")
+            return Suggestions(query, results, False)
+        try:
+            results = future.result(SEARCH_TIMEOUT)
+        except (CancelledError, TimeoutError):
+            SEARCHES.inc("superseded")
+            return Suggestions(query, [], False)
+        if results is None:
+            SEARCHES.inc("error")
+            return Suggestions(query, [], True)
+        SEARCHES.inc("miss")
+        return Suggestions(query, results, True)
+
+    def _cached(self, query: str) -> Optional[list[Suggestion]]:
+        """Get unexpired results of a query, caller must hold the lock"""
+        entry = self._cache.get(query)
+        if entry is None:
+            return None
+        if monotonic() - entry[0] > self._ttl:
+            del self._cache[query]
+            return None
+        self._cache.move_to_end(query)
+        return entry[1]
+
+    def _from_prefix(self, query: str) -> Optional[list[Suggestion]]:
+        """Get the results of the longest cached prefix of query that match it, caller must hold
+        the lock"""
+        words = _words(query)
+        if len(words) == 0:
+            return None
+        for end in range(len(query) - 1, 0, -1):
+            results = self._cached(query[:end])
+            if results is None:
+                continue
+            matching = [result for result in results if _matches(result, words)]
+            return matching if len(matching) > 0 else None
+        return None
+
+    def _cancel_superseded(self, query: str):
+        """Cancel queued searches of queries that query extends or shortens, caller must hold
+        the lock"""
+        for other, future in list(self._pending.items()):
+            if query.startswith(other) or other.startswith(query):
+                # Searches already running can't be cancelled and are cached when done
+                future.cancel()
+
+    def _search(self, query: str) -> Optional[list[Suggestion]]:
+        try:
+            info = self._ytdl.extract_info(
+                "ytsearch{}:{}".format(DEFAULT_RESULTS, query), download=False
+            )
+        # pylint: disable-next=broad-exception-caught
+        except Exception as error:
+            traceback.print_exception(error)
+            return None
+        return [
+            self._suggestion(entry)
+            for entry in (info or {}).get("entries") or []
+            if entry is not None and entry.get("url") is not None
+        ]
+
+    def _suggestion(self, entry: dict) -> Suggestion:
+        thumbnail = _choose_thumbnail(entry.get("thumbnails"))
+        if thumbnail is None:
+            thumbnail = entry.get("thumbnail")
+        return Suggestion(
+            url=entry.get("webpage_url") or entry["url"],
+            title=entry.get("title"),
+            uploader=entry.get("uploader") or entry.get("channel"),
+            duration=(
+                None
+                if entry.get("duration") is None
+                else seconds_duration(entry["duration"])
+            ),
+            # Downloaded and cached when the page first shows it
+            thumbnail=(
+                None if thumbnail is None else self._thumbnails.register(thumbnail)
+            ),
+        )
+
+    def _finished(self, query: str, future: Future):
+        with self._lock:
+            if self._pending.get(query) is future:
+                del self._pending[query]
+            if future.cancelled() or future.result() is None:
+                # Failed searches aren't cached so are tried again
+                return
+            self._cache[query] = (monotonic(), future.result())
+            self._cache.move_to_end(query)
+            while len(self._cache) > self._max_queries:
+                self._cache.popitem(last=False)
+
+
+def _matches(result: Suggestion, words: list[str]) -> bool:
+    """Check a result has each whole word of a query, and a word starting with the last one
+    that may still be being typed"""
+    text_words = _words("{} {}".format(result.title or "", result.uploader or ""))
+    *whole, last = words
+    return all(word in text_words for word in whole) and any(
+        word.startswith(last) for word in text_words
+    )
+
+
+def _words(text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+def _choose_thumbnail(thumbnails: Optional[list[dict]]) -> Optional[str]:
+    """Choose the smallest thumbnail wide enough to show, or the last (usually largest) if none
+    are known to be"""
+    if not thumbnails:
+        return None
+    wide = [
+        thumbnail
+        for thumbnail in thumbnails
+        if "url" in thumbnail and (thumbnail.get("width") or 0) >= THUMBNAIL_WIDTH
+    ]
+    if len(wide) > 0:
+        return min(wide, key=lambda thumbnail: thumbnail["width"])["url"]
+    return thumbnails[-1].get("url")
@@ -0,0 +1,55 @@
+"""Time taken to reach milestones after the process started"""
+
+import os
+from threading import Lock
+from time import perf_counter
+from typing import Optional
+
+# Milestones, in the order they're usually reached
+LISTENING = "listening"
+FIRST_RESPONSE = "first response"
+YTDL_READY = "yt-dlp ready"
+FIRST_LINK = "first link resolved"
+MILESTONES = (LISTENING, FIRST_RESPONSE, YTDL_READY, FIRST_LINK)
+
+
+def _process_age() -> float:
+    """Seconds since the process started, 0 when that can't be read from /proc"""
+    try:
+        with open("/proc/self/stat", "r", encoding="utf-8") as file:
+            # Fields after the command, which may contain spaces, start at the state (field 3)
+            start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime", "r", encoding="utf-8") as file:
+            uptime = float(file.read().split()[0])
+        return max(uptime - start_ticks / os.sysconf("SC_CLK_TCK"), 0)
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class StartupTimer:
+    """Record how long after the process started each milestone was first reached"""
+
+    def __init__(self):
+        # Includes starting the interpreter and imports before this module where /proc is readable
+        self._start = perf_counter() - _process_age()
+        self._times: dict[str, float] = {}
+        self._lock = Lock()
+
+    def mark(self, milestone: str):
+        """Record and print the time a milestone was reached, if it's the first time"""
+        # Checked without the lock first as this is called for every request
+        if milestone in self._times:
+            return
+        with self._lock:
+            if milestone in self._times:
+                return
+            seconds = perf_counter() - self._start
+            self._times[milestone] = seconds
+        print("Startup: {} after {:.0f}ms".format(milestone, seconds * 1000))
+
+    def seconds(self, milestone: str) -> Optional[float]:
+        """Get seconds after start the milestone was reached, None if it hasn't been"""
+        return self._times.get(milestone)
+
+
+STARTUP = StartupTimer()
@@ -1,38 +1,72 @@
 """Serve static files"""
 
+import hashlib
 import os.path
 import os
 from http.server import BaseHTTPRequestHandler
 from collections.abc import MutableMapping, Sequence
 from io import FileIO
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from shutil import copyfileobj
-from time import time
 from mimetypes import guess_type
 
+from .compression import IDENTITY, available_encodings, choose_encoding, compress
+
 STATIC_PREFIX = "/static/"
 
 CACHE_MAX_AGE = 60 * 60 * 3  # 3 hours
 CACHE_CONTROL = "private, max_age={}".format(CACHE_MAX_AGE)
+# Fingerprinted URLs change whenever the content does so can be cached forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
 
 
 @dataclass
 class File:
-    """Data about a static file"""
+    """Data about one encoding of a static file"""
 
     file: FileIO
     content_type: str
     content_len: int
+    etag: str
 
 
-class StaticFiles:
-    """Manage serving static files"""
+@dataclass
+class Asset:
+    """A static file and its precompressed encodings
+
+    Attributes:
+        name            File name
+        url_name        File name including content hash
+        modified        Modification time of the source file
+        encodings       Files for each available encoding, including identity
+    """
+
+    name: str
+    url_name: str
+    modified: float
+    encodings: MutableMapping[str, File] = field(default_factory=dict)
+
 
-    def __init__(self, base_path: str, files: Sequence[str], use_sendfile=True):
+class StaticFiles:
+    """Manage serving static files
+
+    Files are served under their own name and a fingerprinted name that includes a hash of the
+    content, which clients may cache forever. Compressed encodings are written to cache_dir on
+    startup so they can be sent without compressing on each request.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        files: Sequence[str],
+        cache_dir: str,
+        use_sendfile=True,
+    ):
         assert os.path.isdir(base_path)
-        self._files: MutableMapping[str, FileIO] = {}
+        assert os.path.isdir(cache_dir)
+        self._assets: MutableMapping[str, Asset] = {}
+        self._urls: MutableMapping[str, Asset] = {}
         self._use_sendfile = use_sendfile
-        self._modified = None
 
         # Open files
         for file_name in files:
@@ -40,49 +74,58 @@ class StaticFiles:
             assert os.path.isfile(path)
 
             print("Loading", file_name, path)
+            asset = _load_asset(path, file_name, cache_dir)
+            self._assets[file_name] = asset
+            self._urls[file_name] = asset
+            self._urls[asset.url_name] = asset
 
-            # pylint: disable=consider-using-with
-            file = open(path, "rb")
-            file.seek(0, os.SEEK_END)
-            self._files[file_name] = File(
-                file=file, content_type=guess_type(path)[0], content_len=file.tell()
-            )
+    def url(self, file_name: str) -> str:
+        """Get the fingerprinted URL of a static file"""
+        return "." + STATIC_PREFIX + self._assets[file_name].url_name
 
     def handle_request(self, handler: BaseHTTPRequestHandler, path: str):
         """Handle a request, caller must check path is a static URL prior to calling"""
-        file_name = path[len(STATIC_PREFIX) :]
+        url_name = path[len(STATIC_PREFIX) :]
 
-        if not file_name in self._files:
-            print("Static not found", file_name)
+        asset = self._urls.get(url_name)
+        if asset is None:
+            print("Static not found", url_name)
             handler.send_error(404)
             return
 
-        file = self._files[file_name]
-        assert file is not None
-
-        if self._modified is None:
-            self._modified = handler.date_time_string(timestamp=time())
+        encoding = choose_encoding(
+            handler.headers.get("Accept-Encoding"), asset.encodings.keys()
+        )
+        file = asset.encodings[encoding]
+        modified = handler.date_time_string(timestamp=asset.modified)
+        if url_name == asset.url_name:
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = CACHE_CONTROL
 
         # Check if client has cached
+        none_match = handler.headers.get("If-None-Match")
         modified_since = handler.headers.get("If-Modified-Since")
-        if modified_since is not None and modified_since == self._modified:
+        if (none_match is not None and file.etag in _parse_etags(none_match)) or (
+            none_match is None and modified_since == modified
+        ):
             handler.send_response(304)
-            handler.send_header(
-                "Expires", handler.date_time_string(timestamp=time() + 30)
-            )
-            handler.send_header("Content-Type", file.content_type)
-            handler.send_header("Content-Length", file.content_len)
-            handler.send_header("Cache-Control", CACHE_CONTROL)
-            handler.send_header("Last-Modified", self._modified)
+            handler.send_header("ETag", file.etag)
+            handler.send_header("Cache-Control", cache_control)
+            handler.send_header("Last-Modified", modified)
+            handler.send_header("Vary", "Accept-Encoding")
             handler.end_headers()
             return
 
-        # Send image
         handler.send_response(200)
         handler.send_header("Content-Type", file.content_type)
         handler.send_header("Content-Length", file.content_len)
-        handler.send_header("Cache-Control", CACHE_CONTROL)
-        handler.send_header("Last-Modified", self._modified)
+        if encoding != IDENTITY:
+            handler.send_header("Content-Encoding", encoding)
+        handler.send_header("ETag", file.etag)
+        handler.send_header("Cache-Control", cache_control)
+        handler.send_header("Last-Modified", modified)
+        handler.send_header("Vary", "Accept-Encoding")
         handler.end_headers()
         if self._use_sendfile:
             handler.request.sendfile(file.file, offset=0, count=file.content_len)
@@ -94,3 +137,36 @@ class StaticFiles:
     def is_static_url(path: str) -> bool:
         """Check if a path references a static file"""
         return path.startswith(STATIC_PREFIX)
+
+
+def _load_asset(path: str, file_name: str, cache_dir: str) -> Asset:
+    with open(path, "rb") as file:
+        content = file.read()
+    content_type = guess_type(path)[0]
+    content_hash = hashlib.sha256(content).hexdigest()[:16]
+    stem, ext = os.path.splitext(file_name)
+    asset = Asset(file_name, f"{stem}.{content_hash}{ext}", os.path.getmtime(path))
+
+    # pylint: disable=consider-using-with
+    for encoding in available_encodings():
+        compressed = compress(content, encoding)
+        if len(compressed) >= len(content):
+            continue
+        compressed_path = os.path.join(cache_dir, f"{asset.url_name}.{encoding}")
+        with open(compressed_path, "wb") as file:
+            file.write(compressed)
+        asset.encodings[encoding] = File(
+            open(compressed_path, "rb"),
+            content_type,
+            len(compressed),
+            f'"{content_hash}-{encoding}"',
+        )
+    # Last as encodings are in order of preference
+    asset.encodings[IDENTITY] = File(
+        open(path, "rb"), content_type, len(content), f'"{content_hash}"'
+    )
+    return asset
+
+
+def _parse_etags(header: str) -> Sequence[str]:
+    return [etag.strip().removeprefix("W/") for etag in header.split(",")]
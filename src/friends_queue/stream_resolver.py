@@ -0,0 +1,111 @@
+"""Re-resolve stream URLs of upcoming queue items before they play"""
+
+from threading import Condition, Thread
+from time import time
+import traceback
+from typing import TYPE_CHECKING
+
+from .player_state import PlayerStateSnapshot
+from .video_queue import VideoQueue, VideoQueueItem, first_entry
+
+if TYPE_CHECKING:
+    import yt_dlp
+
+DEFAULT_LOOKAHEAD = 2
+# Signed stream URLs usually last a few hours, refresh well before that
+DEFAULT_STREAM_URL_TTL = 60 * 60
+# How often to re-check upcoming items while the current item plays
+CHECK_INTERVAL = 60
+
+
+class StreamResolver(Thread):
+    """Thread that keeps stream URLs of the next few queue items fresh
+
+    Items are checked whenever the playlist position or queue changes and periodically while an
+    item plays. Items never resolved (e.g. added from the metadata cache or imported from a
+    playlist) or resolved longer ago than the TTL are re-extracted and swapped into the mpv
+    playlist in place.
+    """
+
+    def __init__(
+        self,
+        ytdl: "yt_dlp.YoutubeDL",
+        queue: VideoQueue,
+        player_state: PlayerStateSnapshot,
+        lookahead: int = DEFAULT_LOOKAHEAD,
+        ttl: int = DEFAULT_STREAM_URL_TTL,
+    ):
+        super().__init__(daemon=True)
+        self._ytdl = ytdl
+        self._queue = queue
+        self._player_state = player_state
+        self._lookahead = lookahead
+        self._ttl = ttl
+        self._condition = Condition()
+        self._changed = True
+
+        player_state.add_listener(self._on_player_change)
+        queue.add_listener(self._on_queue_change)
+
+    def _on_player_change(self, attr: str, _value):
+        if attr == "playlist_pos":
+            self._wake()
+
+    def _on_queue_change(self, event: str, **_data):
+        if event in ("append", "move", "reset"):
+            self._wake()
+
+    def _wake(self):
+        with self._condition:
+            self._changed = True
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            with self._condition:
+                if not self._changed:
+                    self._condition.wait(CHECK_INTERVAL)
+                self._changed = False
+            for item in self._upcoming():
+                if self._is_stale(item):
+                    self._resolve(item)
+
+    def _upcoming(self) -> list[VideoQueueItem]:
+        start = self._player_state.playlist_pos + 1
+        # Copy so the queue can change while resolving
+        return list(self._queue[start : start + self._lookahead])
+
+    def _is_stale(self, item: VideoQueueItem) -> bool:
+        return item.resolved_at is None or item.resolved_at + self._ttl < time()
+
+    def _resolve(self, item: VideoQueueItem):
+        try:
+            # The URL may be search text, which would resolve to the search results
+            info = self._ytdl.extract_info(item.webpage_url or item.url, download=False)
+            entry = None if info is None else first_entry(info)
+            if entry is not None and entry.get("_type") == "url":
+                # Playlist entries are only listed flat, extract the video itself
+                info = self._ytdl.extract_info(entry["url"], download=False)
+            if info is None:
+                # Not found, leave it to mpv rather than extracting again every check
+                item.resolved_at = time()
+                return
+            if item.webpage_url is None:
+                # Queued before webpage URLs were kept, resolve the video directly next time
+                item.webpage_url = info.get("webpage_url")
+            if item.title is None:
+                # Placeholder from a playlist entry that had no metadata
+                self._queue.update_item(
+                    item,
+                    title=info.get("fulltitle"),
+                    uploader=info.get("uploader"),
+                    duration=info.get("duration"),
+                    duration_str=info.get("duration_string"),
+                )
+            if self._queue.refresh_streams(item, info):
+                print("Refreshed stream URLs for", item.url)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as error:
+            # Leave the old entry, mpv can still try to resolve it when played
+            traceback.print_exception(error)
+            item.resolved_at = time()
@@ -1,21 +1,46 @@
 """Caching for thumbnails"""
 
+import os
 import os.path
-from dataclasses import dataclass
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from dataclasses import dataclass, field
 from urllib.request import urlopen
 import hashlib
 from http.client import HTTPResponse
 from http.server import BaseHTTPRequestHandler
-from collections.abc import MutableMapping
-from io import FileIO
+from io import BufferedIOBase, FileIO
 from shutil import copyfileobj
+import tempfile
+from threading import Lock
 from time import time
+from typing import Optional
+import traceback
+
+from .tracing import span
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
 
 THUMBNAIL_PREFIX = "/thumbnails/"
 
+# Bytes read at a time when not using sendfile
+COPY_BUFSIZE = 64 * 1024
+
 CACHE_MAX_AGE = 60 * 60 * 24  # 24 hours
 CACHE_CONTROL = "private, max_age={}".format(CACHE_MAX_AGE)
 
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024  # 64 MiB
+DEFAULT_MAX_OPEN_FILES = 32
+# Source URLs remembered for thumbnails that aren't cached, least recently used are forgotten
+MAX_URLS = 8192
+
+# Queue tiles are 5em wide, make a 1x and 2x size for them
+VARIANT_WIDTHS = (96, 192)
+VARIANT_QUALITY = 75
+
 
 class HTTPException(Exception):
     """HTTP related error"""
@@ -23,9 +48,10 @@ class HTTPException(Exception):
 
 @dataclass
 class ThumbnailItem:
-    """Cached thumbnail data"""
+    """Cached thumbnail data, file is None when the handle has been closed to save descriptors"""
 
     file: FileIO
+    file_path: str
     content_type: str
     content_len: int
     timestamp: float
@@ -33,30 +59,167 @@ class ThumbnailItem:
     height: int = None
 
 
+@dataclass
+class ThumbnailCacheStats:
+    """Thumbnail cache counters, for sizing the cache
+
+    Attributes:
+        hits        Requests served from cache
+        misses      Requests for thumbnails not in cache
+        evictions   Thumbnails removed to stay within the byte budget
+        bytes       Total size of cached thumbnails
+        entries     Number of cached thumbnails
+        open_files  Number of cached file handles
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    bytes: int
+    entries: int
+    open_files: int
+
+
+@dataclass
+class _Download:
+    """In progress download, the lock is held while downloading"""
+
+    lock: Lock = field(default_factory=Lock)
+    waiters: int = 0
+
+
 class ThumbnailCache:
-    """A cache that manages fetching and storing thumbnails"""
+    """A cache that manages fetching and storing thumbnails
+
+    Least recently used thumbnails are deleted once the cache grows past max_bytes, and least
+    recently used file handles are closed once more than max_open_files are open. Evicted
+    thumbnails are downloaded again when next requested.
 
-    def __init__(self, cache_dir: str, use_sendfile=True):
+    When Pillow is installed each thumbnail is also downscaled to variant_widths and stored as
+    WebP, see srcset.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        use_sendfile=True,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_open_files: int = DEFAULT_MAX_OPEN_FILES,
+        variant_widths: tuple[int, ...] = VARIANT_WIDTHS,
+    ):
         """Create a thumbnail cache"""
         self._cache_dir = os.path.abspath(cache_dir)
         assert os.path.isdir(self._cache_dir)
-        self._cached: MutableMapping[str, ThumbnailItem] = {}
+        self._cached: OrderedDict[str, ThumbnailItem] = OrderedDict()
+        self._open: OrderedDict[str, None] = OrderedDict()
+        # Source URLs of thumbnails registered or cached so evicted ones can be fetched again
+        self._urls: OrderedDict[str, str] = OrderedDict()
+        self._downloads: MutableMapping[str, _Download] = {}
+        # Widths of the variants made of each thumbnail
+        self._variants: MutableMapping[str, tuple[int, ...]] = {}
+        self._variant_widths = variant_widths if Image is not None else ()
         self._use_sendfile = use_sendfile
+        self._max_bytes = max_bytes
+        self._max_open_files = max_open_files
+        self._lock = Lock()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
 
     def cache_thumbnail(self, url: str) -> str:
-        """Download an image from URL and return path to fetch from cache"""
+        """Download an image from URL and return path to fetch from cache
+
+        Concurrent calls for the same URL share a single download.
+        """
         thumb_hash = hashlib.sha512(bytes(url, "utf-8")).hexdigest()
         thumb_path = "." + THUMBNAIL_PREFIX + thumb_hash
+        with self._lock:
+            if self._is_cached(thumb_hash):
+                return thumb_path
+            download = self._downloads.get(thumb_hash)
+            if download is None:
+                download = _Download()
+                self._downloads[thumb_hash] = download
+            download.waiters += 1
+
+        try:
+            with download.lock:
+                with self._lock:
+                    # Finished while waiting for the lock
+                    if self._is_cached(thumb_hash):
+                        return thumb_path
+                    # Only variants were evicted, the original can't be while downloading
+                    item = self._cached.get(thumb_hash)
+                if item is None:
+                    item = self._download(url, thumb_hash)
+                variants = self._make_variants(item, thumb_hash)
+                with self._lock:
+                    self._add(thumb_hash, url, item)
+                    for width, variant in variants.items():
+                        self._add(_variant_hash(thumb_hash, width), url, variant)
+                    self._variants[thumb_hash] = tuple(variants.keys())
+                    self._evict()
+        finally:
+            with self._lock:
+                download.waiters -= 1
+                if download.waiters == 0:
+                    del self._downloads[thumb_hash]
+        return thumb_path
+
+    def register(self, url: str) -> str:
+        """Get the path a thumbnail would be cached at without downloading it, it is downloaded
+        when first requested"""
+        thumb_hash = hashlib.sha512(bytes(url, "utf-8")).hexdigest()
+        with self._lock:
+            self._remember(thumb_hash, url)
+            for width in self._variant_widths:
+                self._remember(_variant_hash(thumb_hash, width), url)
+        return "." + THUMBNAIL_PREFIX + thumb_hash
+
+    def srcset(self, thumb_path: str, width: int = None) -> Optional[str]:
+        """Get a srcset of the variants of a cached thumbnail, None if it has none"""
+        thumb_hash = thumb_path[len("." + THUMBNAIL_PREFIX) :]
+        with self._lock:
+            widths = self._variants.get(thumb_hash, ())
+        if len(widths) == 0:
+            return None
+        srcset = ["{0}-{1} {1}w".format(thumb_path, w) for w in widths]
+        if width is not None:
+            srcset.append("{} {}w".format(thumb_path, width))
+        return ", ".join(srcset)
+
+    def _is_cached(self, thumb_hash: str) -> bool:
+        """Check a thumbnail and all its variants are cached, must hold lock"""
+        widths = self._variants.get(thumb_hash)
+        if thumb_hash not in self._cached or widths is None:
+            return False
+        self._cached.move_to_end(thumb_hash)
+        return all(_variant_hash(thumb_hash, w) in self._cached for w in widths)
+
+    def _add(self, thumb_hash: str, url: str, item: ThumbnailItem):
+        """Add a thumbnail to the cache if not already, must hold lock"""
         if thumb_hash in self._cached:
-            return thumb_path
+            self._cached.move_to_end(thumb_hash)
+            return
+        self._remember(thumb_hash, url)
+        self._bytes += item.content_len
+        self._cached[thumb_hash] = item
+
+    def _remember(self, thumb_hash: str, url: str):
+        """Keep the source URL of a thumbnail, forgetting the least recently used once there
+        are too many, must hold lock"""
+        self._urls[thumb_hash] = url
+        self._urls.move_to_end(thumb_hash)
+        while len(self._urls) > MAX_URLS:
+            self._urls.popitem(last=False)
+
+    def _download(self, url: str, thumb_hash: str) -> ThumbnailItem:
         with urlopen(url) as res:
             if not isinstance(res, HTTPResponse):
                 raise HTTPException("Expected HTTP response")
             if res.status != 200:
                 raise HTTPException("Bad image status code")
-            content_length = res.headers.get("content-length")
-            if content_length is not None:
-                content_length = int(content_length)
             content_type = res.headers.get_content_type()
             if content_type is None or not content_type.startswith("image/"):
                 raise HTTPException(
@@ -64,58 +227,206 @@ class ThumbnailCache:
                     + str(content_type)
                 )
             file_path = os.path.join(self._cache_dir, thumb_hash)
-            with open(file_path, "wb") as file:
-                # Don't use sendfile here as res decodes
-                copyfileobj(res, file, length=content_length)
-        # pylint: disable=consider-using-with
-        file = open(file_path, "rb")
-        if content_length is None:
-            file.seek(0, os.SEEK_END)
-            content_length = file.tell()
-        self._cached[thumb_hash] = ThumbnailItem(
-            file, content_type, content_length, time()
+            # Write to a temporary file so a partial image is never served
+            fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+            try:
+                with open(fd, "wb") as file:
+                    # Don't use sendfile here as res decodes
+                    copyfileobj(res, file, COPY_BUFSIZE)
+                os.replace(tmp_path, file_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+        # The written size, as Content-Length may be missing or differ after decoding
+        return ThumbnailItem(
+            None, file_path, content_type, os.path.getsize(file_path), time()
         )
-        return thumb_path
+
+    def _make_variants(
+        self, item: ThumbnailItem, thumb_hash: str
+    ) -> dict[int, ThumbnailItem]:
+        """Downscale a thumbnail to each variant width narrower than it"""
+        variants = {}
+        if len(self._variant_widths) == 0:
+            return variants
+        try:
+            with Image.open(item.file_path) as image:
+                # JPEGs can be decoded at a reduced scale, much faster for large images
+                widest = max(self._variant_widths)
+                image.draft("RGB", (widest, image.height * widest // image.width))
+                if image.mode not in ("RGB", "RGBA"):
+                    image = image.convert("RGBA")
+                for width in self._variant_widths:
+                    if width < image.width:
+                        variants[width] = self._save_variant(image, thumb_hash, width)
+        # pylint: disable-next=broad-exception-caught
+        except Exception as error:
+            # The original can still be served
+            traceback.print_exception(error)
+        return variants
+
+    def _save_variant(self, image, thumb_hash: str, width: int) -> ThumbnailItem:
+        height = max(1, round(image.height * width / image.width))
+        variant = image.resize((width, height), Image.Resampling.LANCZOS)
+        file_path = os.path.join(self._cache_dir, _variant_hash(thumb_hash, width))
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, suffix=".tmp")
+        try:
+            with open(fd, "wb") as file:
+                variant.save(file, "WEBP", quality=VARIANT_QUALITY)
+            os.replace(tmp_path, file_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return ThumbnailItem(
+            None,
+            file_path,
+            "image/webp",
+            os.path.getsize(file_path),
+            time(),
+            width,
+            height,
+        )
+
+    def stats(self) -> ThumbnailCacheStats:
+        """Get cache counters"""
+        with self._lock:
+            return ThumbnailCacheStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                self._bytes,
+                len(self._cached),
+                len(self._open),
+            )
+
+    def close(self):
+        """Close cached file handles, they are opened again if another request comes"""
+        with self._lock:
+            for thumb_hash in list(self._open):
+                self._close(thumb_hash, self._cached[thumb_hash])
+
+    def _evict(self):
+        """Remove least recently used thumbnails until within budget, must hold lock"""
+        for thumb_hash in list(self._cached):
+            # Always keep the newest thumbnail even if it alone is over budget
+            if self._bytes <= self._max_bytes or len(self._cached) <= 1:
+                break
+            # Variants are being made from it
+            if thumb_hash in self._downloads:
+                continue
+            item = self._cached.pop(thumb_hash)
+            self._close(thumb_hash, item)
+            # Requests being served have their own descriptor so removing is safe
+            os.unlink(item.file_path)
+            self._bytes -= item.content_len
+            self._evictions += 1
+
+    def _close(self, thumb_hash: str, item: ThumbnailItem):
+        if item.file is not None:
+            item.file.close()
+            item.file = None
+            del self._open[thumb_hash]
+
+    def _open_descriptor(self, thumb_hash: str, item: ThumbnailItem) -> int:
+        """Get a new descriptor for a cached thumbnail, must hold lock"""
+        if item.file is None:
+            # pylint: disable=consider-using-with
+            item.file = open(item.file_path, "rb")
+            self._open[thumb_hash] = None
+            while len(self._open) > self._max_open_files:
+                oldest = next(iter(self._open))
+                self._close(oldest, self._cached[oldest])
+        else:
+            self._open.move_to_end(thumb_hash)
+        # Duplicate so the cached handle can be closed while the response is sent
+        return os.dup(item.file.fileno())
+
+    def _lookup(self, thumb_hash: str) -> (ThumbnailItem, int):
+        with self._lock:
+            item = self._cached.get(thumb_hash)
+            if item is None:
+                return (None, None)
+            self._cached.move_to_end(thumb_hash)
+            return (item, self._open_descriptor(thumb_hash, item))
 
     def handle_request(self, handler: BaseHTTPRequestHandler, path: str):
         """Handle a request, caller must check path is a thumbnail URL prior to calling"""
         thumb_hash = path[len(THUMBNAIL_PREFIX) :]
-        if thumb_hash in self._cached:
-            item = self._cached[thumb_hash]
-            assert item is not None
+        item, descriptor = self._lookup(thumb_hash)
+        if item is None:
+            with self._lock:
+                self._misses += 1
+                url = self._urls.get(thumb_hash)
+                if url is not None:
+                    self._urls.move_to_end(thumb_hash)
+            if url is None:
+                handler.send_error(404)
+                return
+            # Previously evicted, fetch again
+            try:
+                with span("download thumbnail"):
+                    self.cache_thumbnail(url)
+            except (OSError, HTTPException, ValueError) as error:
+                traceback.print_exception(error)
+                handler.send_error(502)
+                return
+            item, descriptor = self._lookup(thumb_hash)
+            if item is None:
+                handler.send_error(404)
+                return
+        else:
+            with self._lock:
+                self._hits += 1
 
-            item_modified = handler.date_time_string(timestamp=item.timestamp)
+        with open(descriptor, "rb") as file:
+            self._send(handler, item, file)
 
-            # Check if client has cached
-            modified_since = handler.headers.get("If-Modified-Since")
-            if modified_since is not None and modified_since == item_modified:
-                handler.send_response(304)
-                handler.send_header(
-                    "Expires", handler.date_time_string(timestamp=time() + 30)
-                )
-                handler.send_header("Content-Type", item.content_type)
-                handler.send_header("Content-Length", item.content_len)
-                handler.send_header("Cache-Control", CACHE_CONTROL)
-                handler.send_header("Last-Modified", item_modified)
-                handler.end_headers()
-                return
+    def _send(self, handler: BaseHTTPRequestHandler, item: ThumbnailItem, file: FileIO):
+        item_modified = handler.date_time_string(timestamp=item.timestamp)
 
-            # Send image
-            handler.send_response(200)
+        # Check if client has cached
+        modified_since = handler.headers.get("If-Modified-Since")
+        if modified_since is not None and modified_since == item_modified:
+            handler.send_response(304)
+            handler.send_header(
+                "Expires", handler.date_time_string(timestamp=time() + 30)
+            )
             handler.send_header("Content-Type", item.content_type)
             handler.send_header("Content-Length", item.content_len)
             handler.send_header("Cache-Control", CACHE_CONTROL)
             handler.send_header("Last-Modified", item_modified)
             handler.end_headers()
-            if self._use_sendfile:
-                handler.request.sendfile(item.file, offset=0, count=item.content_len)
-            else:
-                item.file.seek(0)
-                copyfileobj(item.file, handler.wfile, length=item.content_len)
+            return
+
+        # Send image
+        handler.send_response(200)
+        handler.send_header("Content-Type", item.content_type)
+        handler.send_header("Content-Length", item.content_len)
+        handler.send_header("Cache-Control", CACHE_CONTROL)
+        handler.send_header("Last-Modified", item_modified)
+        handler.end_headers()
+        if self._use_sendfile:
+            handler.request.sendfile(file, offset=0, count=item.content_len)
         else:
-            handler.send_error(404)
+            _copy_from_start(file, handler.wfile, item.content_len)
 
     @staticmethod
     def is_thumbnail_url(path: str) -> bool:
         """Check if a path references a thumbnail"""
         return path.startswith(THUMBNAIL_PREFIX)
+
+
+def _copy_from_start(file: FileIO, wfile: BufferedIOBase, length: int):
+    """Copy length bytes from the start of a file, reading at offsets as the descriptor shares
+    its position with the cached file and other responses"""
+    offset = 0
+    while offset < length:
+        chunk = os.pread(file.fileno(), min(COPY_BUFSIZE, length - offset), offset)
+        if len(chunk) == 0:
+            break
+        wfile.write(chunk)
+        offset += len(chunk)
+
+
+def _variant_hash(thumb_hash: str, width: int) -> str:
+    return "{}-{}".format(thumb_hash, width)
@@ -0,0 +1,268 @@
+"""Lightweight tracing of request and fetch stages, with optional profiling of slow requests"""
+
+import cProfile
+import heapq
+import marshal
+import random
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler
+from itertools import count
+from threading import Lock
+from time import perf_counter, time
+from typing import Optional
+
+from .compression import send_compressed
+
+DEBUG_PREFIX = "/debug/"
+TRACES_PATH = DEBUG_PREFIX + "traces"
+PROFILES_PATH = DEBUG_PREFIX + "profiles"
+
+DEFAULT_BUFFER_SIZE = 200
+DEFAULT_PROFILE_SAMPLE = 0.1
+
+
+@dataclass
+class Span:
+    """A timed stage of a trace
+
+    Attributes:
+        name        Stage name
+        start       Seconds from the start of the trace
+        depth       Number of spans this is inside of
+        duration    Seconds the stage took, None until it finishes
+    """
+
+    name: str
+    start: float
+    depth: int
+    duration: float = None
+
+
+@dataclass
+class Trace:
+    """Spans of one request or fetch
+
+    Attributes:
+        name        Kind of trace
+        detail      What was traced, e.g. the request path
+        started_at  Time the trace started
+        start       perf_counter when the trace started, span starts are relative to it
+        duration    Seconds the trace took, None until it finishes
+        spans       Stages in the order they started
+        depth       Number of spans currently open
+    """
+
+    name: str
+    detail: str
+    started_at: float
+    start: float = field(default_factory=perf_counter)
+    duration: float = None
+    spans: list[Span] = field(default_factory=list)
+    depth: int = 0
+
+
+@dataclass(order=True)
+class Profile:
+    """cProfile stats of a traced request"""
+
+    duration: float
+    id: int
+    name: str = field(compare=False)
+    stats: bytes = field(compare=False, repr=False)
+
+
+_CURRENT: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+class _SpanContext:
+    """Times a span of the current trace, a class rather than a generator to stay cheap"""
+
+    def __init__(self, trace: Trace, name: str):
+        self._trace = trace
+        self._span = Span(name, perf_counter() - trace.start, trace.depth)
+
+    def __enter__(self) -> Span:
+        self._trace.depth += 1
+        self._trace.spans.append(self._span)
+        return self._span
+
+    def __exit__(self, *_exc):
+        self._trace.depth -= 1
+        self._span.duration = perf_counter() - self._trace.start - self._span.start
+
+
+def span(name: str):
+    """Time a stage of the current trace, does nothing outside of a trace"""
+    trace = _CURRENT.get()
+    if trace is None:
+        return nullcontext()
+    return _SpanContext(trace, name)
+
+
+class Tracer:
+    """Keep the most recent traces, and profiles of the slowest sampled traces if enabled
+
+    Only one trace is profiled at a time as Python only allows one active profiler.
+    """
+
+    def __init__(self, buffer_size: int = DEFAULT_BUFFER_SIZE):
+        self._traces: deque[Trace] = deque(maxlen=buffer_size)
+        self._lock = Lock()
+        self._profile_slowest = 0
+        self._profile_sample = DEFAULT_PROFILE_SAMPLE
+        self._profiles: list[Profile] = []
+        self._profile_ids = count()
+        self._profiling = Lock()
+
+    def enable_profiling(self, slowest: int, sample: float = DEFAULT_PROFILE_SAMPLE):
+        """Profile a fraction sample of profiled traces, keeping the slowest"""
+        self._profile_slowest = slowest
+        self._profile_sample = sample
+
+    @contextmanager
+    def trace(
+        self, name: str, detail: str = "", profile: bool = False
+    ) -> Iterator[Trace]:
+        """Trace the block, profiling it if enabled and sampled"""
+        trace = Trace(name, detail, time())
+        token = _CURRENT.set(trace)
+        profiler = None
+        if (
+            profile
+            and self._profile_slowest > 0
+            and random.random() < self._profile_sample
+            and self._profiling.acquire(blocking=False)
+        ):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        try:
+            yield trace
+        finally:
+            trace.duration = perf_counter() - trace.start
+            _CURRENT.reset(token)
+            if profiler is not None:
+                profiler.disable()
+                self._profiling.release()
+                self._keep_profile(trace, profiler)
+            # Without spans there is nothing to see beyond the request metrics
+            if len(trace.spans) > 0:
+                with self._lock:
+                    self._traces.append(trace)
+
+    def _keep_profile(self, trace: Trace, profiler: cProfile.Profile):
+        with self._lock:
+            if (
+                len(self._profiles) >= self._profile_slowest
+                and trace.duration <= self._profiles[0].duration
+            ):
+                return
+        profiler.create_stats()
+        profile = Profile(
+            trace.duration,
+            next(self._profile_ids),
+            "{} {}".format(trace.name, trace.detail),
+            # The format pstats.Stats.dump_stats writes
+            marshal.dumps(profiler.stats),
+        )
+        with self._lock:
+            heapq.heappush(self._profiles, profile)
+            while len(self._profiles) > self._profile_slowest:
+                heapq.heappop(self._profiles)
+
+    def traces(self) -> list[Trace]:
+        """Get recent traces, newest first"""
+        with self._lock:
+            return list(reversed(self._traces))
+
+    def profiles(self) -> list[Profile]:
+        """Get kept profiles, slowest first"""
+        with self._lock:
+            return sorted(self._profiles, reverse=True)
+
+    def handle_request(self, handler: BaseHTTPRequestHandler, path: str):
+        """Handle a request, caller must check path is a debug URL prior to calling"""
+        if path == TRACES_PATH:
+            self._send_text(handler, _format_traces(self.traces()))
+        elif path == PROFILES_PATH:
+            self._send_text(handler, _format_profiles(self.profiles()))
+        elif path.startswith(PROFILES_PATH + "/"):
+            profile_id = path[len(PROFILES_PATH) + 1 :].removesuffix(".prof")
+            for profile in self.profiles():
+                if str(profile.id) == profile_id:
+                    self._send_profile(handler, profile)
+                    return
+            handler.send_error(404)
+        else:
+            handler.send_error(404)
+
+    @staticmethod
+    def _send_text(handler: BaseHTTPRequestHandler, text: str):
+        content = bytes(text, "utf-8")
+        send_compressed(
+            handler,
+            [
+                ("Content-Type", "text/plain; charset=utf-8"),
+                ("Cache-Control", "no-store"),
+            ],
+            lambda wfile: wfile.write(content),
+        )
+
+    @staticmethod
+    def _send_profile(handler: BaseHTTPRequestHandler, profile: Profile):
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/octet-stream")
+        handler.send_header("Content-Length", len(profile.stats))
+        handler.send_header(
+            "Content-Disposition",
+            'attachment; filename="profile-{}.prof"'.format(profile.id),
+        )
+        handler.end_headers()
+        handler.wfile.write(profile.stats)
+
+    @staticmethod
+    def is_debug_url(path: str) -> bool:
+        """Check if a path references a debug page"""
+        return path.startswith(DEBUG_PREFIX)
+
+
+def _format_traces(traces: list[Trace]) -> str:
+    lines = []
+    for trace in traces:
+        lines.append(
+            "{:9.2f}ms {} {}".format(trace.duration * 1000, trace.name, trace.detail)
+        )
+        for stage in trace.spans:
+            duration = (
+                "unfinished"
+                if stage.duration is None
+                else "{:.2f}ms".format(stage.duration * 1000)
+            )
+            lines.append(
+                "    {}{} +{:.2f}ms {}".format(
+                    "  " * stage.depth, stage.name, stage.start * 1000, duration
+                )
+            )
+    return "\n".join(lines) + "\n"
+
+
+def _format_profiles(profiles: list[Profile]) -> str:
+    if len(profiles) == 0:
+        return "No profiles, enable with --profile-slowest\n"
+    lines = [
+        "Load with python -m pstats <file>, or snakeviz",
+        "",
+    ]
+    for profile in profiles:
+        lines.append(
+            "{:9.2f}ms {} {}/{}.prof".format(
+                profile.duration * 1000, profile.name, PROFILES_PATH, profile.id
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+TRACER = Tracer()
@@ -1,16 +1,31 @@
 """Data classes"""
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections.abc import Mapping
-from threading import Condition
-
-import mpv
-import yt_dlp
+from threading import Condition, Event
+from typing import TYPE_CHECKING
 
+from .event_stream import EventStream
+from .metadata_cache import DEFAULT_TTL as DEFAULT_METADATA_TTL
+from .player_state import PlayerStateSnapshot
+from .search import DEFAULT_WORKERS as DEFAULT_SEARCH_WORKERS, SearchCache
 from .static_files import StaticFiles
-from .thumbnail_cache import ThumbnailCache
+from .stream_resolver import DEFAULT_LOOKAHEAD, DEFAULT_STREAM_URL_TTL
+from .thumbnail_cache import (
+    DEFAULT_MAX_BYTES as DEFAULT_THUMBNAIL_BYTES,
+    DEFAULT_MAX_OPEN_FILES as DEFAULT_THUMBNAIL_FILES,
+    ThumbnailCache,
+)
+from .tracing import DEFAULT_PROFILE_SAMPLE
 from .video_queue import VideoQueue
 
+if TYPE_CHECKING:
+    # Slow to import, only imported when used
+    import mpv
+    import yt_dlp
+
+DEFAULT_QUEUE_WINDOW = 50
+
 
 @dataclass
 class Config:
@@ -22,6 +37,24 @@ class Config:
         format_specifier    Override the yt-dl FORMAT SPECIFIER
         host                Set the IP address to listen on
         port                Set the port to listen on
+        server              HTTP server to use, "threaded" or "asyncio"
+        http_workers        Number of threads handling requests with the asyncio server
+        fetch_workers       Maximum number of videos to fetch info for at once
+        search_workers      Maximum number of searches for suggestions to run at once, 0
+                            disables suggestions
+        cache_dir           Directory for caches kept between runs (default ~/.cache/friends-queue)
+        metadata_ttl        Seconds to keep cached video metadata
+        lookahead           Number of upcoming items to keep stream URLs fresh for
+        stream_url_ttl      Seconds before an upcoming item's stream URLs are re-resolved
+        thumbnail_bytes     Maximum total size of cached thumbnails
+        thumbnail_files     Maximum number of open cached thumbnail files
+        queue_window        Number of queue items to render at once
+        restore_queue       Restore the queue from the journal of the last run
+        profile_slowest     Number of slowest profiled requests to keep, 0 disables profiling
+        profile_sample      Fraction of requests to profile when profiling is enabled
+        player              mpv to use, "embedded" libmpv or "ipc" to launch mpv in its own
+                            process and control it over JSON IPC
+        mpv_ipc             Socket path of an already running mpv's IPC server to control
     """
 
     debug: bool = False
@@ -29,19 +62,43 @@ class Config:
     format_specifier: str = None
     host: str = None
     port: int = None
+    server: str = "threaded"
+    http_workers: int = 8
+    fetch_workers: int = 3
+    search_workers: int = DEFAULT_SEARCH_WORKERS
+    cache_dir: str = None
+    metadata_ttl: int = DEFAULT_METADATA_TTL
+    lookahead: int = DEFAULT_LOOKAHEAD
+    stream_url_ttl: int = DEFAULT_STREAM_URL_TTL
+    thumbnail_bytes: int = DEFAULT_THUMBNAIL_BYTES
+    thumbnail_files: int = DEFAULT_THUMBNAIL_FILES
+    queue_window: int = DEFAULT_QUEUE_WINDOW
+    restore_queue: bool = True
+    profile_slowest: int = 0
+    profile_sample: float = DEFAULT_PROFILE_SAMPLE
+    player: str = "embedded"
+    mpv_ipc: str = None
 
 
 @dataclass
 class State:
-    """App state"""
+    """App state
+
+    The server starts listening with only config, ytdl, events and close_condition set, the rest
+    are set before ready is.
+    """
 
     config: Config
-    player: mpv.MPV
-    ytdl: yt_dlp.YoutubeDL
+    player: "mpv.MPV"
+    player_state: PlayerStateSnapshot
+    ytdl: "yt_dlp.YoutubeDL"
     static: StaticFiles
     thumbnails: ThumbnailCache
     queue: VideoQueue
+    events: EventStream
     close_condition: Condition
+    search: SearchCache = None
+    ready: Event = field(default_factory=Event)
 
 
 @dataclass
@@ -53,3 +110,4 @@ class RequestState:
     location_extra: str = "?"
     text: str = ""
     show_skipped_items: bool = False
+    queue_end: int = None
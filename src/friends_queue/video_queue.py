@@ -1,123 +1,443 @@
 """Manage the queue of videos"""
 
-from typing import List, Optional
-from dataclasses import dataclass
-from threading import Thread
-from collections.abc import Sequence
+from typing import TYPE_CHECKING, Any, Optional
+from dataclasses import dataclass, field
+from collections import deque
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from time import time
+from threading import RLock
+from urllib.parse import parse_qsl, urlsplit
 import traceback
 import sys
 
-import mpv
-import yt_dlp
-
+from .canonical import canonical_key, info_video_key
+from .fenwick import FenwickTree
+from .metrics import FETCH_STAGE_DURATION, FETCHES
+from .startup import FIRST_LINK, STARTUP
+from .tracing import TRACER, span
+from .fetch_scheduler import FetchScheduler, FetchStats
 from .thumbnail_cache import ThumbnailCache
 
+if TYPE_CHECKING:
+    import mpv
+    import yt_dlp
+
+# Fetch errors kept until shown, older ones are dropped
+MAX_RECENT_ERRORS = 20
+
 
 class VideoNotFoundException(Exception):
     """Thrown when a video was not found"""
 
 
+class DuplicateVideoException(Exception):
+    """Thrown when a fetched video turns out to already be queued"""
+
+
 @dataclass
 class VideoQueueItem:
-    """Video Queue item data"""
+    """Video Queue item data
+
+    Fields shown on the page must be changed with update so the cached HTML fragment is rebuilt.
+    """
 
     url: str
+    key: str = None
+    # Extractor key of the video when it differs from the key of the URL, e.g. for search text
+    video_key: str = None
+    # Page of the video the URL resolved to, the URL may be search text
+    webpage_url: str = None
     title: str = None
     uploader: str = None
     duration: int = None
     duration_str: str = None
     video_url: str = None
     audio_url: str = None
+    resolved_at: float = None
     thumbnail: str = None
+    thumbnail_url: str = None
+    thumbnail_srcset: str = None
+    thumbnail_width: int = None
+    thumbnail_height: int = None
+    version: int = field(default=0, compare=False)
+    # (version, HTML) of the last render of the item
+    fragment: tuple[int, bytes] = field(default=None, repr=False, compare=False)
 
+    def keys(self) -> list[str]:
+        """Get the keys the item is queued under"""
+        return [key for key in (self.key, self.video_key) if key is not None]
 
-# TODO: Lock queue
-class VideoQueue(List[VideoQueueItem]):
-    """Managed video queue"""
+    def update(self, **fields: Any):
+        """Set fields and invalidate the cached HTML fragment"""
+        for name, value in fields.items():
+            setattr(self, name, value)
+        self.version += 1
+
+
+@dataclass
+class ActiveFetch:
+    """A queued or in progress fetch"""
+
+    url: str
+    started: bool
+
+
+# pylint: disable-next=too-many-public-methods
+class VideoQueue:
+    """Managed video queue, kept in the same order as mpv's playlist
+
+    Changes are made under a lock while readers get an immutable snapshot of the items, so
+    rendering never blocks or sees a half made change. If mpv's playlist is changed outside the
+    queue (e.g. with mpv's own key bindings) the queue is changed to match it.
+    """
 
     def __init__(
-        self, player: mpv.MPV, ytdl: yt_dlp.YoutubeDL, thumbnails: ThumbnailCache
+        self,
+        player: "mpv.MPV",
+        ytdl: "yt_dlp.YoutubeDL",
+        thumbnails: ThumbnailCache,
+        scheduler: FetchScheduler,
     ):
-        super().__init__()
         self._player = player
         self._ytdl = ytdl
         self._thumbs = thumbnails
-        self._active: list[FetchVideoThread] = []
+        self._scheduler = scheduler
+        self._items: tuple[VideoQueueItem, ...] = ()
+        # Durations of items in the same order, for watch times without summing every item
+        self._durations = FenwickTree()
+        self._active: list[FetchVideoJob] = []
         self._errors: list[Exception] = []
-
-    def append(self, item: VideoQueueItem):
-        """Append a new video item to queue and add to mpv playlist"""
+        self._listeners: list[Callable[..., None]] = []
+        # Canonical keys of queued and fetching videos
+        self._keys: set[str] = set()
+        # Increased on every change, for clients checking if the queue changed
+        self._version = 0
+        # Re-entrant so play next can move while appending
+        self._lock = RLock()
+
+        player.observe_property("playlist", self._on_playlist_change)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator[VideoQueueItem]:
+        return iter(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    @property
+    def version(self) -> int:
+        """Number of changes made to the queue, increases every time listeners are notified"""
+        return self._version
+
+    @property
+    def lock(self) -> RLock:
+        """Lock held while the queue changes and listeners are told, hold it to read the items
+        consistently with the changes listeners have seen"""
+        return self._lock
+
+    def snapshot(self) -> tuple[VideoQueueItem, ...]:
+        """Get the current items, which won't change if the queue does"""
+        return self._items
+
+    def index(self, item: VideoQueueItem) -> int:
+        """Get the position of an item, -1 if it isn't in the queue"""
+        for i, queued in enumerate(self._items):
+            if queued is item:
+                return i
+        return -1
+
+    def watch_times(self, index: int) -> (float, float, float):
+        """Get the total duration of items before index, the item at index and items after it"""
+        with self._lock:
+            durations = self._durations
+            if not 0 <= index < len(durations):
+                # Nothing playing so everything counts as watched
+                return (durations.total(), 0, 0)
+            before = durations.prefix_sum(index)
+            current = durations[index]
+            return (before, current, durations.total() - before - current)
+
+    def update_item(self, item: VideoQueueItem, **fields: Any):
+        """Update fields of a queued item and notify listeners"""
+        with self._lock:
+            item.update(**fields)
+            index = self.index(item)
+            if index >= 0:
+                self._durations.set(index, item.duration or 0)
+        self.notify("update", item=item)
+
+    def add_listener(self, listener: Callable[..., None]):
+        """Register a function called with (event, **data) when the queue changes
+
+        Events are "fetch" (url), "append" (index, item), "update" (item), "move" (old, new),
+        "imported" (url) when a playlist's entries were appended, "error" (url, error) and
+        "reset" when the queue was changed to match mpv's playlist.
+        Listeners may be called from fetch threads, and while the queue is locked, so must not
+        block.
+        """
+        self._listeners.append(listener)
+
+    def notify(self, event: str, **data: Any):
+        """Call queue listeners with an event"""
+        with self._lock:
+            self._version += 1
+        for listener in self._listeners:
+            listener(event, **data)
+
+    def append(self, item: VideoQueueItem, play_next: bool = False):
+        """Append a new video item to queue and add to mpv playlist, optionally moving it to play
+        after the current item"""
         assert item is not None
 
-        args = {}
+        with self._lock:
+            self._loadfile(item, "append-play")
+
+            # Append to self after as player might error
+            self._keys.update(item.keys())
+            self._items += (item,)
+            self._durations.append(item.duration or 0)
+            index = len(self._items) - 1
+            self.notify("append", index=index, item=item)
+
+            if play_next:
+                next_index = self._player.playlist_pos + 1
+                if 0 < next_index < index:
+                    try:
+                        self.move(index, next_index)
+                    except SystemError:
+                        print("Unable to play next, mpv playlist has changed")
+
+    def extend(self, items: Sequence[VideoQueueItem], play_next: bool = False):
+        """Append several items to the queue and mpv playlist, optionally moving them to play
+        after the current item"""
+        with self._lock:
+            next_index = self._player.playlist_pos + 1
+            start = len(self._items)
+            for item in items:
+                self.append(item)
+            if play_next and 0 < next_index < start:
+                try:
+                    for i in range(len(items)):
+                        self.move(start + i, next_index + i)
+                except SystemError:
+                    print("Unable to play next, mpv playlist has changed")
+
+    def restore(
+        self,
+        items: Sequence[VideoQueueItem],
+        current: int = -1,
+        time_pos: float = None,
+    ):
+        """Fill an empty queue and mpv playlist with previously queued items, paused at time_pos
+        of the current item"""
+        with self._lock:
+            assert len(self._items) == 0
+            self._load_all(items, current, time_pos)
+            for item in items:
+                self._keys.update(item.keys())
+            self._set_items(items)
+            if 0 <= current < len(items):
+                self._player.pause = True
+                self._player.playlist_pos = current
+            self.notify("reset")
+
+    def reload_player(
+        self, current: int = -1, time_pos: float = None, pause: bool = False
+    ):
+        """Load the queue into a restarted mpv with an empty playlist, playing from time_pos of
+        the current item"""
+        with self._lock:
+            self._load_all(self._items, current, time_pos)
+            if 0 <= current < len(self._items):
+                self._player.pause = pause
+                self._player.playlist_pos = current
+
+    def _load_all(
+        self, items: Sequence[VideoQueueItem], current: int, time_pos: Optional[float]
+    ):
+        """Append items to mpv's playlist, starting the current item at time_pos"""
+        for i, item in enumerate(items):
+            if i == current and time_pos is not None:
+                self._loadfile(item, "append", start=str(time_pos))
+            else:
+                self._loadfile(item, "append")
+
+    def _set_items(self, items: list[VideoQueueItem]):
+        """Replace all items, must hold lock"""
+        self._items = tuple(items)
+        self._durations = FenwickTree(item.duration or 0 for item in items)
+
+    def _loadfile(self, item: VideoQueueItem, mode: str, **args: str):
         # This is basically replicating [ytdl_hook][1] find a way to call into that
         # [1]: https://github.com/mpv-player/mpv/blob/8536aaac3c2c22b77a596d0645ac99be20c0186a/player/lua/ytdl_hook.lua#L545
         if item.audio_url is not None:
             args["audio_file"] = item.audio_url
 
-        self._player.loadfile(item.video_url or item.url, mode="append-play", **args)
-
-        # Append to self after as player might error
-        super().append(item)
-
-    def append_url(self, url: str):
-        """Fetch video URL and asyncronously append to queue"""
+        self._player.loadfile(_playlist_filename(item), mode=mode, **args)
+
+    def refresh_streams(self, item: VideoQueueItem, info) -> bool:
+        """Replace an item's stream URLs with those from freshly extracted info, swapping the
+        item's mpv playlist entry in place. Returns whether the item was refreshed."""
+        info = first_entry(info)
+        video, audio = (None, None) if info is None else _get_stream_urls(info)
+        with self._lock:
+            index = self.index(item)
+            # Don't swap out the entry that is playing
+            if index < 0 or index == self._player.playlist_pos:
+                return False
+
+            # Resolved even without separate streams, so it isn't extracted again until stale
+            item.resolved_at = time()
+            if video is None:
+                # No separate streams, mpv will resolve when playing
+                return False
+            item.video_url = video.get("url")
+            item.audio_url = None if audio is None else audio.get("url")
+
+            # Add new entry at the end, move it in front of the old one then remove the old one
+            end = len(self._items)
+            self._loadfile(item, "append")
+            self._player.playlist_move(end, index)
+            self._player.playlist_remove(index + 1)
+            return True
+
+    def append_url(
+        self, url: str, play_next: bool = False, import_playlist: bool = False
+    ):
+        """Fetch video URL and asyncronously append to queue, play next fetches skip ahead of
+        other waiting fetches. Every entry of a playlist is queued only if import_playlist,
+        otherwise just the video the URL points to or the playlist's first."""
         if len(url.strip()) == 0:
             return  # Early return if no request provided
-        if self.has_been_queued(url):
-            return  # Early return if URL already in queue
-        thread = _fetch_video(self._ytdl, self._thumbs, self, url)
-        self._active.append(thread)
+        key = canonical_key(url, playlist=import_playlist)
+        with self._lock:
+            if not self.reserve(key):
+                return  # Early return if URL already in queue
+            job = FetchVideoJob(
+                self._ytdl,
+                self._thumbs,
+                self,
+                VideoQueueItem(url, key),
+                play_next,
+                import_playlist=import_playlist,
+            )
+            self._active.append(job)
+            # Before submitting, so listeners never see the job's events before its fetch
+            self.notify("fetch", url=url)
+        self._scheduler.submit(job.run, priority=play_next)
 
     def move(self, item_index: int, new_index: int):
         """Move queue items"""
-        assert 0 <= item_index < len(self)
-        assert 0 <= new_index < len(self)
-
-        if item_index == new_index:
-            return
-
-        item_value = self[item_index]
-        if item_index < new_index:
-            for i in range(item_index, new_index):
-                self[i] = self[i + 1]
-        else:
-            for i in range(new_index + 1, item_index):
-                self[i] = self[i - 1]
-        self[new_index] = item_value
-
-        self._player.playlist_move(item_index, new_index)
-
-    def has_been_queued(self, url: str):
-        """Check if a URL has already been queued"""
-
-        for item in self:
-            if item.url == url:
-                return True
-
-        for fetch_url in self.active_fetches():
-            if fetch_url == url:
-                return True
-
-        return False
-
-    def active_fetches(self) -> Sequence[str]:
-        """Get currently active fetches"""
-        for i, thread in enumerate(self._active):
-            if not thread.has_started() or (
-                not thread.is_in_queue() and thread.is_alive()
-            ):
-                yield thread.url()
-            else:
-                thread = self._active.pop(i)
-                error = thread.get_error()
-                if error is not None:
-                    self._errors.append(error)
-
-    def recent_errors(self) -> Sequence[Exception]:
-        """Get recent fetch exceptions"""
-        while len(self._errors) > 0:
-            yield self._errors.pop()
+        with self._lock:
+            items = list(self._items)
+            assert 0 <= item_index < len(items)
+            assert 0 <= new_index < len(items)
+
+            if item_index == new_index:
+                return
+
+            items.insert(new_index, items.pop(item_index))
+
+            try:
+                # mpv moves the item to before the entry currently at the target index
+                self._player.playlist_move(
+                    item_index, new_index + 1 if item_index < new_index else new_index
+                )
+            except SystemError:
+                # The playlist was changed outside the queue, catch up now
+                self._reconcile()
+                raise
+            self._set_items(items)
+            self.notify("move", old=item_index, new=new_index)
+
+    def has_been_queued(self, url: str) -> bool:
+        """Check if a URL has already been queued or is being fetched"""
+        key = canonical_key(url)
+        with self._lock:
+            return key in self._keys
+
+    def reserve(self, key: str) -> bool:
+        """Mark a video key as queued, returns False if it already was"""
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            return True
+
+    def release(self, key: str):
+        """Unmark a video key as queued, e.g. when fetching it failed"""
+        with self._lock:
+            self._keys.discard(key)
+
+    def active_fetches(self) -> Sequence[ActiveFetch]:
+        """Get fetches that are waiting for a worker or have not finished"""
+        with self._lock:
+            active = []
+            for job in self._active:
+                if not job.is_in_queue() and not job.is_done():
+                    active.append(job)
+                else:
+                    error = job.get_error()
+                    if error is not None:
+                        self._errors.append(error)
+            del self._errors[:-MAX_RECENT_ERRORS]
+            self._active = active
+        return [ActiveFetch(job.url(), job.has_started()) for job in active]
+
+    def fetch_stats(self) -> FetchStats:
+        """Get fetch backlog depth and worker utilisation"""
+        return self._scheduler.stats()
+
+    def recent_errors(self, clear: bool = True) -> Sequence[Exception]:
+        """Get recent fetch exceptions, newest first, clear so they are only shown once"""
+        with self._lock:
+            errors = self._errors
+            if clear:
+                self._errors = []
+        return errors[::-1]
+
+    def _on_playlist_change(self, _name: str, _value):
+        # The value may be from before changes made while the queue is locked, so only use it as
+        # a hint and read the playlist again once nothing else can change it
+        self._reconcile()
+
+    def _reconcile(self):
+        """Change the queue to match mpv's playlist"""
+        with self._lock:
+            playlist = self._player.playlist or []
+            filenames = [entry.get("filename") for entry in playlist]
+            if filenames == [_playlist_filename(item) for item in self._items]:
+                return
+
+            # Keep queue items for entries that are still there, in mpv's order
+            unmatched: dict[str, deque[VideoQueueItem]] = {}
+            for item in self._items:
+                unmatched.setdefault(_playlist_filename(item), deque()).append(item)
+            items = []
+            for filename in filenames:
+                matches = unmatched.get(filename)
+                if matches:
+                    items.append(matches.popleft())
+                else:
+                    # Added to mpv directly
+                    items.append(VideoQueueItem(filename))
+            for matches in unmatched.values():
+                for item in matches:
+                    self._keys.difference_update(item.keys())
+
+            print("Queue changed to match mpv playlist")
+            self._set_items(items)
+            self.notify("reset")
+
+
+@contextmanager
+def _stage(name: str) -> Iterator[None]:
+    """Time a stage of fetching a video for metrics and the current trace"""
+    with FETCH_STAGE_DURATION.time(name), span(name):
+        yield
 
 
 @dataclass
@@ -137,6 +457,38 @@ def _choose_thumbnail(thumbnails) -> _ThumbURL:
     return None
 
 
+def _playlist_filename(item: VideoQueueItem) -> str:
+    # Without stream URLs mpv resolves the page, the item's URL may be search text or a playlist
+    return item.video_url or item.webpage_url or item.url
+
+
+def first_entry(info: Mapping[str, Any]) -> Optional[Mapping[str, Any]]:
+    """Get the first entry of a playlist, or the info itself if it's a single video"""
+    if info.get("_type") == "playlist":
+        return next((entry for entry in info.get("entries") or () if entry), None)
+    return info
+
+
+def _playlist_entries(info) -> list:
+    if info is None:
+        return []
+    if info.get("_type") in ("playlist", "multi_video"):
+        return [entry for entry in info.get("entries") or () if entry is not None]
+    return [info]
+
+
+def _requested_entry(
+    entries: Sequence[Mapping[str, Any]], url: str
+) -> Mapping[str, Any]:
+    """Get the playlist entry a URL also points to, e.g. the video of a YouTube watch link with a
+    list, otherwise the first entry"""
+    values = {value for _name, value in parse_qsl(urlsplit(url).query)}
+    for entry in entries:
+        if entry.get("id") in values:
+            return entry
+    return entries[0]
+
+
 def _get_stream_urls(info):
     video = None
     audio = None
@@ -152,69 +504,178 @@ def _get_stream_urls(info):
     return (video, audio)
 
 
-class FetchVideoThread(Thread):
-    """Thread to fetch video info with ytdl"""
+class FetchVideoJob:
+    """Job to fetch video info with ytdl, run by a FetchScheduler worker"""
 
+    # pylint: disable-next=too-many-arguments
     def __init__(
         self,
-        ytdl: yt_dlp.YoutubeDL,
+        ytdl: "yt_dlp.YoutubeDL",
         thumbnails: ThumbnailCache,
         queue: VideoQueue,
         item: VideoQueueItem,
+        play_next: bool = False,
+        *,
+        import_playlist: bool = False,
     ):
-        super().__init__(daemon=True)
         self._ytdl = ytdl
         self._thumbs = thumbnails
         self._queue = queue
         self._item = item
+        self._play_next = play_next
+        self._import_playlist = import_playlist
         self._is_in_queue = False
         self._has_started = False
+        self._is_done = False
         self._error = None
+        # Video keys reserved by this fetch, released if it fails
+        self._keys = [] if item.key is None else [item.key]
 
     def run(self):
+        """Fetch the video and add it to the queue"""
         self._has_started = True
         try:
-            self._do_fetch()
+            with TRACER.trace("fetch", self._item.url):
+                self._do_fetch()
         # pylint: disable=bare-except
         except:
             self._error = sys.exception()
-            traceback.print_exception(self._error)
+            if not self._is_in_queue:
+                for key in self._keys:
+                    self._queue.release(key)
+            if not isinstance(self._error, DuplicateVideoException):
+                traceback.print_exception(self._error)
+            self._queue.notify("error", url=self._item.url, error=self._error)
+            FETCHES.inc(
+                "duplicate"
+                if isinstance(self._error, DuplicateVideoException)
+                else "error"
+            )
+        else:
+            FETCHES.inc("success")
+            STARTUP.mark(FIRST_LINK)
+        finally:
+            self._is_done = True
 
     def _do_fetch(self):
-        # Fetch video info
-        info = self._ytdl.extract_info(self._item.url, download=False)
-
-        if info is None:
+        # Fetch video info, playlist entries are only extracted flat
+        with _stage("extract"):
+            info = self._ytdl.extract_info(self._item.url, download=False)
+        entries = _playlist_entries(info)
+        if len(entries) > 1:
+            if self._import_playlist:
+                self._import_entries(entries)
+                return
+            entries = [_requested_entry(entries, self._item.url)]
+        if len(entries) == 0:
             raise VideoNotFoundException(
                 f'Unable to find a video that matches "{self._item.url}"'
             )
 
-        if info.get("_type") == "playlist":
-            info = info.get("entries")[0]
-
-        self._item.title = info.get("fulltitle")
-        self._item.uploader = info.get("uploader")
-        self._item.duration = info.get("duration")
-        self._item.duration_str = info.get("duration_string")
+        info = entries[0]
+        if info.get("_type") == "url":
+            # Search result or single entry playlist, extract the video itself
+            with _stage("extract"):
+                info = self._ytdl.extract_info(info["url"], download=False)
+            if info is None:
+                raise VideoNotFoundException(
+                    f'Unable to find a video that matches "{self._item.url}"'
+                )
+
+        # The URL may not have shown which video it was, check again now it's known
+        key = info_video_key(info)
+        if key is not None and key not in self._keys:
+            if not self._queue.reserve(key):
+                raise DuplicateVideoException(
+                    f'"{info.get("fulltitle")}" is already in the queue'
+                )
+            self._keys.append(key)
+            # Kept on the item so it's released if the item is removed
+            self._item.video_key = key
+
+        self._item.update(
+            webpage_url=info.get("webpage_url"),
+            title=info.get("fulltitle"),
+            uploader=info.get("uploader"),
+            duration=info.get("duration"),
+            duration_str=info.get("duration_string"),
+        )
 
         video, audio = _get_stream_urls(info)
         if video is not None:
             self._item.video_url = video.get("url")
+            self._item.resolved_at = time()
         if audio is not None:
             self._item.audio_url = audio.get("url")
         # TODO: Add other metadata added by ytdl_hook e.g. subtitles, chapters, bitrate
 
         # Append before fetching thumbnail as that requires another request and is not required to
         # play the video
-        self._queue.append(self._item)
+        with _stage("append"):
+            self._queue.append(self._item, self._play_next)
         self._is_in_queue = True
 
         # Fetch video thumbnail (as base64)
         thumbnail = _choose_thumbnail(info.get("thumbnails"))
         if thumbnail is not None:
-            self._item.thumbnail = self._thumbs.cache_thumbnail(thumbnail.url)
-            self._item.thumbnail_width = thumbnail.width
-            self._item.thumbnail_height = thumbnail.height
+            self._set_thumbnail(self._item, thumbnail)
+
+    def _import_entries(self, entries: Sequence[Mapping[str, Any]]):
+        """Queue placeholder items from flat playlist entries, their streams are resolved when
+        they near playback by the StreamResolver or by mpv"""
+        # Already imported to extract the playlist
+        # pylint: disable-next=import-outside-toplevel
+        from yt_dlp.utils import formatSeconds
+
+        items = []
+        thumbnails = []
+        for entry in entries:
+            url = entry.get("url") or entry.get("webpage_url")
+            if url is None:
+                continue
+            key = info_video_key(entry) or canonical_key(url)
+            if not self._queue.reserve(key):
+                continue  # Already queued
+            self._keys.append(key)
+            duration = entry.get("duration")
+            items.append(
+                VideoQueueItem(
+                    url,
+                    key,
+                    title=entry.get("title"),
+                    uploader=entry.get("uploader") or entry.get("channel"),
+                    duration=duration,
+                    duration_str=None if duration is None else formatSeconds(duration),
+                )
+            )
+            thumbnails.append(_choose_thumbnail(entry.get("thumbnails")))
+
+        with _stage("append"):
+            self._queue.extend(items, self._play_next)
+        # The playlist itself isn't queued, so it can be imported again for new entries
+        if self._item.key is not None:
+            self._queue.release(self._item.key)
+        self._is_in_queue = True
+        # Entries were appended under their own URLs, so say the playlist's fetch is done
+        self._queue.notify("imported", url=self._item.url)
+        print("Imported", len(items), "of", len(entries), "playlist entries")
+
+        # Thumbnails one at a time in this job, so a big playlist only keeps one worker busy
+        for item, thumbnail in zip(items, thumbnails):
+            if thumbnail is not None:
+                self._set_thumbnail(item, thumbnail)
+
+    def _set_thumbnail(self, item: VideoQueueItem, thumbnail: _ThumbURL):
+        with _stage("thumbnail"):
+            path = self._thumbs.cache_thumbnail(thumbnail.url)
+        self._queue.update_item(
+            item,
+            thumbnail=path,
+            thumbnail_url=thumbnail.url,
+            thumbnail_srcset=self._thumbs.srcset(path, thumbnail.width),
+            thumbnail_width=thumbnail.width,
+            thumbnail_height=thumbnail.height,
+        )
 
     def url(self) -> str:
         """Get the URL being fetched"""
@@ -228,17 +689,10 @@ class FetchVideoThread(Thread):
         """Whether the fetch has been started"""
         return self._has_started
 
+    def is_done(self) -> bool:
+        """Whether the fetch has finished (successfully or not)"""
+        return self._is_done
+
     def get_error(self) -> Optional[Exception]:
-        """Get the error this thread encountered"""
+        """Get the error this job encountered"""
         return self._error
-
-
-def _fetch_video(
-    ytdl: yt_dlp.YoutubeDL, thumbnails: ThumbnailCache, queue: VideoQueue, url: str
-) -> FetchVideoThread:
-    item = VideoQueueItem(url)
-
-    thread = FetchVideoThread(ytdl, thumbnails, queue, item)
-    thread.start()
-
-    return thread
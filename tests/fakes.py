@@ -0,0 +1,64 @@
+"""Stand-ins for mpv and yt-dlp used by the tests"""
+
+from collections.abc import Mapping
+from typing import Any
+
+VIDEO_URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+# Info of VIDEO_URL as cached, without stream URLs
+VIDEO_INFO = {
+    "id": "dQw4w9WgXcQ",
+    "extractor_key": "Youtube",
+    "webpage_url": VIDEO_URL,
+    "fulltitle": "Never Gonna Give You Up",
+    "duration": 213,
+}
+
+
+class FakePlayer:
+    """Playlist parts of mpv.MPV, records the options each file was loaded with"""
+
+    def __init__(self):
+        self.playlist_pos = -1
+        self.pause = False
+        self.playlist: list[dict] = []
+        self.loaded: list[tuple[str, dict]] = []
+
+    def observe_property(self, _name: str, _handler):
+        """The playlist only changes through the queue, so never observed"""
+
+    def loadfile(self, filename: str, mode: str = "replace", **options):
+        """Append to the playlist"""
+        assert mode.startswith("append")
+        self.playlist.append({"filename": filename})
+        self.loaded.append((filename, options))
+
+    def playlist_move(self, index1: int, index2: int):
+        """Move entry at index1 to before the entry at index2"""
+        if not 0 <= index1 < len(self.playlist):
+            raise SystemError("Error running mpv command")
+        entry = self.playlist[index1]
+        self.playlist.insert(index2, entry)
+        self.playlist.pop(index1 + 1 if index2 < index1 else index1)
+
+    def playlist_remove(self, index: int):
+        """Remove the entry at index"""
+        self.playlist.pop(index)
+
+    def filenames(self) -> list[str]:
+        """Get the filename of each playlist entry"""
+        return [entry["filename"] for entry in self.playlist]
+
+
+# pylint: disable-next=too-few-public-methods
+class FakeYoutubeDL:
+    """Answers extract_info from a map of URL to info, recording the URLs extracted"""
+
+    def __init__(self, infos: Mapping[str, Mapping[str, Any]]):
+        self.infos = infos
+        self.extracted: list[str] = []
+
+    def extract_info(self, url: str, download: bool = False, **_kwargs):
+        """Get the info of a URL"""
+        assert not download
+        self.extracted.append(url)
+        return self.infos.get(url)
@@ -0,0 +1,57 @@
+"""Tests of the asyncio HTTP server"""
+
+import http.client
+import socket
+import unittest
+from time import monotonic, sleep
+
+from friends_queue.async_server import AsyncHTTPThread, BufferedHandler
+from friends_queue.event_stream import EventStream
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _get(port: int, path: str) -> tuple[int, bytes]:
+    """Request a path, retrying until the server is listening, returns the status and body"""
+    deadline = monotonic() + 5
+    while True:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        try:
+            connection.request("GET", path)
+            response = connection.getresponse()
+            return (response.status, response.read())
+        except ConnectionRefusedError:
+            if monotonic() > deadline:
+                raise
+            sleep(0.05)
+        finally:
+            connection.close()
+
+
+def _handle_get(handler: BufferedHandler):
+    handler.send_response(200)
+    handler.send_header("Content-Type", "text/plain")
+    handler.wfile.write(bytes(handler.path, "utf-8"))
+
+
+class AsyncHTTPThreadTest(unittest.TestCase):
+    """Starting, serving and shutting down the server"""
+
+    def test_start_serve_shutdown(self):
+        """A started server answers requests and its thread ends on shutdown"""
+        port = _free_port()
+        server = AsyncHTTPThread(("127.0.0.1", port), _handle_get, EventStream(), 2)
+        server.start()
+        try:
+            self.assertEqual(_get(port, "/hello"), (200, b"/hello"))
+        finally:
+            server.shutdown()
+        self.assertFalse(server.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Tests of canonical video keys"""
+
+import unittest
+
+from friends_queue.canonical import canonical_key, load_extractors, normalise_url
+
+WATCH = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+MIX = "RDdQw4w9WgXcQ"
+
+
+class NormaliseURLTest(unittest.TestCase):
+    """Normalising parts of URLs that don't change what they point to"""
+
+    def test_ignored_parts_removed(self):
+        """Scheme, subdomain, fragment, tracking and start time are normalised"""
+        self.assertEqual(
+            normalise_url("http://m.example.com/video/?utm_source=x&b=2&a=1&t=30#top"),
+            "https://example.com/video?a=1&b=2",
+        )
+
+    def test_search_unchanged(self):
+        """Text that isn't a URL is kept as is"""
+        self.assertEqual(normalise_url("  never gonna  "), "never gonna")
+
+
+class CanonicalKeyTest(unittest.TestCase):
+    """Keys shared by every URL of a video"""
+
+    @classmethod
+    def setUpClass(cls):
+        load_extractors()
+
+    def test_video_urls_share_key(self):
+        """Short links, start times and tracking parameters give the same key"""
+        self.assertEqual(canonical_key(WATCH), "Youtube:dQw4w9WgXcQ")
+        self.assertEqual(
+            canonical_key("https://youtu.be/dQw4w9WgXcQ?t=42"), canonical_key(WATCH)
+        )
+        self.assertEqual(canonical_key(WATCH + "&si=abc"), canonical_key(WATCH))
+
+    def test_videos_from_same_list_differ(self):
+        """Videos played from the same playlist are keyed on the video, not the playlist"""
+        first = canonical_key(WATCH + "&list=" + MIX)
+        second = canonical_key(
+            "https://www.youtube.com/watch?v=9bZkp7q19f0&list={}&index=2".format(MIX)
+        )
+        self.assertEqual(first, "Youtube:dQw4w9WgXcQ")
+        self.assertEqual(second, "Youtube:9bZkp7q19f0")
+
+    def test_playlist_import_keyed_on_playlist(self):
+        """Importing a playlist from a video in it is keyed on the playlist"""
+        key = "YoutubeTab:" + MIX
+        self.assertEqual(canonical_key(WATCH + "&list=" + MIX, playlist=True), key)
+        self.assertEqual(
+            canonical_key("https://www.youtube.com/playlist?list=" + MIX), key
+        )
+
+    def test_search_keyed_on_text(self):
+        """Search text is keyed on the normalised text"""
+        self.assertEqual(canonical_key(" never gonna "), "url:never gonna")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+"""Tests of the Fenwick tree of prefix sums"""
+
+import random
+import unittest
+
+from friends_queue.fenwick import FenwickTree
+
+
+class FenwickTreeTest(unittest.TestCase):
+    """Prefix sums match summing the values directly"""
+
+    def _check(self, tree: FenwickTree, values: list[float]):
+        self.assertEqual(len(tree), len(values))
+        for count in range(len(values) + 1):
+            self.assertEqual(tree.prefix_sum(count), sum(values[:count]))
+        self.assertEqual(tree.total(), sum(values))
+
+    def test_empty(self):
+        """An empty tree sums to 0"""
+        tree = FenwickTree()
+        self._check(tree, [])
+        self.assertEqual(tree.prefix_sum(5), 0)
+
+    def test_built(self):
+        """A tree built from values has their prefix sums"""
+        values = list(range(1, 18))
+        tree = FenwickTree(values)
+        self._check(tree, values)
+        self.assertEqual(tree[4], 5)
+
+    def test_appended(self):
+        """Appending one at a time gives the same sums as building"""
+        values = [3, 0, 7, 1, 9, 2, 8, 4, 6, 5, 10, 12, 11]
+        tree = FenwickTree()
+        for i, value in enumerate(values):
+            tree.append(value)
+            self._check(tree, values[: i + 1])
+
+    def test_set(self):
+        """Changing values updates every sum including them"""
+        values = [5] * 10
+        tree = FenwickTree(values)
+        for index, value in ((0, 1), (9, 0), (4, 12), (7, 3)):
+            tree.set(index, value)
+            values[index] = value
+            self._check(tree, values)
+
+    def test_random_changes(self):
+        """Random appends and sets match a list"""
+        rng = random.Random(0)
+        values = []
+        tree = FenwickTree()
+        for _ in range(200):
+            if len(values) == 0 or rng.random() < 0.4:
+                value = rng.randint(0, 600)
+                values.append(value)
+                tree.append(value)
+            else:
+                index = rng.randrange(len(values))
+                values[index] = rng.randint(0, 600)
+                tree.set(index, values[index])
+        self._check(tree, values)
+
+    def test_count_past_end(self):
+        """Counts past the end sum every value"""
+        tree = FenwickTree([1, 2, 3])
+        self.assertEqual(tree.prefix_sum(10), 6)
+
+
+if __name__ == "__main__":
+    unittest.main()
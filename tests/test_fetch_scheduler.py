@@ -0,0 +1,77 @@
+"""Tests of the fetch worker pool"""
+
+import threading
+import unittest
+
+from friends_queue.fetch_scheduler import FetchScheduler
+
+TIMEOUT = 5
+
+
+class FetchSchedulerTest(unittest.TestCase):
+    """Running jobs on a fixed number of workers"""
+
+    def setUp(self):
+        self.scheduler = FetchScheduler(workers=1)
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.order = []
+        self.done = threading.Semaphore(0)
+
+    def tearDown(self):
+        # Let any blocked worker finish
+        self.release.set()
+
+    def _block(self):
+        """Job keeping the only worker busy until released"""
+        self.started.set()
+        self.release.wait(TIMEOUT)
+
+    def _job(self, name: str):
+        def job():
+            self.order.append(name)
+            self.done.release()
+
+        return job
+
+    def _wait_for(self, count: int):
+        for _ in range(count):
+            # pylint: disable-next=consider-using-with
+            self.assertTrue(self.done.acquire(timeout=TIMEOUT))
+
+    def test_priority_jobs_run_first(self):
+        """Priority jobs jump ahead of waiting jobs, each kind runs in submitted order"""
+        self.scheduler.submit(self._block)
+        self.assertTrue(self.started.wait(TIMEOUT))
+        self.scheduler.submit(self._job("first"))
+        self.scheduler.submit(self._job("second"))
+        self.scheduler.submit(self._job("next"), priority=True)
+        self.scheduler.submit(self._job("then"), priority=True)
+        self.release.set()
+        self._wait_for(4)
+        self.assertEqual(self.order, ["next", "then", "first", "second"])
+
+    def test_stats(self):
+        """Stats count waiting jobs and busy workers"""
+        self.scheduler.submit(self._block)
+        self.assertTrue(self.started.wait(TIMEOUT))
+        self.scheduler.submit(self._job("waiting"))
+        stats = self.scheduler.stats()
+        self.assertEqual((stats.backlog, stats.busy, stats.workers), (1, 1, 1))
+        self.release.set()
+        self._wait_for(1)
+
+    def test_failing_job_keeps_worker(self):
+        """A job raising doesn't stop the worker running later jobs"""
+
+        def fail():
+            raise ValueError("Expected by the test")
+
+        self.scheduler.submit(fail)
+        self.scheduler.submit(self._job("after"))
+        self._wait_for(1)
+        self.assertEqual(self.order, ["after"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""Tests of rendering the queue"""
+
+import unittest
+from io import BytesIO
+
+from fakes import FakePlayer
+from friends_queue.generate import generate_page_queue
+from friends_queue.player_state import PlayerStateSnapshot
+from friends_queue.types import Config, RequestState, State
+from friends_queue.video_queue import VideoQueue, VideoQueueItem
+
+WINDOW = 10
+
+
+class GeneratePageQueueTest(unittest.TestCase):
+    """Rendering a window of the queue around the current item"""
+
+    def setUp(self):
+        player = FakePlayer()
+        queue = VideoQueue(player, None, None, None)
+        for i in range(50):
+            queue.append(VideoQueueItem("https://example.com/{}".format(i)))
+        self.player_state = PlayerStateSnapshot(playlist_pos=30)
+        self.state = State(
+            Config(queue_window=WINDOW),
+            player,
+            self.player_state,
+            None,
+            None,
+            None,
+            queue,
+            None,
+            None,
+        )
+
+    def _render(self, **options) -> str:
+        wfile = BytesIO()
+        generate_page_queue(wfile, self.state, RequestState(**options))
+        return wfile.getvalue().decode("utf-8")
+
+    def _positions(self, page: str) -> list[int]:
+        return [i for i in range(50) if 'name="pos" value="{}"'.format(i) in page]
+
+    def test_window_from_before_current(self):
+        """Skipped items are hidden, starting one before the current item"""
+        page = self._render()
+        self.assertEqual(self._positions(page), list(range(29, 29 + WINDOW)))
+        self.assertNotIn('type="hidden"', page)
+
+    def test_show_skipped_keeps_current(self):
+        """Showing skipped items still reaches as far past the current item"""
+        page = self._render(show_skipped_items=True)
+        self.assertEqual(self._positions(page), list(range(29 + WINDOW)))
+
+    def test_show_more_keeps_skipped_shown(self):
+        """Showing more without JS still submits show_skipped"""
+        page = self._render(show_skipped_items=True)
+        hidden = page.index('<input type="hidden" name="show_skipped" value="1">')
+        # Before the button hiding them, whose value is submitted after and wins
+        self.assertLess(hidden, page.index("Hide previous"))
+        self.assertIn('name="queue_end" value="{}"'.format(29 + 2 * WINDOW), page)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Tests of restoring the queue from the journal"""
+
+import os.path
+import tempfile
+import unittest
+
+from fakes import VIDEO_URL, FakePlayer
+from friends_queue.journal import JOURNAL_FILE, QueueJournal
+from friends_queue.player_state import PlayerStateSnapshot
+from friends_queue.thumbnail_cache import ThumbnailCache
+from friends_queue.video_queue import VideoQueue, VideoQueueItem
+
+OTHER_URL = "https://www.youtube.com/watch?v=9bZkp7q19f0"
+
+
+class QueueJournalTest(unittest.TestCase):
+    """Recording queue changes and replaying them after a restart"""
+
+    def setUp(self):
+        # pylint: disable-next=consider-using-with
+        self.directory = tempfile.TemporaryDirectory()
+        self.thumbnails = ThumbnailCache(self.directory.name, variant_widths=())
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _record(self, compact_every: int) -> QueueJournal:
+        """Record a search, a link, a title change, a move and the playback position"""
+        journal = QueueJournal(self.directory.name, compact_every)
+        queue = VideoQueue(FakePlayer(), None, None, None)
+        player_state = PlayerStateSnapshot()
+        journal.record(queue, player_state)
+
+        search = VideoQueueItem(
+            "never gonna", "url:never gonna", "Youtube:dQw4w9WgXcQ", VIDEO_URL
+        )
+        # Stream URLs expire so aren't kept
+        search.video_url = "https://stream.example.com/video"
+        queue.append(search)
+        queue.append(VideoQueueItem(OTHER_URL, "Youtube:9bZkp7q19f0", None, OTHER_URL))
+        queue.update_item(search, title="Never Gonna Give You Up")
+        queue.move(1, 0)
+        # pylint: disable=protected-access
+        player_state._on_change("playlist-pos", 1)
+        player_state._on_change("time-pos", 12.5)
+        return journal
+
+    def _restore(self) -> tuple[VideoQueue, FakePlayer]:
+        player = FakePlayer()
+        queue = VideoQueue(player, None, None, None)
+        QueueJournal(self.directory.name).restore(queue, self.thumbnails)
+        return queue, player
+
+    def _check_restored(self):
+        queue, player = self._restore()
+        self.assertEqual([item.url for item in queue], [OTHER_URL, "never gonna"])
+        self.assertEqual(queue[1].title, "Never Gonna Give You Up")
+        self.assertIsNone(queue[1].video_url)
+        # The search is loaded from the page it resolved to, not searched again by mpv
+        self.assertEqual(player.filenames(), [OTHER_URL, VIDEO_URL])
+        self.assertEqual(player.loaded[1][1], {"start": "12.5"})
+        self.assertEqual(player.playlist_pos, 1)
+        self.assertTrue(player.pause)
+
+    def test_journal_replayed(self):
+        """Changes written to the journal are applied to the empty snapshot"""
+        self._record(compact_every=1000).close()
+        self._check_restored()
+
+    def test_snapshot_round_trip(self):
+        """Changes compacted into the snapshot are restored the same"""
+        journal = self._record(compact_every=1000)
+        journal.compact()
+        journal.close()
+        with open(
+            os.path.join(self.directory.name, JOURNAL_FILE), "r", encoding="utf-8"
+        ) as file:
+            self.assertEqual(file.read(), "")
+        self._check_restored()
+
+    def test_compacting_while_recording(self):
+        """Records written after frequent compactions are replayed after the snapshot"""
+        self._record(compact_every=2).close()
+        self._check_restored()
+
+    def test_partial_record_skipped(self):
+        """A record partly written when the process stopped is ignored"""
+        self._record(compact_every=1000).close()
+        with open(
+            os.path.join(self.directory.name, JOURNAL_FILE), "a", encoding="utf-8"
+        ) as file:
+            file.write('{"op":"append","item":{"url":')
+        self._check_restored()
+
+
+if __name__ == "__main__":
+    unittest.main()
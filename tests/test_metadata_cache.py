@@ -0,0 +1,94 @@
+"""Tests of the video metadata cache"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from fakes import VIDEO_INFO, VIDEO_URL, FakeYoutubeDL
+from friends_queue.canonical import load_extractors
+from friends_queue.metadata_cache import MetadataCache
+
+SHORT_URL = "https://youtu.be/dQw4w9WgXcQ"
+EXTRACTED_INFO = dict(
+    VIDEO_INFO,
+    requested_formats=[{"url": "https://video", "video_ext": "mp4"}],
+    formats=[{"format_id": "18", "ext": "mp4", "width": 640, "url": "https://expires"}],
+)
+
+
+class MetadataCacheTest(unittest.TestCase):
+    """Answering extract_info from cache"""
+
+    @classmethod
+    def setUpClass(cls):
+        load_extractors()
+
+    def setUp(self):
+        # pylint: disable-next=consider-using-with
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.ytdl = FakeYoutubeDL(
+            {VIDEO_URL: EXTRACTED_INFO, SHORT_URL: EXTRACTED_INFO}
+        )
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def test_second_extract_cached(self):
+        """A video is extracted once, then answered from cache for any URL of it"""
+        cache = MetadataCache(self.cache_dir.name, self.ytdl)
+        self.assertIs(cache.extract_info(VIDEO_URL), EXTRACTED_INFO)
+        info = cache.extract_info(SHORT_URL)
+        self.assertEqual(self.ytdl.extracted, [VIDEO_URL])
+        self.assertEqual(info["fulltitle"], "Never Gonna Give You Up")
+
+    def test_stream_urls_stripped(self):
+        """Stream URLs expire so aren't cached, other format fields are"""
+        cache = MetadataCache(self.cache_dir.name, self.ytdl)
+        cache.put(EXTRACTED_INFO)
+        info = cache.get("Youtube:dQw4w9WgXcQ")
+        self.assertNotIn("requested_formats", info)
+        self.assertEqual(
+            info["formats"], [{"format_id": "18", "ext": "mp4", "width": 640}]
+        )
+
+    def test_expired_extracted_again(self):
+        """Entries older than the TTL are extracted again"""
+        cache = MetadataCache(self.cache_dir.name, self.ytdl, ttl=-1)
+        cache.extract_info(VIDEO_URL)
+        cache.extract_info(VIDEO_URL)
+        self.assertEqual(self.ytdl.extracted, [VIDEO_URL, VIDEO_URL])
+
+    def test_corrupt_entry_ignored(self):
+        """An unreadable entry is treated as missing"""
+        cache = MetadataCache(self.cache_dir.name, self.ytdl)
+        cache.put(EXTRACTED_INFO)
+        for name in os.listdir(self.cache_dir.name):
+            with open(
+                os.path.join(self.cache_dir.name, name), "w", encoding="utf-8"
+            ) as file:
+                file.write('{"key": ')
+        self.assertIsNone(cache.get("Youtube:dQw4w9WgXcQ"))
+
+    def test_playlists_not_cached(self):
+        """Only single videos are cached"""
+        cache = MetadataCache(self.cache_dir.name, self.ytdl)
+        cache.put({"_type": "playlist", "id": "PL", "extractor_key": "YoutubeTab"})
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+    def test_entry_checks_key(self):
+        """An entry whose key doesn't match, e.g. a hash collision, isn't used"""
+        cache = MetadataCache(self.cache_dir.name, self.ytdl)
+        cache.put(EXTRACTED_INFO)
+        [name] = os.listdir(self.cache_dir.name)
+        path = os.path.join(self.cache_dir.name, name)
+        with open(path, "r", encoding="utf-8") as file:
+            entry = json.load(file)
+        entry["key"] = "Youtube:other"
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        self.assertIsNone(cache.get("Youtube:dQw4w9WgXcQ"))
+
+
+if __name__ == "__main__":
+    unittest.main()
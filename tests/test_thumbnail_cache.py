@@ -0,0 +1,123 @@
+"""Tests of serving cached thumbnails"""
+
+import tempfile
+import threading
+import unittest
+from email.message import Message
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from unittest import mock
+
+from friends_queue import thumbnail_cache
+from friends_queue.thumbnail_cache import THUMBNAIL_PREFIX, ThumbnailCache
+
+IMAGE = bytes(range(256)) * 20
+
+
+class _OriginHandler(BaseHTTPRequestHandler):
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve an image, without its length for /unsized.png, or 404 for any other path"""
+        if self.path not in ("/image.png", "/unsized.png"):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        if self.path == "/image.png":
+            self.send_header("Content-Length", len(IMAGE))
+        else:
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(IMAGE)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        """Quiet"""
+
+
+class _Handler:
+    """Records a response like BaseHTTPRequestHandler would send it"""
+
+    def __init__(self):
+        self.headers = Message()
+        self.wfile = BytesIO()
+        self.status = None
+        self.sent_headers = {}
+
+    def send_response(self, code: int):
+        """Record status"""
+        self.status = code
+
+    def send_header(self, keyword: str, value):
+        """Record header"""
+        self.sent_headers[keyword] = value
+
+    def end_headers(self):
+        """Headers aren't checked"""
+
+    def send_error(self, code: int):
+        """Record status"""
+        self.status = code
+
+    def date_time_string(self, timestamp: float = None) -> str:
+        """Format a timestamp"""
+        return BaseHTTPRequestHandler.date_time_string(self, timestamp)
+
+
+class ThumbnailCacheTest(unittest.TestCase):
+    """Serving thumbnails without sendfile"""
+
+    def setUp(self):
+        self.origin = ThreadingHTTPServer(("127.0.0.1", 0), _OriginHandler)
+        threading.Thread(target=self.origin.serve_forever, daemon=True).start()
+        self.base = "http://127.0.0.1:{}".format(self.origin.server_address[1])
+        # pylint: disable-next=consider-using-with
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.cache = ThumbnailCache(
+            self.cache_dir.name, use_sendfile=False, variant_widths=()
+        )
+
+    def tearDown(self):
+        self.origin.shutdown()
+        self.origin.server_close()
+        self.cache.close()
+        self.cache_dir.cleanup()
+
+    def _get(self, thumb_path: str) -> _Handler:
+        handler = _Handler()
+        self.cache.handle_request(handler, thumb_path[1:])
+        return handler
+
+    def test_repeated_requests_send_whole_image(self):
+        """Every response has the whole image, not just the first"""
+        thumb_path = self.cache.cache_thumbnail(self.base + "/image.png")
+        for _ in range(3):
+            handler = self._get(thumb_path)
+            self.assertEqual(handler.status, 200)
+            self.assertEqual(handler.wfile.getvalue(), IMAGE)
+
+    def test_download_without_length(self):
+        """An image sent without a Content-Length is served with the length written"""
+        thumb_path = self.cache.cache_thumbnail(self.base + "/unsized.png")
+        handler = self._get(thumb_path)
+        self.assertEqual(handler.sent_headers["Content-Length"], len(IMAGE))
+        self.assertEqual(handler.wfile.getvalue(), IMAGE)
+
+    def test_least_recent_urls_forgotten(self):
+        """Only the most recently used source URLs are kept"""
+        with mock.patch.object(thumbnail_cache, "MAX_URLS", 2):
+            first = self.cache.register(self.base + "/missing.png?1")
+            second = self.cache.register(self.base + "/missing.png?2")
+            # Used, so kept over the second
+            self.assertEqual(self._get(first).status, 502)
+            self.cache.register(self.base + "/missing.png?3")
+        self.assertEqual(self._get(first).status, 502)
+        self.assertEqual(self._get(second).status, 404)
+
+    def test_failed_download_is_bad_gateway(self):
+        """A thumbnail that can't be downloaded again gets an error response"""
+        thumb_path = self.cache.register(self.base + "/missing.png")
+        self.assertTrue(thumb_path.startswith("." + THUMBNAIL_PREFIX))
+        self.assertEqual(self._get(thumb_path).status, 502)
+
+
+if __name__ == "__main__":
+    unittest.main()
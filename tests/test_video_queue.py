@@ -0,0 +1,152 @@
+"""Tests of fetching videos into the queue"""
+
+import tempfile
+import unittest
+
+from fakes import VIDEO_INFO, VIDEO_URL, FakePlayer, FakeYoutubeDL
+from friends_queue.canonical import load_extractors
+from friends_queue.metadata_cache import MetadataCache
+from friends_queue.video_queue import FetchVideoJob, VideoQueue, VideoQueueItem
+
+SEARCH = "never gonna give you up"
+SEARCH_INFO = {
+    "_type": "playlist",
+    "entries": [{"_type": "url", "ie_key": "Youtube", "url": VIDEO_URL}],
+}
+
+
+class FetchVideoJobTest(unittest.TestCase):
+    """Fetching a link and appending it to mpv's playlist"""
+
+    @classmethod
+    def setUpClass(cls):
+        load_extractors()
+
+    def setUp(self):
+        # pylint: disable-next=consider-using-with
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.player = FakePlayer()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def _fetch(self, ytdl, url: str) -> VideoQueue:
+        queue = VideoQueue(self.player, ytdl, None, None)
+        job = FetchVideoJob(ytdl, None, queue, VideoQueueItem(url))
+        job.run()
+        self.assertIsNone(job.get_error())
+        return queue
+
+    def test_cached_search_hit_loads_page(self):
+        """A search answered from the metadata cache has no stream URLs, so mpv gets the video's
+        page rather than the search text"""
+        ytdl = FakeYoutubeDL({SEARCH: SEARCH_INFO})
+        cache = MetadataCache(self.cache_dir.name, ytdl)
+        cache.put(VIDEO_INFO)
+
+        queue = self._fetch(cache, SEARCH)
+        self.assertEqual(ytdl.extracted, [SEARCH])
+        self.assertEqual(queue[0].webpage_url, VIDEO_URL)
+        self.assertIsNone(queue[0].video_url)
+        self.assertEqual(self.player.filenames(), [VIDEO_URL])
+
+    def test_streams_are_loaded(self):
+        """Separate video and audio streams are loaded instead of the page"""
+        info = dict(
+            VIDEO_INFO,
+            requested_formats=[
+                {"url": "https://video", "video_ext": "mp4", "audio_ext": "none"},
+                {"url": "https://audio", "video_ext": "none", "audio_ext": "m4a"},
+            ],
+        )
+        self._fetch(FakeYoutubeDL({VIDEO_URL: info}), VIDEO_URL)
+        self.assertEqual(
+            self.player.loaded, [("https://video", {"audio_file": "https://audio"})]
+        )
+
+
+# pylint: disable-next=too-few-public-methods
+class _InlineScheduler:
+    """Runs jobs as soon as they are submitted"""
+
+    def submit(self, job, priority: bool = False):
+        """Run job"""
+        assert isinstance(priority, bool)
+        job()
+
+
+class AppendURLTest(unittest.TestCase):
+    """Queueing a link to be fetched"""
+
+    @classmethod
+    def setUpClass(cls):
+        load_extractors()
+
+    def test_fetch_published_before_job_runs(self):
+        """Listeners see the fetch start before anything the job publishes"""
+        ytdl = FakeYoutubeDL({VIDEO_URL: VIDEO_INFO})
+        queue = VideoQueue(FakePlayer(), ytdl, None, _InlineScheduler())
+        events = []
+        queue.add_listener(lambda event, **_data: events.append(event))
+        queue.append_url(VIDEO_URL)
+        self.assertEqual(events, ["fetch", "append"])
+
+    def test_import_finishes_playlist_fetch(self):
+        """Importing a playlist appends its entries then says the playlist's fetch is done"""
+        playlist_url = "https://www.youtube.com/playlist?list=PLtest"
+        entries = [
+            {"_type": "url", "ie_key": "Youtube", "id": video_id, "url": url}
+            for video_id, url in (
+                ("dQw4w9WgXcQ", VIDEO_URL),
+                ("9bZkp7q19f0", "https://www.youtube.com/watch?v=9bZkp7q19f0"),
+            )
+        ]
+        ytdl = FakeYoutubeDL({playlist_url: {"_type": "playlist", "entries": entries}})
+        player = FakePlayer()
+        queue = VideoQueue(player, ytdl, None, _InlineScheduler())
+        events = []
+        queue.add_listener(
+            lambda event, **data: events.append((event, data.get("url")))
+        )
+        queue.append_url(playlist_url, import_playlist=True)
+        self.assertEqual(
+            [event for event, _url in events], ["fetch", "append", "append", "imported"]
+        )
+        self.assertEqual(events[-1], ("imported", playlist_url))
+        self.assertEqual(player.filenames(), [entry["url"] for entry in entries])
+        # The playlist itself isn't kept as queued, so can be imported again
+        self.assertFalse(queue.has_been_queued(playlist_url))
+
+
+class RefreshStreamsTest(unittest.TestCase):
+    """Swapping fresh stream URLs into mpv's playlist"""
+
+    def setUp(self):
+        self.player = FakePlayer()
+        self.queue = VideoQueue(self.player, None, None, None)
+        self.item = VideoQueueItem(VIDEO_URL, webpage_url=VIDEO_URL)
+        self.queue.append(VideoQueueItem("https://example.com/first"))
+        self.queue.append(self.item)
+        self.player.playlist_pos = 0
+
+    def test_no_streams_still_resolved(self):
+        """Info without separate streams marks the item resolved without swapping it"""
+        self.assertFalse(self.queue.refresh_streams(self.item, VIDEO_INFO))
+        self.assertIsNotNone(self.item.resolved_at)
+        self.assertEqual(self.player.filenames()[1], VIDEO_URL)
+
+    def test_streams_swapped_in_place(self):
+        """Fresh streams replace the item's entry at the same position"""
+        info = dict(
+            VIDEO_INFO,
+            requested_formats=[{"url": "https://video", "video_ext": "mp4"}],
+        )
+        self.assertTrue(self.queue.refresh_streams(self.item, info))
+        self.assertIsNotNone(self.item.resolved_at)
+        self.assertEqual(
+            self.player.filenames(), ["https://example.com/first", "https://video"]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()